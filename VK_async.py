@@ -0,0 +1,963 @@
+import asyncio
+import json
+import random
+import time
+from collections import deque
+
+import aiohttp
+from vk_api.longpoll import DEFAULT_MODE, Event, VkEventType
+
+from VK_bot import VkBot
+from VK_class import (
+    CITY_NOT_FOUND, VK_ERROR_COUNT, VK_REQUEST_SECONDS, HttpException, My_VkApi, VkApiError, VkBatch, VkCircuitOpen,
+    backoff_delay, get_top_likes, get_top_likes_many, retry_decision, vk_error
+)
+from circuit_breaker import breaker_stats, get_breaker
+from db_tools import DB_editor
+from dispatcher import BOT_EVENT_HANDLE_SECONDS, BOT_EVENT_SECONDS, BOT_EVENTS
+from metrics import METRICS_PORT, gauge, start_metrics_server
+from outbox import new_random_id
+from router import CommandRouter
+from rate_limiter import GROUP_TOKEN_RPS, USER_TOKEN_RPS, TokenBucket, get_limiter, limiter_stats
+from sessions import SessionStore
+from tracing import close as close_tracing, configure_from, span, trace
+
+
+class AsyncVkTransport:
+    """
+    Общий асинхронный HTTP-транспорт для запросов к API.
+
+    Держит пул keep-alive соединений aiohttp. Сессия создается при первом
+    запросе, то есть уже внутри работающего цикла событий.
+
+    Параметры:
+        pool_size (int): Максимальное число одновременно открытых соединений.
+        timeout (float): Таймаут запроса по умолчанию в секундах.
+        gzip (bool): Запрашивать ли сжатые ответы.
+    """
+
+    def __init__(self, pool_size: int = 100, timeout: float = 10, gzip: bool = True) -> None:
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.gzip = gzip
+        self.session = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        """Возвращает сессию aiohttp, создавая ее при первом обращении."""
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.pool_size),
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                headers={"Accept-Encoding": "gzip, deflate" if self.gzip else "identity"},
+            )
+        return self.session
+
+    async def request(
+        self, http_method: str, url: str, params: dict = None, data: dict = None, timeout: float = None
+    ) -> tuple[int, str]:
+        """
+        Отправляет запрос через пул соединений.
+
+        Параметры:
+            http_method (str): Метод запроса (GET/POST/...).
+            url (str): Полный адрес запроса.
+            params (dict): Параметры строки запроса.
+            data (dict): Данные формы для отправки в теле запроса.
+            timeout (float): Таймаут для этого запроса, по умолчанию таймаут транспорта.
+
+        Возвращаемое значение:
+            Кортеж (код ответа, текст ответа).
+        """
+        options = {} if timeout is None else {"timeout": aiohttp.ClientTimeout(total=timeout)}
+        async with self._get_session().request(http_method, url, params=params, data=data, **options) as response:
+            return response.status, await response.text()
+
+    async def close(self) -> None:
+        """Закрывает все соединения пула."""
+        if self.session is not None:
+            await self.session.close()
+
+
+class AsyncVkApi:
+    """
+    Асинхронный клиент VK с тем же набором методов, что и My_VkApi.
+
+    Кэш профилей, справочник городов и ограничитель частоты для ключа
+    общие с синхронным клиентом, поэтому оба клиента можно использовать
+    в одном процессе.
+    """
+
+    host = My_VkApi.host
+    search_cap = My_VkApi.search_cap
+    profile_fields = My_VkApi.profile_fields
+    default_profiles = My_VkApi.default_profiles
+    cities = My_VkApi.cities
+    transport = None  # Транспорт по умолчанию, общий для всех клиентов
+    limiter: TokenBucket = None
+    max_retries = My_VkApi.max_retries
+    backoff_base = My_VkApi.backoff_base
+    backoff_cap = My_VkApi.backoff_cap
+
+    def __init__(
+        self,
+        token: str,
+        transport: AsyncVkTransport = None,
+        rps: float = USER_TOKEN_RPS,
+        profiles=None
+    ) -> None:
+        """
+        Параметры:
+            token: Токен доступа для авторизации в API.
+            transport: HTTP-транспорт; по умолчанию общий для всех клиентов пул соединений.
+            rps: Лимит запросов в секунду для токена (3 для пользователя, 20 для сообщества).
+            profiles: Кэш профилей; по умолчанию общий для всех клиентов.
+        """
+        self.params = {"access_token": token, "v": "5.199"}
+        self.user_token = token
+        self.transport = transport or self.default_transport()
+        self.limiter = get_limiter(token, rps)
+        self.profiles = profiles or self.default_profiles
+
+    @classmethod
+    def default_transport(cls) -> AsyncVkTransport:
+        """
+        Возвращает общий транспорт, создавая его при первом обращении.
+
+        Возвращаемое значение:
+            Экземпляр AsyncVkTransport, разделяемый всеми клиентами.
+        """
+        if AsyncVkApi.transport is None:
+            AsyncVkApi.transport = AsyncVkTransport()
+        return AsyncVkApi.transport
+
+    async def _send_request(
+        self,
+        http_method: str,
+        uri_path: str,
+        params: dict = None,
+        data: dict = None,
+        timeout: float = None
+    ) -> dict:
+        """
+        Метод для отправки всех запросов к API.
+
+        Параметры:
+            http_method (str): Метод запроса (GET/POST).
+            uri_path (str): URI API, например, method/users.get.
+            params (dict): Параметры запроса.
+            data (dict): Данные формы для отправки в теле запроса.
+            timeout (float): Таймаут запроса, по умолчанию таймаут транспорта.
+
+        Возвращаемое значение:
+            Ответ от API в формате словаря.
+
+        Исключения:
+            HttpException: Если сервер вернул код ошибки HTTP.
+            VkApiError: Если VK вернул ошибку в теле ответа (временные ошибки сначала повторяются).
+            VkCircuitOpen: Если цепь метода разомкнута.
+            aiohttp.ClientError: Если сетевая ошибка повторилась max_retries раз.
+        """
+        method = uri_path.rsplit("/", 1)[-1]
+        breaker = get_breaker(method)  # Размыкатели общие с синхронным клиентом
+        with span(f"vk {method}", method=method) as current:
+            for attempt in range(self.max_retries + 1):
+                if current is not None:
+                    current.set(attempts=attempt + 1)
+                token = breaker.allow()
+                if token is None:
+                    VK_ERROR_COUNT.inc(method, "circuit_open")
+                    raise VkCircuitOpen(method)
+                # Исход записывается в finally: неожиданное исключение (ответ не в JSON,
+                # отмена задачи) не должно оставить пробный вызов незавершенным
+                success = False
+                try:
+                    if self.limiter is not None:
+                        await self.limiter.acquire_async()  # ждем, не блокируя цикл событий
+                    started = time.perf_counter()
+                    try:
+                        status, text = await self.transport.request(
+                            http_method, f"{self.host}/{uri_path}", params=params, data=data, timeout=timeout
+                        )
+                    finally:
+                        VK_REQUEST_SECONDS.observe(time.perf_counter() - started, method)
+                    if status >= 400:
+                        raise HttpException(status, text)
+                    response = json.loads(text)
+                    if "error" in response:
+                        raise vk_error(response["error"], method)
+                    success = True
+                    return response
+                except (aiohttp.ClientError, asyncio.TimeoutError, HttpException, VkApiError) as e:
+                    success, retry = retry_decision(e, method, attempt, self.max_retries, current)
+                    if not retry:
+                        raise
+                finally:
+                    breaker.record(token, success)
+                await asyncio.sleep(backoff_delay(attempt, self.backoff_base, self.backoff_cap))
+
+    async def _call(self, method: str, params: dict, parser=None):
+        """
+        Выполняет вызов метода API.
+
+        Параметры:
+            method (str): Имя метода, например, users.get.
+            params (dict): Параметры вызова без access_token и версии.
+            parser: Функция обработки ответа.
+
+        Возвращаемое значение:
+            Результат parser или сырой ответ.
+        """
+        response = await self._send_request("GET", f"method/{method}", params={**params, **self.params})
+        return parser(response) if parser else response
+
+    async def execute(self, calls: list[tuple]) -> list[dict]:
+        """
+        Выполняет вызовы пакетами через execute (не больше VkBatch.max_calls за запрос).
+
+        Параметры:
+            calls (list[tuple]): Список пар (метод, параметры).
+
+        Возвращаемое значение:
+            Список ответов вида {"response": ...} или {"error": ...} в порядке вызовов.
+        """
+        results = []
+        for start in range(0, len(calls), VkBatch.max_calls):
+            chunk = calls[start:start + VkBatch.max_calls]
+            response = await self._send_request(
+                "POST", "method/execute", params=self.params, data={"code": VkBatch.code(chunk)}
+            )
+            chunk_results = VkBatch.results(response, len(chunk))
+            # Неполный ответ execute: недостающим вызовам - явная ошибка, чтобы ответы не сдвинулись
+            missing = {"error_code": 0, "error_msg": f"execute returned {len(chunk_results)} results for {len(chunk)} calls"}
+            results.extend(chunk_results[:len(chunk)] + [{"error": missing}] * (len(chunk) - len(chunk_results)))
+        return results
+
+    async def get_user_info(self, user_id: int) -> dict:
+        """
+        Получает полную информацию о пользователе по его идентификатору.
+
+        Параметры:
+            user_id (int): Идентификатор пользователя.
+
+        Возвращаемое значение:
+            Словарь с информацией о пользователе (имя, фамилия, город, возраст, пол).
+        """
+        profiles = await self.get_profiles([user_id])
+        return My_VkApi._parse_user_info(user_id, profiles[user_id])
+
+    async def get_short_user_info(self, user_id: int) -> str:
+        """
+        Получает короткую информацию о пользователе.
+
+        Параметры:
+            user_id (int): Идентификатор пользователя.
+
+        Возвращаемое значение:
+            Строка, содержащая имя и фамилию пользователя.
+        """
+        profile = (await self.get_profiles([user_id]))[user_id]
+        return f"{profile['first_name']} {profile['last_name']}"
+
+    async def get_user_photos(self, user_id: int) -> dict:
+        """
+        Получает все фотографии пользователя.
+
+        Параметры:
+            user_id (int): Идентификатор пользователя.
+
+        Возвращаемое значение:
+            Словарь с информацией о фотографиях пользователя.
+        """
+        return await self._call("photos.get", {"owner_id": user_id, "album_id": "profile", "extended": "1"})
+
+    async def get_candidates(self, user_ids: list[int]) -> dict:
+        """
+        Получает имена и фотографии сразу нескольких пользователей.
+
+        Параметры:
+            user_ids (list[int]): Идентификаторы пользователей.
+
+        Возвращаемое значение:
+            Словарь {user_id: (имя и фамилия, ответ photos.get)}.
+        """
+        profiles = await self.get_profiles(user_ids)
+        user_ids = [user_id for user_id in user_ids if user_id in profiles]
+        photos = await self.execute(
+            [("photos.get", {"owner_id": user_id, "album_id": "profile", "extended": "1"}) for user_id in user_ids]
+        )
+        return {
+            user_id: (f"{profiles[user_id]['first_name']} {profiles[user_id]['last_name']}", user_photos)
+            for user_id, user_photos in zip(user_ids, photos)
+        }
+
+    async def get_profiles(self, user_ids: list[int]) -> dict:
+        """
+        Получает профили пользователей через кэш профилей.
+
+        Параметры:
+            user_ids (list[int]): Идентификаторы пользователей.
+
+        Возвращаемое значение:
+            Словарь {user_id: элемент ответа users.get}.
+        """
+        return await self.profiles.get_many_async(user_ids, self._fetch_profiles)
+
+    async def _fetch_profiles(self, user_ids: list[int]) -> list[dict]:
+        """
+        Запрашивает профили нескольких пользователей одним вызовом users.get.
+
+        Параметры:
+            user_ids (list[int]): Идентификаторы пользователей.
+
+        Возвращаемое значение:
+            Список профилей из ответа users.get.
+        """
+        response = await self._call(
+            "users.get", {"user_ids": ",".join(map(str, user_ids)), "fields": self.profile_fields}
+        )
+        return response["response"]
+
+    async def search_users(self, sex: int, age_from: int, age_to: int, city_id: int) -> list:
+        """
+        Получает список идентификаторов пользователей в зависимости от заданных параметров.
+
+        Параметры:
+            sex (int): Пол искомых пользователей (1 - женский, 2 - мужской, 0 - не указывать).
+            age_from (int): Минимальный возраст пользователей.
+            age_to (int): Максимальный возраст пользователей.
+            city_id (int): id города, в котором должны находиться искомые пользователи.
+
+        Возвращаемое значение:
+            Список идентификаторов найденных пользователей.
+        """
+        page = await self._search_users_page(sex, age_from, age_to, city_id, offset=0, count=100)
+        all_found_users_id = [user["id"] for user in page["response"]["items"]]
+        random.shuffle(all_found_users_id)
+        return all_found_users_id
+
+    async def iter_search_users(
+        self,
+        sex: int,
+        age_from: int,
+        age_to: int,
+        city_id: int,
+        page_size: int = 200,
+        prefetch_at: int = 20
+    ):
+        """
+        Лениво перебирает идентификаторы найденных пользователей постранично.
+
+        Работает так же, как My_VkApi.iter_search_users, но страницы
+        запрашиваются без блокировки цикла событий.
+
+        Параметры:
+            sex (int): Пол искомых пользователей (1 - женский, 2 - мужской, 0 - не указывать).
+            age_from (int): Минимальный возраст пользователей.
+            age_to (int): Максимальный возраст пользователей.
+            city_id (int): id города, в котором должны находиться искомые пользователи.
+            page_size (int): Размер страницы (не больше 1000).
+            prefetch_at (int): Сколько кандидатов должно остаться, чтобы запросить следующую страницу.
+
+        Возвращаемое значение:
+            Асинхронный генератор идентификаторов пользователей.
+        """
+        seen = set()
+        queue = deque()
+        offset = 0
+        limit = self.search_cap
+        while True:
+            if len(queue) <= prefetch_at and offset < limit:
+                page = await self._search_users_page(
+                    sex, age_from, age_to, city_id, offset=offset, count=min(page_size, limit - offset)
+                )
+                limit = min(limit, page["response"]["count"])
+                self.profiles.put(page["response"]["items"])  # Имена кандидатов потом не нужно запрашивать
+                offset += page_size
+                found_users_id = [user["id"] for user in page["response"]["items"]]
+                if not found_users_id:
+                    offset = limit  # Выдача закончилась раньше заявленного количества
+                random.shuffle(found_users_id)
+                queue.extend(found_users_id)
+            if not queue:
+                return
+            user_id = queue.popleft()
+            if user_id not in seen:
+                seen.add(user_id)
+                yield user_id
+
+    async def _search_users_page(
+        self, sex: int, age_from: int, age_to: int, city_id: int, offset: int, count: int
+    ) -> dict:
+        """
+        Запрашивает одну страницу users.search.
+
+        Возвращаемое значение:
+            Ответ API в формате словаря.
+        """
+        return await self._call(
+            "users.search", My_VkApi._search_params(sex, age_from, age_to, city_id, offset, count)
+        )
+
+    async def find_users_photos(self, find_users: dict) -> list[list[str]]:
+        """Получает топ 3 фото пользователей по количеству лайков.
+
+        Параметры:
+            find_users (dict): Словарь с информацией о найденных пользователях.
+
+        Возвращаемое значение:
+            Список, где каждый элемент - информация о пользователе (имя, фамилия, ссылка, топ 3 фото).
+        """
+        items = find_users["response"]["items"]
+        photos = await self.execute(
+            [("photos.get", {"owner_id": element["id"], "album_id": "profile", "extended": "1"}) for element in items]
+        )
+        top_photos = get_top_likes_many({element["id"]: all_foto for element, all_foto in zip(items, photos)})
+        return [
+            [element["first_name"], element["last_name"], f"https://vk.com/id{element['id']}", top_photos[element["id"]]]
+            for element in items
+        ]
+
+    async def search_city(self, city: str) -> tuple | str:
+        """
+        Ищет город по названию.
+
+        Параметры:
+            city (str): Название города для поиска.
+
+        Возвращаемое значение:
+            Название и id найденного города или CITY_NOT_FOUND, как и My_VkApi.search_city.
+            Сначала город ищется в локальном справочнике, в VK уходят только промахи.
+        """
+        indexed_city = My_VkApi._indexed_city(self.cities, city)
+        if indexed_city is not None:
+            return indexed_city
+        found_city = await self._call("database.getCities", {"q": city, "need_all": 0, "count": 1})
+        return My_VkApi._parse_city(self.cities, city, found_city)
+
+    async def search_city_by_id(self, city_id: int) -> str:
+        """
+        Ищет город по id.
+
+        Параметры:
+            city_id (int): id города для поиска.
+
+        Возвращаемое значение:
+            Название найденного города или CITY_NOT_FOUND.
+        """
+        indexed_city = self.cities.find_by_id(city_id)
+        if indexed_city is not None:
+            return indexed_city
+        found_city = await self._call("database.getCitiesById", {"city_ids": city_id})
+        return My_VkApi._parse_city_by_id(self.cities, city_id, found_city)
+
+    async def send_message(
+        self, user_id: int, message: str, random_id: int, keyboard: str = None, attachment: str = None
+    ) -> dict:
+        """
+        Отправляет сообщение пользователю (для ключа сообщества).
+
+        Параметры:
+            user_id (int): Идентификатор получателя.
+            message (str): Текст сообщения.
+            random_id (int): Уникальный идентификатор сообщения; повторная отправка
+                с тем же random_id не создает дубль.
+            keyboard (str): Клавиатура в формате JSON.
+            attachment (str): Вложения.
+
+        Возвращаемое значение:
+            Ответ API в формате словаря.
+        """
+        data = {"user_id": user_id, "message": message, "random_id": random_id}
+        if keyboard is not None:
+            data["keyboard"] = keyboard
+        if attachment is not None:
+            data["attachment"] = attachment
+        return await self._send_request("POST", "method/messages.send", params=self.params, data=data)
+
+
+class AsyncLongPoll:
+    """
+    Асинхронное чтение событий User Long Poll сообщества.
+
+    Повторяет протокол vk_api.longpoll.VkLongPoll и отдает те же объекты
+    Event, поэтому события можно передавать в обработчики бота без изменений.
+
+    Методы:
+        update_longpoll_server: Получает адрес, ключ и номер события сервера.
+        check: Один запрос событий.
+        listen: Асинхронный генератор событий.
+    """
+
+    def __init__(self, api: AsyncVkApi, wait: int = 25, mode=DEFAULT_MODE, group_id: int = None) -> None:
+        """
+        Параметры:
+            api (AsyncVkApi): Клиент с ключом сообщества.
+            wait (int): Сколько секунд сервер держит запрос, если событий нет.
+            mode: Режим получения событий (как в VkLongPoll).
+            group_id (int): id сообщества.
+        """
+        self.api = api
+        self.wait = wait
+        self.mode = int(getattr(mode, "value", mode))
+        self.group_id = group_id
+        self.url = None
+        self.key = None
+        self.ts = None
+
+    async def update_longpoll_server(self, update_ts: bool = True) -> None:
+        """
+        Получает адрес, ключ и (при update_ts) номер последнего события сервера.
+
+        Параметры:
+            update_ts (bool): Обновлять ли номер последнего события.
+        """
+        params = {"lp_version": 3}
+        if self.group_id:
+            params["group_id"] = self.group_id
+        response = (await self.api._call("messages.getLongPollServer", params))["response"]
+        self.key = response["key"]
+        server = response["server"]
+        self.url = server if "://" in server else f"https://{server}"  # Локальный сервер может отдать адрес со схемой
+        if update_ts:
+            self.ts = response["ts"]
+
+    async def check(self) -> list[Event]:
+        """
+        Получает события от сервера один раз.
+
+        Возвращаемое значение:
+            Список событий Event.
+        """
+        if self.url is None:
+            await self.update_longpoll_server()
+        status, text = await self.api.transport.request(
+            "GET",
+            self.url,
+            params={"act": "a_check", "key": self.key, "ts": self.ts, "wait": self.wait, "mode": self.mode, "version": 3},
+            timeout=self.wait + 10,
+        )
+        if status >= 400:
+            raise HttpException(status, text)
+        response = json.loads(text)
+        if "failed" not in response:
+            self.ts = response["ts"]
+            return [Event(raw_event) for raw_event in response["updates"]]
+        if response["failed"] == 1:
+            self.ts = response["ts"]
+        elif response["failed"] == 2:
+            await self.update_longpoll_server(update_ts=False)
+        elif response["failed"] == 3:
+            await self.update_longpoll_server()
+        return []
+
+    async def listen(self):
+        """
+        Асинхронный генератор событий. Сетевые ошибки не прерывают чтение.
+
+        Возвращаемое значение:
+            Асинхронный генератор событий Event.
+        """
+        while True:
+            try:
+                events = await self.check()
+            except (aiohttp.ClientError, asyncio.TimeoutError, HttpException, VkApiError, ValueError) as e:
+                print(f"Long poll error: {e}")
+                await asyncio.sleep(1)
+                continue
+            for event in events:
+                yield event
+
+
+class AsyncVkBot(VkBot):
+    """
+    Бот VKinder на asyncio: все ожидание сети не занимает потоки.
+
+    Клавиатуры и инструкции берутся из VkBot, обработчики событий -
+    корутины с той же логикой. События одного пользователя обрабатываются
+    по порядку (под его asyncio.Lock), разных пользователей - конкурентно.
+    Число одновременно обрабатываемых событий ограничено max_inflight:
+    при превышении чтение long-poll приостанавливается. Запросы к БД
+    (psycopg2) выполняются в пуле потоков через asyncio.to_thread.
+
+    Методы:
+        dispatch: Запускает обработку события с сохранением порядка для пользователя.
+        run: Читает long-poll и обрабатывает события до остановки.
+    """
+
+    def __init__(
+        self,
+        token_file: str,
+        prefetch_depth: int = 3,
+        top_photos_count: int = 3,
+        max_inflight: int = 1000,
+        database=None
+    ) -> None:
+        """
+        Параметры:
+            token_file (str): Путь к файлу с токенами.
+            prefetch_depth (int): Сколько кандидатов готовить заранее.
+            top_photos_count (int): Сколько фото кандидата показывать.
+            max_inflight (int): Сколько событий обрабатывать одновременно.
+            database: Готовый объект с методами DB_editor (например, для нагрузочного теста);
+                по умолчанию создается DB_editor.
+        """
+        with open(token_file, 'r') as file:
+            data_json = json.load(file)
+            self.group_access_token = data_json["group_access_token"]
+            self.access_token = data_json["access_token"]
+            self.user_token = self.access_token
+        configure_from(data_json)  # Трассировка событий, если задана trace_sample_rate
+
+        self.transport = AsyncVkTransport()
+        self.group_api = AsyncVkApi(self.group_access_token, self.transport, rps=GROUP_TOKEN_RPS)
+        self.user_api = AsyncVkApi(self.access_token, self.transport)
+        self.longpoll = AsyncLongPoll(self.group_api)
+        # Вставки пишутся пачками в фоне
+        self.database = DB_editor(write_behind=True) if database is None else database
+        self.sessions = SessionStore()  # Курсоры поиска и текущие кандидаты пользователей
+        self.prefetch_depth = prefetch_depth  # Сколько кандидатов готовить заранее
+        self.top_photos_count = top_photos_count  # Сколько фото кандидата показывать
+        self.inflight = asyncio.Semaphore(max_inflight)
+        self.user_locks = dict()  # user_id -> [asyncio.Lock, число ожидающих событий]
+        self.tasks = set()
+        self.router = self.build_router()  # Та же таблица команд, что у VkBot, с обработчиками-корутинами
+        gauge("bot_events_inflight", "События, обрабатываемые конкурентно", callback=lambda: len(self.tasks))
+
+    async def db(self, method, *args):
+        """Выполняет блокирующий метод DB_editor в пуле потоков."""
+        return await asyncio.to_thread(method, *args)
+
+    async def write_msg(self, user_id: int, message: str, keyboard=None, attachment=None) -> None:
+        """
+        Отправляет сообщение пользователю с опциональной клавиатурой и вложениями.
+
+        Параметры:
+            user_id (int): Идентификатор пользователя, которому отправляется сообщение.
+            message (str): Текст сообщения.
+            keyboard: Опциональная клавиатура для сообщения.
+            attachment: Опциональные вложения для сообщения.
+        """
+        await self.group_api.send_message(user_id, message, new_random_id(), keyboard, attachment)
+
+    async def start_bot(self, user_id: int) -> tuple:
+        """
+        Инициализирует пользователя, собирает информацию и сохраняет в базу данных.
+
+        Параметры:
+            user_id (int): Идентификатор пользователя для инициализации.
+
+        Возвращаемое значение:
+            Кортеж (ID, пол, возраст, противоположный пол, минимальный и максимальный возраст, id города).
+        """
+        user_info = await self.group_api.get_user_info(user_id)
+        user_sex = user_info[user_id]["sex"]
+        user_age = user_info[user_id]["age"]
+        opposite_sex, age_min, age_max, user_vk_sex = self.search_criteria(user_sex, user_age)
+
+        # Город из базы или, для нового пользователя, из профиля (как VkBot.start_bot)
+        user_city = await self.db(self.database.get_user_city, user_id, user_info[user_id].get("city_id"))
+
+        await self.db(self.database.register_user, user_id, user_age, user_vk_sex, user_city)
+        return user_id, user_sex, user_age, opposite_sex, age_min, age_max, user_city
+
+    async def fetch_candidate(self, user_id: int) -> tuple:
+        """
+        Получает имя и топ-3 фотографии кандидата.
+
+        Параметры:
+            user_id (int): Идентификатор кандидата.
+
+        Возвращаемое значение:
+            Кортеж с идентификатором пользователя, его ФИО и топ-3 фотографии.
+        """
+        found_user_fio, found_user_photos = (await self.user_api.get_candidates([user_id]))[user_id]
+        return user_id, found_user_fio, get_top_likes(found_user_photos, self.top_photos_count)
+
+    async def _fill(self, session, excluded) -> None:
+        """Дополняет очередь подготовленных кандидатов сессии до prefetch_depth задач."""
+        while len(session.prefetched) < self.prefetch_depth:
+            try:
+                candidate_id = await anext(session.candidates, None)
+            except Exception:
+                # Курсор закрыт ошибкой: следующее сообщение начнет поиск заново
+                self._drop_prefetched(session)
+                session.end_search()
+                raise
+            if candidate_id is None:
+                return
+            if candidate_id in excluded:
+                continue
+            session.prefetched.append(asyncio.create_task(self.fetch_candidate(candidate_id)))
+
+    @staticmethod
+    def _drop_prefetched(session) -> None:
+        """Отменяет подготовку кандидатов по устаревшему поиску."""
+        for task in session.prefetched:
+            if not task.done():
+                task.cancel()
+            elif not task.cancelled():
+                task.exception()  # Ошибка уже не нужна, отмечаем ее прочитанной
+
+    async def next_found_user_message(self, event_user_id: int, session) -> tuple:
+        """
+        Отправляет следующего найденного пользователя, пропуская заблокированных и избранных.
+
+        Параметры:
+            event_user_id (int): ID события, пользователь, получающий сообщение.
+            session (SearchSession): Сессия поиска пользователя с курсором кандидатов.
+
+        Возвращаемое значение:
+            Кортеж с идентификатором пользователя, его ФИО и топ-3 фотографии.
+
+        Исключения:
+            StopAsyncIteration: Если кандидаты закончились.
+        """
+        excluded = await self.db(self.database.get_excluded_ids, event_user_id)
+        await self._fill(session, excluded)
+        if not session.prefetched:
+            raise StopAsyncIteration
+        user_id, found_user_fio, top3_user_photos = await session.prefetched.popleft()
+        await self._fill(session, excluded)  # Пока пользователь смотрит кандидата, готовим следующих
+        await self.write_msg(
+            event_user_id,
+            f"{found_user_fio}\nhttps://vk.com/id{user_id}",
+            self.create_keyboard(),
+            attachment=top3_user_photos,
+        )
+        return user_id, found_user_fio, top3_user_photos
+
+    async def send_next_photo(self, event_user_id: int, session) -> tuple:
+        """
+        Отправляет следующего кандидата.
+
+        Параметры:
+            event_user_id (int): ID события, пользователь, получающий сообщение.
+            session (SearchSession): Сессия поиска пользователя с курсором кандидатов.
+
+        Возвращаемое значение:
+            tuple: user_id, found_user_fio, top3_user_photos или (None, None, None), если показать некого.
+        """
+        try:
+            return await self.next_found_user_message(event_user_id, session)
+        except StopAsyncIteration:
+            session.end_search()  # Кандидаты закончились: следующее сообщение начнет поиск заново
+            await self.write_msg(event_user_id, "Больше нет доступных фотографий.", self.start_buttons())
+        except Exception as e:
+            await self.write_msg(event_user_id, f"Error fetching new user: {e}")
+        return None, None, None
+
+    async def handle_add_to_favourites(
+        self, event_user_id: int, user_id: int, found_user_fio: str, top3_user_photos: str
+    ) -> None:
+        """
+        Обрабатывает добавление пользователя в избранное.
+
+        Параметры:
+            event_user_id (int): ID события, пользователь, получающий сообщение.
+            user_id (int): ID пользователя, которого добавляют в избранное.
+            found_user_fio (str): ФИО найденного пользователя.
+            top3_user_photos (str): Строка с идентификаторами фотографий пользователя.
+        """
+        if user_id is None:
+            return
+        name, last_name = found_user_fio.split()[:2]
+        await self.db(
+            self.database.add_to_favourites,
+            event_user_id, name, last_name, user_id, "{" + "".join(top3_user_photos.split()) + "}",
+        )
+        await self.write_msg(event_user_id, f"https://vk.com/id{user_id}\nЗапись добавлена в избранное", self.create_keyboard())
+
+    async def handle_add_to_blacklist(self, event_user_id: int, user_id: int) -> None:
+        """
+        Обрабатывает добавление пользователя в черный список.
+
+        Параметры:
+            event_user_id (int): ID события, пользователь, получающий сообщение.
+            user_id (int): ID пользователя, который добавляется в черный список.
+        """
+        if user_id is None:
+            return
+        await self.db(self.database.add_to_black_list, event_user_id, user_id)
+        await self.write_msg(
+            event_user_id, f"https://vk.com/id{user_id}\nЗапись добавлена в чёрный список", self.create_black_list_keyboard()
+        )
+
+    async def handle_city_request(self, event_user_id: int, user_request: str) -> None:
+        """
+        Обрабатывает запрос пользователя о городе и обновляет информацию.
+
+        Параметры:
+            event_user_id (int): ID события, пользователь, получающий сообщение.
+            user_request (str): Текст сообщения пользователя.
+        """
+        command = self.router.resolve(user_request)[0]
+        if not user_request:
+            await self.write_msg(event_user_id, "Не поняла вашего ответа...", self.start_buttons())
+        elif command == "Правила":
+            await self.write_msg(event_user_id, self.instructions, self.start_buttons())
+        elif command != CommandRouter.unknown:
+            # Команды не отправляем на поиск города
+            await self.write_msg(event_user_id, "Укажите ваш город", self.start_buttons())
+        else:
+            found_city = await self.user_api.search_city(user_request)
+            if found_city == CITY_NOT_FOUND:
+                await self.write_msg(event_user_id, "Укажите ваш город", self.start_buttons())
+            else:
+                await self.write_msg(event_user_id, f"Выбран город: {found_city[0]}", self.start_buttons())
+                await self.db(self.database.update_user_city, event_user_id, found_city[1])
+
+    async def view_favourites(self, event_user_id: int) -> None:
+        """
+        Просмотр избранных пользователей и отправка их списка.
+
+        Параметры:
+            event_user_id (int): ID события, пользователь, получающий сообщение.
+        """
+        user_favourites = await self.db(self.database.get_favourites, event_user_id)
+        await self.write_msg(event_user_id, self.favourites_message(user_favourites), self.create_favourite_keyboard())
+
+    async def process_event(self, event) -> None:
+        """
+        Основная логика обработки сообщений от пользователя ВКонтакте (как VkBot.process_event).
+
+        Параметры:
+            event: Событие long-poll.
+        """
+        if not (event.type == VkEventType.MESSAGE_NEW and event.to_me):
+            return
+        user_vk_id, user_sex, user_age, opposite_sex, age_min, age_max, user_city = await self.start_bot(event.user_id)
+        session = self.sessions.get(event.user_id)
+        # Если город еще неизвестен или находимся в состоянии смены города
+        if user_city is None:
+            await self.handle_city_request(event.user_id, event.text)
+            return
+        search_params = (opposite_sex, age_min, age_max, user_city)
+        # Поиск выполняем заново, только если изменились город, возраст или пол
+        if session.needs_search(search_params):
+            self._drop_prefetched(session)
+            session.start_search(search_params, self.user_api.iter_search_users(*search_params))
+        await self.router.dispatch_async(event.text, event.user_id, session)
+
+    async def command_next(self, user_id: int, session) -> None:
+        """Показывает следующего кандидата."""
+        session.current = await self.send_next_photo(user_id, session)
+
+    async def command_rules(self, user_id: int, session) -> None:
+        """Отправляет инструкции."""
+        await self.write_msg(user_id, self.instructions, self.start_buttons())
+
+    async def command_change_city(self, user_id: int, session) -> None:
+        """Сбрасывает город пользователя и сессию поиска."""
+        await self.db(self.database.update_user_city, user_id, None)
+        await self.write_msg(user_id, "Укажите ваш город", self.start_buttons())
+        self._drop_prefetched(session)
+        session.reset()
+
+    async def command_add_favourite(self, user_id: int, session) -> None:
+        """Добавляет текущего кандидата в избранное и показывает следующего."""
+        if session.current[0] is None:
+            await self.write_msg(user_id, self.no_candidate_text, self.start_buttons())
+            return
+        await self.handle_add_to_favourites(user_id, *session.current)
+        session.current = await self.send_next_photo(user_id, session)
+
+    async def command_add_black_list(self, user_id: int, session) -> None:
+        """Добавляет текущего кандидата в черный список."""
+        if session.current[0] is None:
+            await self.write_msg(user_id, self.no_candidate_text, self.start_buttons())
+            return
+        await self.handle_add_to_blacklist(user_id, session.current[0])
+
+    async def command_view_favourites(self, user_id: int, session) -> None:
+        """Отправляет список избранного."""
+        await self.view_favourites(user_id)
+
+    async def command_main_menu(self, user_id: int, session) -> None:
+        """Возвращает пользователя в главное меню."""
+        await self.write_msg(user_id, "Возвращаемся в главное меню", self.start_buttons())
+
+    async def command_clear_favourites(self, user_id: int, session) -> None:
+        """Удаляет весь список избранного."""
+        await self.db(self.database.delete_all_favourites, user_id)
+        await self.write_msg(user_id, "Удаляем весь список", self.start_buttons())
+
+    async def command_remove_last_favourite(self, user_id: int, session) -> None:
+        """Удаляет последнюю запись избранного."""
+        await self.db(self.database.delete_last_favourite, user_id)
+        await self.write_msg(user_id, "Последняя запись удалена", self.start_buttons())
+
+    async def command_clear_black_list(self, user_id: int, session) -> None:
+        """Удаляет весь черный список."""
+        await self.db(self.database.delete_all_blocked, user_id)
+        await self.write_msg(user_id, "Удаляем весь список", self.start_buttons())
+
+    async def command_remove_last_blocked(self, user_id: int, session) -> None:
+        """Удаляет последнюю запись черного списка."""
+        await self.db(self.database.delete_last_blocked, user_id)
+        await self.write_msg(user_id, "Последняя запись удалена", self.start_buttons())
+
+    async def command_unknown(self, user_id: int, session) -> None:
+        """Отвечает на нераспознанный текст."""
+        await self.write_msg(user_id, "Не поняла вашего ответа... Выберите одну из кнопок:", self.start_buttons())
+
+    async def _handle(self, event) -> None:
+        """Обрабатывает событие под блокировкой его пользователя."""
+        user_id = getattr(event, "user_id", None)
+        entry = self.user_locks.setdefault(user_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        queued = started = time.perf_counter()
+        status = "ok"
+        try:
+            async with entry[0]:
+                started = time.perf_counter()
+                # Корневой span трассы события; запросы к БД через asyncio.to_thread наследуют контекст
+                with trace("event", user_id=user_id, queue_wait_ms=round((started - queued) * 1000, 3)):
+                    await self.process_event(event)
+        except Exception as e:
+            status = "error"
+            print(f"Error processing event: {e}")  # Ошибка одного события не останавливает бота
+        finally:
+            finished = time.perf_counter()
+            BOT_EVENTS.inc(status)
+            BOT_EVENT_SECONDS.observe(finished - queued)
+            BOT_EVENT_HANDLE_SECONDS.observe(finished - started)
+            entry[1] -= 1
+            if not entry[1]:
+                del self.user_locks[user_id]
+            self.inflight.release()
+
+    async def dispatch(self, event) -> None:
+        """
+        Запускает обработку события. Ждет, если уже обрабатывается max_inflight событий.
+
+        Порядок событий одного пользователя сохраняется: задачи запускаются
+        в порядке поступления, а asyncio.Lock выдается ожидающим по очереди.
+
+        Параметры:
+            event: Событие long-poll.
+        """
+        await self.inflight.acquire()
+        task = asyncio.create_task(self._handle(event))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def run(self) -> None:
+        """Читает long-poll и обрабатывает события; при остановке дожидается начатых обработок."""
+        try:
+            async for event in self.longpoll.listen():
+                await self.dispatch(event)
+        finally:
+            if self.tasks:
+                await asyncio.gather(*self.tasks, return_exceptions=True)
+            print(self.router.stats())  # Время выполнения и число вызовов по командам
+            print(limiter_stats())  # Ожидания ограничителей частоты по ключам
+            print(breaker_stats())  # Размыкания цепи по методам API
+            await self.transport.close()
+            await asyncio.to_thread(self.database.close)  # Записываем буфер отложенной записи
+            await asyncio.to_thread(close_tracing)  # Выгружаем оставшиеся span
+
+
+if __name__ == "__main__":
+    start_metrics_server(METRICS_PORT)
+    print(f'Async bot is running, metrics: http://127.0.0.1:{METRICS_PORT}/metrics')
+    asyncio.run(AsyncVkBot('token.json').run())
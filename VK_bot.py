@@ -1,10 +1,94 @@
-import vk_api
-from vk_api.longpoll import VkLongPoll, VkEventType
-from VK_class import My_VkApi
-from vk_api.keyboard import VkKeyboard, VkKeyboardColor
+from startup import StartupTimer  # Первым импортом: от него отсчитывается время запуска
+from concurrent.futures import ThreadPoolExecutor
+from VK_class import CITY_NOT_FOUND, My_VkApi
 import json
 from db_tools import DB_editor
-from VK_class import get_top3_likes
+from VK_class import get_top_likes
+from rate_limiter import GROUP_TOKEN_RPS, limiter_stats
+from circuit_breaker import breaker_stats
+from sessions import SessionStore
+from prefetch import CandidatePrefetcher, SearchCursorError
+from dispatcher import EventDispatcher
+from outbox import MessageOutbox
+from router import CommandRouter
+from metrics import METRICS_PORT, start_metrics_server
+import tracing
+
+
+# Клавиатуры собираются словарями, а не через vk_api.keyboard: импорт vk_api занимает
+# около 0.15 с, а клавиатуры строятся при импорте модуля (например, в callback_server.py)
+def build_start_keyboard() -> str:
+    """Собирает стартовую клавиатуру бота."""
+    keyboard = {
+        "one_time": True,
+        "buttons": [
+            [
+                {"action": {"type": "text", "label": "Поиск пары"}, "color": "positive"},
+                {"action": {"type": "text", "label": "Правила"}, "color": "primary"},
+            ],
+            [
+                {"action": {"type": "text", "label": "Сменить город"}, "color": "secondary"},
+            ],
+        ],
+    }
+    return json.dumps(keyboard)
+
+
+def build_search_keyboard() -> str:
+    """Собирает клавиатуру для поиска пары."""
+    keyboard = {
+        "one_time": True,
+        "buttons": [
+            [
+                {"action": {"type": "text", "label": "Добавить в избранное"}, "color": "positive"},
+                {"action": {"type": "text", "label": "Пропустить"}, "color": "negative"},
+            ],
+            [
+                {"action": {"type": "text", "label": "Добавить в Чёрный список"}, "color": "secondary"},
+                {"action": {"type": "text", "label": "Просмотреть избранное"}, "color": "primary"},
+            ],
+            [
+                {"action": {"type": "text", "label": "Вернуться в главное меню"}, "color": "primary"},
+            ],
+        ],
+    }
+    return json.dumps(keyboard)
+
+
+def build_favourite_keyboard() -> str:
+    """Собирает клавиатуру для управления избранным."""
+    keyboard = {
+        "inline": True,
+        "buttons": [
+            [
+                {"action": {"type": "text", "label": "Очистить список"}, "color": "negative"},
+                {"action": {"type": "text", "label": "Убрать последнюю запись"}, "color": "primary"},
+            ],
+            [
+                {"action": {"type": "text", "label": "Продолжить поиск"}, "color": "positive"},
+                {"action": {"type": "text", "label": "Вернуться в главное меню"}, "color": "default"},
+            ] 
+        ]       
+    }
+    return json.dumps(keyboard)  # Преобразование в JSON-строку перед отправкой
+
+
+def build_black_list_keyboard() -> str:
+    """Собирает клавиатуру для управления списком заблокированных."""
+    keyboard = {
+        "inline": True,
+        "buttons": [
+            [
+                {"action": {"type": "text", "label": "Очистить black list"}, "color": "negative"},
+                {"action": {"type": "text", "label": "Убрать последнего пользователя"}, "color": "primary"},
+            ],
+            [
+                {"action": {"type": "text", "label": "Продолжить поиск"}, "color": "positive"},
+                {"action": {"type": "text", "label": "Вернуться в главное меню"}, "color": "default"},
+            ] 
+        ]       
+    }
+    return json.dumps(keyboard) 
 
 
 class VkBot:
@@ -14,142 +98,178 @@ class VkBot:
 
     Методы:
     write_msg: Отправляет сообщение пользователю с опциональной клавиатурой и вложениями.
-    start_buttons: Создает стартовую клавиатуру для бота.
-    create_keyboard: Создает клавиатуру для поиска пары.
-    create_favourite_keyboard: Создает клавиатуру для управления избранным.
-    create_black_list_keyboard: Создает клавиатуру для управления списком заблокированных.
+    start_buttons: Возвращает стартовую клавиатуру для бота.
+    create_keyboard: Возвращает клавиатуру для поиска пары.
+    create_favourite_keyboard: Возвращает клавиатуру для управления избранным.
+    create_black_list_keyboard: Возвращает клавиатуру для управления списком заблокированных.
     photo_generator: Генерирует пользователей из списка.
     start_bot: Инициализирует пользователя, собирает информацию и сохраняет в базу данных.
+    fetch_candidates: Получает имена и топ-3 фотографии нескольких кандидатов.
     next_found_user_message: Генерирует сообщение о найденном пользователе, проверяет его наличие в черном списке.
     send_next_photo: Получает следующую фотографию пользователя и отправляет информацию о ней.
     handle_add_to_favourites: Обрабатывает добавление пользователя в избранное.
     handle_add_to_blacklist: Обрабатывает добавление пользователя в черный список.
     handle_city_request: Обрабатывает запрос пользователя о городе и обновляет информацию.
     view_favourites: Просмотр избранных пользователей и отправка их списка.
+    build_router: Собирает таблицу команд из commands.
+    command_*: Обработчики команд из таблицы commands.
     process_event: Основная логика обработки сообщений от пользователя ВКонтакте.
     
     """
 
-    def __init__(self, token_file: str) -> None:
-        with open(token_file, 'r') as file:
-            data_json = json.load(file)
-            self.group_access_token = data_json["group_access_token"]
-            self.access_token = data_json["access_token"]
-            self.user_token = self.access_token
-            
+    # Инструкции для пользователя
+    instructions = (
+        "Привет! Я бот, который поможет вам найти людей для знакомства в социальной сети ВКонтакте 🥰\n\n"
+        "1. Поиск пары🔍: Нажмите на кнопку «Поиск пары», чтобы начать поиск. Я постараюсь помочь вам найти интересных людей для общения!\n\n"
+        "2. Добавить в избранное❤️: Если вам понравился кто-то, просто нажмите «Добавить в избранное», чтобы сохранить этот профиль.\n\n"
+        "3. Добавить в чёрный список⛔️: Если вы встретили пользователя, с которым не хотите общаться, нажмите «Добавить в чёрный список», чтобы прекратить взаимодействие.\n\n"
+        "4. Просмотреть избранное📃: Вы можете просмотреть всех, кого вы добавили в избранное, нажав на кнопку «Просмотреть избранное».\n\n"
+        "5. Пропустить⏭: Если вы не хотите взаимодействовать с текущим пользователем, просто нажмите кнопку «Пропустить».\n\n"
+        "6. Сменить город🌇: Если вы хотите изменить город, нажмите кнопку «Сменить город».\n\n"
+        "✨ Нажмите на кнопку, чтобы продолжить!😊"
+    )
+
+    # Ответ на «Добавить в избранное» и «Добавить в Чёрный список», когда кандидат не показан
+    no_candidate_text = "Сейчас некого добавить: нажмите «Поиск пары», чтобы увидеть кандидата."
+
+    # Клавиатуры не меняются, поэтому собираются и сериализуются один раз при импорте
+    start_keyboard = build_start_keyboard()
+    search_keyboard = build_search_keyboard()
+    favourite_keyboard = build_favourite_keyboard()
+    black_list_keyboard = build_black_list_keyboard()
+
+    # Таблица команд: текст кнопки (под ним ведутся метрики команды), имя обработчика, синонимы.
+    # Обработчики принимают (user_id, session); AsyncVkBot реализует те же имена корутинами
+    commands = (
+        ("Поиск пары", "command_next", ("найти пару", "поиск")),
+        ("Пропустить", "command_next", ("дальше", "следующий")),
+        ("Продолжить поиск", "command_next", ()),
+        ("Правила", "command_rules", ("помощь", "help")),
+        ("Сменить город", "command_change_city", ()),
+        ("Добавить в избранное", "command_add_favourite", ()),
+        ("Добавить в Чёрный список", "command_add_black_list", ()),
+        ("Просмотреть избранное", "command_view_favourites", ("избранное",)),
+        ("Вернуться в главное меню", "command_main_menu", ("главное меню", "меню", "начать")),
+        ("Очистить список", "command_clear_favourites", ()),
+        ("Убрать последнюю запись", "command_remove_last_favourite", ()),
+        ("Очистить black list", "command_clear_black_list", ()),
+        ("Убрать последнего пользователя", "command_remove_last_blocked", ()),
+    )
+
+    def __init__(
+        self,
+        token_file: str,
+        prefetch_depth: int = 3,
+        prefetch_workers: int = 4,
+        top_photos_count: int = 3,
+        use_longpoll: bool = True,
+        lazy_connect: bool = False,
+        database=None
+    ) -> None:
+        """
+        Параметры:
+            token_file (str): Путь к файлу с токенами.
+            prefetch_depth (int): Сколько кандидатов готовить заранее.
+            prefetch_workers (int): Число потоков подготовки кандидатов.
+            top_photos_count (int): Сколько фото кандидата показывать.
+            use_longpoll (bool): Получать ли события через long poll (False для Callback API).
+            lazy_connect (bool): Открывать ли соединения с БД при первом запросе, а не при запуске.
+            database: Готовый объект с методами DB_editor (например, для нагрузочного теста);
+                по умолчанию создается DB_editor.
+
+        Подключение к long poll и открытие соединений с БД - самые долгие этапы
+        запуска, поэтому они выполняются параллельно. Время этапов сохраняется
+        в startup_times.
+        """
+        timer = StartupTimer()
+        with timer.step("config"):
+            with open(token_file, 'r') as file:
+                data_json = json.load(file)
+                self.group_access_token = data_json["group_access_token"]
+                self.access_token = data_json["access_token"]
+                self.user_token = self.access_token
+            tracing.configure_from(data_json)  # Трассировка событий, если задана trace_sample_rate
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            # Вставки пишутся пачками в фоне
+            opening = executor.submit(
+                timer.timed, "database", DB_editor, write_behind=True, lazy_connect=lazy_connect
+            ) if database is None else None
+            # При приеме событий через Callback API (callback_server.py) long poll не нужен
+            longpoll = executor.submit(timer.timed, "longpoll", self._open_longpoll) if use_longpoll else None
+            with timer.step("runtime"):
+                self.user_vk_id = None
+                self.sessions = SessionStore()  # Курсоры поиска и текущие кандидаты пользователей
+                self.prefetcher = CandidatePrefetcher(prefetch_depth, prefetch_workers)
+                self.top_photos_count = top_photos_count  # Сколько фото кандидата показывать
+                # Сообщения отправляются в фоне с лимитом ключа сообщества, а не через vk_api (он ограничен 3 запросами в секунду)
+                self.outbox = MessageOutbox(My_VkApi(self.group_access_token, rps=GROUP_TOKEN_RPS).send_message)
+                self.router = self.build_router()
+            self.database = opening.result() if opening is not None else database
+            self.longpoll = longpoll.result() if longpoll is not None else None
+        self.startup_times = timer.report()
+
+    def _open_longpoll(self):
+        """Подключается к long poll сервера сообщества (запрос к VK)."""
+        import vk_api  # Нужен только для long poll: при Callback API и в тестах vk_api не загружается
+        from vk_api.longpoll import VkLongPoll
+
         self.vk = vk_api.VkApi(token=self.group_access_token)
-        self.longpoll = VkLongPoll(self.vk)
-        self.database = DB_editor()
-        self.all_found_users_generator = None
-        self.user_vk_id = None
-
-        # Инструкции для пользователя
-        self.instructions = (
-            "Привет! Я бот, который поможет вам найти людей для знакомства в социальной сети ВКонтакте 🥰\n\n"
-            "1. Поиск пары🔍: Нажмите на кнопку «Поиск пары», чтобы начать поиск. Я постараюсь помочь вам найти интересных людей для общения!\n\n"
-            "2. Добавить в избранное❤️: Если вам понравился кто-то, просто нажмите «Добавить в избранное», чтобы сохранить этот профиль.\n\n"
-            "3. Добавить в чёрный список⛔️: Если вы встретили пользователя, с которым не хотите общаться, нажмите «Добавить в чёрный список», чтобы прекратить взаимодействие.\n\n"
-            "4. Просмотреть избранное📃: Вы можете просмотреть всех, кого вы добавили в избранное, нажав на кнопку «Просмотреть избранное».\n\n"
-            "5. Пропустить⏭: Если вы не хотите взаимодействовать с текущим пользователем, просто нажмите кнопку «Пропустить».\n\n"
-            "6. Сменить город🌇: Если вы хотите изменить город, нажмите кнопку «Сменить город».\n\n"
-            "✨ Нажмите на кнопку, чтобы продолжить!😊"
-        )
+        return VkLongPoll(self.vk)
 
-    def write_msg(self, user_id: int, message: str, keyboard=None, attachment=None) -> None:
+    def write_msg(self, user_id: int, message: str, keyboard=None, attachment=None, replaceable: bool = False) -> None:
         """
-        Отправляет сообщение пользователю с опциональной клавиатурой и вложениями.
+        Ставит сообщение пользователю в очередь отправки с опциональной клавиатурой и вложениями.
 
         Параметры:
             user_id (int): Идентификатор пользователя, которому отправляется сообщение.
             message (str): Текст сообщения.
             keyboard: Опциональная клавиатура для сообщения.
             attachment: Опциональные вложения для сообщения.
+            replaceable (bool): Клавиатуру сообщения можно не отправлять, если следом
+                уже стоит другое сообщение с клавиатурой (текст отправляется всегда).
 
         Возвращаемое значение:
             None
         """
-        self.vk.method('messages.send', {
-            'user_id': user_id,
-            'message': message,
-            'random_id': 0,
-            'keyboard': keyboard,
-            'attachment': attachment
-        })
+        with tracing.span("write_msg", replaceable=replaceable):
+            self.outbox.send(user_id, message, keyboard, attachment, replaceable=replaceable)
 
     def start_buttons(self):
         """
-        Создает стартовую клавиатуру для бота.
+        Возвращает стартовую клавиатуру для бота (собрана один раз при импорте).
 
         Возвращаемое значение:
             Клавиатура в формате строки для отправки пользователю.
         """
-        keyboard = VkKeyboard(one_time=True)
-        keyboard.add_button('Поиск пары', color=VkKeyboardColor.POSITIVE)
-        keyboard.add_button('Правила', color=VkKeyboardColor.PRIMARY)
-        keyboard.add_line()  
-        keyboard.add_button('Сменить город', color=VkKeyboardColor.SECONDARY)
-        return keyboard.get_keyboard()
+        return self.start_keyboard
 
     def create_keyboard(self):
         """
-        Создает клавиатуру для поиска пары.
+        Возвращает клавиатуру для поиска пары (собрана один раз при импорте).
 
         Возвращаемое значение:
             Клавиатура в формате строки для отправки пользователю.
         """
-        keyboard = VkKeyboard(one_time=True)  # Создаем клавиатуру
-        keyboard.add_button('Добавить в избранное', color=VkKeyboardColor.POSITIVE)
-        keyboard.add_button('Пропустить', color=VkKeyboardColor.NEGATIVE)
-        keyboard.add_line()  
-        keyboard.add_button('Добавить в Чёрный список', color=VkKeyboardColor.SECONDARY)
-        keyboard.add_button('Просмотреть избранное', color=VkKeyboardColor.PRIMARY)
-        keyboard.add_line()
-        keyboard.add_button('Вернуться в главное меню', color=VkKeyboardColor.PRIMARY)
-        return keyboard.get_keyboard()
+        return self.search_keyboard
 
     def create_favourite_keyboard(self):
         """
-        Создает клавиатуру для управления избранным.
+        Возвращает клавиатуру для управления избранным (собрана один раз при импорте).
 
         Возвращаемое значение:
             Клавиатура в формате строки для отправки пользователю.
         """
-        keyboard = {
-            "inline": True,
-            "buttons": [
-                [
-                    {"action": {"type": "text", "label": "Очистить список"}, "color": "negative"},
-                    {"action": {"type": "text", "label": "Убрать последнюю запись"}, "color": "primary"},
-                ],
-                [
-                    {"action": {"type": "text", "label": "Продолжить поиск"}, "color": "positive"},
-                    {"action": {"type": "text", "label": "Вернуться в главное меню"}, "color": "default"},
-                ] 
-            ]       
-        }
-        return json.dumps(keyboard)  # Преобразование в JSON-строку перед отправкой
+        return self.favourite_keyboard
 
     def create_black_list_keyboard(self):
         """
-        Создает клавиатуру для управления списком заблокированных.
+        Возвращает клавиатуру для управления списком заблокированных (собрана один раз при импорте).
 
         Возвращаемое значение:
             Клавиатура в формате строки для отправки пользователю.
         """
-        keyboard = {
-            "inline": True,
-            "buttons": [
-                [
-                    {"action": {"type": "text", "label": "Очистить black list"}, "color": "negative"},
-                    {"action": {"type": "text", "label": "Убрать последнего пользователя"}, "color": "primary"},
-                ],
-                [
-                    {"action": {"type": "text", "label": "Продолжить поиск"}, "color": "positive"},
-                    {"action": {"type": "text", "label": "Вернуться в главное меню"}, "color": "default"},
-                ] 
-            ]       
-        }
-        return json.dumps(keyboard) 
+        return self.black_list_keyboard
 
     def photo_generator(self, user_list: list):
         """
@@ -174,77 +294,121 @@ class VkBot:
         Возвращаемое значение:
             Кортеж с информацией о пользователе (ID, пол, возраст, противоположный пол, минимальный и максимальный возраст, город, экземпляр базы данных).
         """
-        user_id = event.user_id
-        user_info = My_VkApi(self.group_access_token).get_user_info(user_id)
+        user_info = My_VkApi(self.group_access_token, rps=GROUP_TOKEN_RPS).get_user_info(user_id)
         user_sex = user_info[user_id]["sex"]
         user_age = user_info[user_id]["age"]
-        opposite_sex = (
-            2 if user_sex == "Женский" else 1
-        )  # выбираем противоположный пол
-        age_min = (
-            user_age - 10 if user_age - 10 >= 16 else 16
-        )  # выбираем минимальный возраст
-        age_max = user_age + 5
+        opposite_sex, age_min, age_max, user_vk_sex = self.search_criteria(user_sex, user_age)
 
         user_vk_id = user_id  # Получаем ID пользователя
-        user_vk_sex = 2 if user_sex == "Женский" else 1
 
-        user_city = user_info[user_id]['city_id']
-
-        if not self.database.get_user_city(user_id):
-            user_city = user_info[user_id].get(
-                "city_id", "Неизвестен"
-            )  # Используем get для безопасного доступа
-        else:
-            user_city = self.database.get_user_city(user_id)
+        # Город из базы; нового пользователя регистрируем с городом из профиля (None, если не указан).
+        # Сброшенный командой смены города NULL в базе остается None, чтобы бот спросил город
+        user_city = self.database.get_user_city(user_id, user_info[user_id].get("city_id"))
 
         self.database.register_user(user_vk_id, user_age, user_vk_sex, user_city)
         return user_vk_id, user_sex, user_age, opposite_sex, age_min, age_max, user_city, self.database
 
-    def next_found_user_message(self, user_id: int) -> tuple:
+    @staticmethod
+    def search_criteria(user_sex: str, user_age: int) -> tuple:
+        """
+        Вычисляет условия поиска кандидатов по профилю пользователя (общие для VkBot и AsyncVkBot).
+
+        Параметры:
+            user_sex (str): Пол пользователя ("Женский" или "Мужской").
+            user_age (int): Возраст пользователя.
+
+        Возвращаемое значение:
+            Кортеж (противоположный пол, минимальный и максимальный возраст, пол пользователя в кодах VK).
+        """
+        opposite_sex = 2 if user_sex == "Женский" else 1  # выбираем противоположный пол
+        age_min = user_age - 10 if user_age - 10 >= 16 else 16  # выбираем минимальный возраст
+        age_max = user_age + 5
+        user_vk_sex = 2 if user_sex == "Женский" else 1
+        return opposite_sex, age_min, age_max, user_vk_sex
+
+    @staticmethod
+    def favourites_message(user_favourites: list) -> str:
+        """
+        Составляет текст списка избранного (общий для VkBot и AsyncVkBot).
+
+        Параметры:
+            user_favourites (list): Записи избранного из DB_editor.get_favourites.
+
+        Возвращаемое значение:
+            Текст сообщения со списком избранного.
+        """
+        favourites_list = [
+            f"{favourite['name']} {favourite['last_name']}: https://vk.com/id{favourite['favourite_user_vk_id']}"
+            for favourite in user_favourites or []
+        ]
+        favourites_message = "\n".join(favourites_list) if favourites_list else "Ваш список избранного пуст."
+        return f"Ваш список избранного:\n\n{favourites_message}"
+
+    def fetch_candidates(self, user_ids: list[int]) -> dict:
+        """
+        Получает имена и топ-3 фотографии нескольких кандидатов. Выполняется в фоновых потоках предзагрузки.
+
+        Параметры:
+            user_ids (list[int]): Идентификаторы кандидатов.
+
+        Возвращаемое значение:
+            Словарь {user_id: (user_id, ФИО, топ-3 фотографии)}; недоступных профилей в нем нет.
+        """
+        # Имена обычно уже есть в кэше профилей после поиска, фотографии всех кандидатов приходят одним execute
+        candidates = My_VkApi(self.access_token).get_candidates(user_ids)
+        return {
+            # Выбираем топ фотографий по количеству лайков
+            user_id: (user_id, found_user_fio, get_top_likes(found_user_photos, self.top_photos_count))
+            for user_id, (found_user_fio, found_user_photos) in candidates.items()
+        }
+
+    def next_found_user_message(self, event_user_id: int, session) -> tuple:
         """
-        Генерирует сообщение о найденном пользователе, проверяет его наличие в черном списке.
+        Генерирует сообщение о следующем найденном пользователе, пропуская заблокированных и избранных.
 
         Параметры:
-            user_id (int): Идентификатор пользователя, о котором требуется получить информацию.
+            event_user_id (int): ID события, пользователь, получающий сообщение.
+            session (SearchSession): Сессия поиска пользователя с курсором кандидатов.
 
         Возвращаемое значение:
             Кортеж с идентификатором пользователя, его ФИО и топ-3 фотографии, или None в случае
-            ошибки или если пользователь заблокирован.
+            ошибки.
         """
-        blocked_list = self.database.get_black_list_user_id(event.user_id) # список заблокированных
-        blocked_list.extend([favourite['favourite_user_vk_id'] for favourite in self.database.get_favourites(event.user_id)]) # список избранных
+        # Заблокированные и избранные: множество из памяти, обновляемое при изменении списков
+        excluded = self.database.get_excluded_ids(event_user_id)
         try:
-            if user_id not in blocked_list:
-                found_user_fio = My_VkApi(self.access_token).get_short_user_info(user_id)
-                # Получаем все фотографии пользователя
-                found_user_photos = My_VkApi(self.access_token).get_user_photos(user_id)
-                # Выбираем топ 3 лайкнувших фотографии
-                top3_user_photos = get_top3_likes(found_user_photos)
-                self.write_msg(event.user_id,
-                        f"{str(found_user_fio)}\nhttps://vk.com/id{user_id}",
-                        self.create_keyboard(),
-                        attachment=f"{top3_user_photos}")
-                return user_id, found_user_fio, top3_user_photos
-            else:
-                self.next_found_user_message(next(self.all_found_users_generator))
+            # Кандидат обычно уже подготовлен в фоне, пока пользователь смотрел предыдущего;
+            # исключенные кандидаты пропускаются в цикле, без рекурсии
+            user_id, found_user_fio, top3_user_photos = self.prefetcher.next(
+                session.prefetched, session.candidates, self.fetch_candidates, excluded
+            )
+            self.write_msg(event_user_id,
+                    f"{str(found_user_fio)}\nhttps://vk.com/id{user_id}",
+                    self.create_keyboard(),
+                    attachment=f"{top3_user_photos}")
+            return user_id, found_user_fio, top3_user_photos
+        except StopIteration:
+            session.end_search()  # Кандидаты закончились: следующее сообщение начнет поиск заново
+            raise
         except Exception as e:
-                self.write_msg(event.user_id, f"Error fetching new user: {e}")
-                return None
+            if isinstance(e, SearchCursorError):
+                session.end_search()  # Курсор закрыт ошибкой, повторять поиск будем со следующим сообщением
+            self.write_msg(event_user_id, f"Error fetching new user: {e}")
+            return None
         
-    def send_next_photo(self, event_user_id: int, all_found_users_generator) -> tuple:
+    def send_next_photo(self, event_user_id: int, session) -> tuple:
         """
         Получает следующую фотографию пользователя и отправляет информацию о ней.
 
         Параметры:
             event_user_id (int): ID события, пользователь, получающий сообщение.
-            all_found_users_generator: Генератор найденных пользователей.
+            session (SearchSession): Сессия поиска пользователя с курсором кандидатов.
 
         Возвращаемое значение:
             tuple: user_id, found_user_fio, top3_user_photos или (None, None, None) в случае исключения.
         """
         try:
-            user_id, found_user_fio, top3_user_photos = self.next_found_user_message(next(all_found_users_generator))
+            user_id, found_user_fio, top3_user_photos = self.next_found_user_message(event_user_id, session)
             return user_id, found_user_fio, top3_user_photos
         except (StopIteration, TypeError) as e:
             # Обработка исключений
@@ -290,33 +454,35 @@ class VkBot:
         except StopIteration:
             self.write_msg(event_user_id, "Больше нет доступных фотографий", self.start_buttons())
 
-    def handle_city_request(self, event_user_id: int) -> bool:
+    def handle_city_request(self, event_user_id: int, user_request: str) -> bool:
         """
         Обрабатывает запрос пользователя о городе и обновляет информацию.
 
         Параметры:
             event_user_id (int): ID события, пользователь, получающий сообщение.
+            user_request (str): Текст сообщения пользователя.
 
         Возвращаемое значение:
             bool: Состояние конфигурации пользователя (False - сбросить настройки для нового города).
         """
-        user_request = event.text
-        found_city = My_VkApi(self.access_token).search_city(user_request)
-
-        if event.text:
-            if user_request.lower() == "правила":
-                self.write_msg(event.user_id, self.instructions, self.start_buttons())
-            elif found_city == "Город не найден":
-                self.write_msg(event.user_id, "Укажите ваш город", self.start_buttons())
-            elif not found_city == "Город не найден":
+        if user_request:
+            command = self.router.resolve(user_request)[0]
+            found_city = CITY_NOT_FOUND  # Команды не отправляем на поиск города: "Начать" - не название города
+            if command == CommandRouter.unknown:
+                found_city = My_VkApi(self.access_token).search_city(user_request)
+            if command == "Правила":
+                self.write_msg(event_user_id, self.instructions, self.start_buttons())
+            elif found_city == CITY_NOT_FOUND:
+                self.write_msg(event_user_id, "Укажите ваш город", self.start_buttons())
+            else:
                 self.write_msg(
                     event_user_id, f"Выбран город: {found_city[0]}", self.start_buttons()
                 )
-                self.database.update_user_city(event.user_id, found_city[1])
+                self.database.update_user_city(event_user_id, found_city[1])
                 state_configed = False  # Сбрасываем настройку пользователя для генерации для нового города
                 return state_configed
         else:
-            self.write_msg(event.user_id, "Не поняла вашего ответа...", self.start_buttons())
+            self.write_msg(event_user_id, "Не поняла вашего ответа...", self.start_buttons(), replaceable=True)
 
     def view_favourites(self, event_user_id) -> None:
         """
@@ -329,84 +495,130 @@ class VkBot:
             None
         """
         user_favourites = self.database.get_favourites(event_user_id)
-        favourites_list = [
-            f"{favourite['name']} {favourite['last_name']}: https://vk.com/id{favourite['favourite_user_vk_id']}"
-            for favourite in user_favourites
-        ]
+        self.write_msg(event_user_id, self.favourites_message(user_favourites), self.create_favourite_keyboard())
 
-        favourites_message = "\n".join(favourites_list) if favourites_list else "Ваш список избранного пуст."    
+    def build_router(self) -> CommandRouter:
+        """
+        Собирает таблицу команд из commands.
+
+        Возвращаемое значение:
+            CommandRouter с обработчиками этого бота; нераспознанный текст уходит в command_unknown.
+        """
+        router = CommandRouter(fallback=self.command_unknown)
+        for name, handler, aliases in self.commands:
+            router.register(name, getattr(self, handler), aliases)
+        return router
+
+    def command_next(self, user_id: int, session) -> None:
+        """Показывает следующего кандидата."""
+        session.current = self.send_next_photo(user_id, session)
+
+    def command_rules(self, user_id: int, session) -> None:
+        """Отправляет инструкции."""
+        self.write_msg(user_id, self.instructions, self.start_buttons())
+
+    def command_change_city(self, user_id: int, session) -> None:
+        """Сбрасывает город пользователя и сессию поиска."""
+        self.database.update_user_city(user_id, None)
+        self.write_msg(user_id, "Укажите ваш город", self.start_buttons())
+        session.reset()
+
+    def command_add_favourite(self, user_id: int, session) -> None:
+        """Добавляет текущего кандидата в избранное и показывает следующего."""
+        if session.current[0] is None:
+            self.write_msg(user_id, self.no_candidate_text, self.start_buttons())
+            return
+        self.handle_add_to_favourites(user_id, *session.current)
+        session.current = self.send_next_photo(user_id, session)
+
+    def command_add_black_list(self, user_id: int, session) -> None:
+        """Добавляет текущего кандидата в черный список."""
+        if session.current[0] is None:
+            self.write_msg(user_id, self.no_candidate_text, self.start_buttons())
+            return
+        self.handle_add_to_blacklist(user_id, session.current[0])
+
+    def command_view_favourites(self, user_id: int, session) -> None:
+        """Отправляет список избранного."""
+        self.view_favourites(user_id)
+
+    def command_main_menu(self, user_id: int, session) -> None:
+        """Возвращает пользователя в главное меню."""
+        self.write_msg(user_id, "Возвращаемся в главное меню", self.start_buttons(), replaceable=True)
+
+    def command_clear_favourites(self, user_id: int, session) -> None:
+        """Удаляет весь список избранного."""
+        self.database.delete_all_favourites(user_id)
+        self.write_msg(user_id, "Удаляем весь список", self.start_buttons())
+
+    def command_remove_last_favourite(self, user_id: int, session) -> None:
+        """Удаляет последнюю запись избранного."""
+        self.database.delete_last_favourite(user_id)
+        self.write_msg(user_id, "Последняя запись удалена", self.start_buttons())
+
+    def command_clear_black_list(self, user_id: int, session) -> None:
+        """Удаляет весь черный список."""
+        self.database.delete_all_blocked(user_id)
+        self.write_msg(user_id, "Удаляем весь список", self.start_buttons())
+
+    def command_remove_last_blocked(self, user_id: int, session) -> None:
+        """Удаляет последнюю запись черного списка."""
+        self.database.delete_last_blocked(user_id)
+        self.write_msg(user_id, "Последняя запись удалена", self.start_buttons())
+
+    def command_unknown(self, user_id: int, session) -> None:
+        """Отвечает на нераспознанный текст."""
         self.write_msg(
-            event_user_id,
-            f"Ваш список избранного:\n\n{favourites_message}",
-            self.create_favourite_keyboard()
+            user_id, "Не поняла вашего ответа... Выберите одну из кнопок:", self.start_buttons(), replaceable=True
         )
 
-    def process_event(self, event: VkEventType) -> None:
+    def process_event(self, event) -> None:
         """
         Основная логика обработки сообщений от пользователя ВКонтакте.
 
         Этот метод отвечает за обработку новых сообщений от пользователя. 
         Если сообщение новое и адресовано боту, информация о пользователе 
         извлекается и инициализируются необходимые переменные.
+        Команда выбирается по таблице router, а не цепочкой сравнений.
 
         """
 
+        from vk_api.longpoll import VkEventType  # Модуль уже загружен источником событий, импорт - поиск в sys.modules
+
         if event.type == VkEventType.MESSAGE_NEW and event.to_me:
-            user_vk_id, self.user_sex, self.user_age, opposite_sex, age_min, age_max, user_city, self.database = self.start_bot(event.user_id)
-            # Инициализация состояний
-            state_configed = False
+            # Данные пользователя держим в локальных переменных: события разных пользователей обрабатываются параллельно
+            user_vk_id, user_sex, user_age, opposite_sex, age_min, age_max, user_city, _ = self.start_bot(event.user_id)
+            session = self.sessions.get(event.user_id)
             # Если город известен, то запускаем генерацию пользователей
-            if self.database.get_user_city(event.user_id) != "Неизвестен":
-                if not state_configed: # Проверяем флаг конфигурации
-                    user_city = self.database.get_user_city(user_vk_id)
-                    all_found_users = My_VkApi(self.user_token).search_users(opposite_sex, age_min, age_max, int(user_city))
-                    all_found_users_generator = self.photo_generator(all_found_users)
-                    state_configed = True
-                # Сообщение от пользователя
-                user_request = event.text.lower()
-                if state_configed:
-                    if user_request == "поиск пары":
-                        self.user_id, self.found_user_fio, self.top3_user_photos = self.send_next_photo(event.user_id, all_found_users_generator)
-                    elif user_request == "правила":
-                        self.write_msg(event.user_id, self.instructions, self.start_buttons())
-                    elif user_request == "сменить город": 
-                        self.database.update_user_city(event.user_id, "Неизвестен")
-                        self.write_msg(event.user_id, "Укажите ваш город", self.start_buttons())
-                        state_configed = False
-                    elif user_request == "пропустить":
-                        self.user_id, self.found_user_fio, self.top3_user_photos = self.send_next_photo(event.user_id, all_found_users_generator)
-                    elif user_request == "продолжить поиск":
-                        self.user_id, self.found_user_fio, self.top3_user_photos = self.send_next_photo(event.user_id, all_found_users_generator)
-                    elif user_request == "добавить в избранное":
-                        self.handle_add_to_favourites(event.user_id, self.user_id, self.found_user_fio, self.top3_user_photos)
-                        self.user_id, self.found_user_fio, self.top3_user_photos = self.send_next_photo(event.user_id, all_found_users_generator)
-                    elif user_request == "добавить в чёрный список":
-                        self.handle_add_to_blacklist(event.user_id, self.user_id)
-                    elif user_request == "просмотреть избранное":
-                        self.view_favourites(event.user_id)
-                    elif user_request == "вернуться в главное меню":
-                        self.write_msg(event.user_id, "Возвращаемся в главное меню", self.start_buttons())
-                    elif user_request == 'очистить список':
-                        self.database.delete_all_favourites(event.user_id)
-                        self.write_msg(event.user_id, "Удаляем весь список", self.start_buttons())
-                    elif user_request == 'убрать последнюю запись':
-                        self.database.delete_last_favourite(event.user_id)
-                        self.write_msg(event.user_id, "Последняя запись удалена", self.start_buttons())
-                    elif user_request == 'очистить black list':
-                        self.database.delete_all_blocked(event.user_id)
-                        self.write_msg(event.user_id, "Удаляем весь список", self.start_buttons())
-                    elif user_request == 'убрать последнего пользователя':
-                        self.database.delete_last_blocked(event.user_id)
-                        self.write_msg(event.user_id, "Последняя запись удалена", self.start_buttons())
-                    else:
-                        self.write_msg(event.user_id, "Не поняла вашего ответа... Выберите одну из кнопок:", self.start_buttons())
+            if user_city is not None:
+                search_params = (opposite_sex, age_min, age_max, user_city)
+                # Поиск выполняем заново, только если изменились город, возраст или пол
+                if session.needs_search(search_params):
+                    # Кандидатов получаем постранично по мере просмотра
+                    all_found_users = My_VkApi(self.user_token).iter_search_users(*search_params)
+                    session.start_search(search_params, all_found_users)
+                # Сообщение от пользователя: обработчик находится одним поиском в таблице команд
+                self.router.dispatch(event.text, event.user_id, session)
             # Если город еще неизвестен или находимся в состоянии смены города
-            elif self.database.get_user_city(event.user_id) == "Неизвестен":
-                self.handle_city_request(event.user_id)
-
+            else:
+                self.handle_city_request(event.user_id, event.text)
 
 if __name__ == "__main__":
-    print('Bot is running')
     bot = VkBot('token.json')
-    for event in bot.longpoll.listen():
-        bot.process_event(event)
+    start_metrics_server(METRICS_PORT)  # Метрики в формате Prometheus: http://127.0.0.1:9100/metrics
+    print(f'Bot is running, startup times: {bot.startup_times}')
+    # События одного пользователя обрабатываются по порядку, разных пользователей - параллельно
+    dispatcher = EventDispatcher(bot.process_event, workers=8, queue_size=100)
+    try:
+        for event in bot.longpoll.listen():
+            dispatcher.submit(event)
+    finally:
+        dispatcher.shutdown()  # Дорабатываем уже принятые события
+        print(dispatcher.stats())
+        print(bot.router.stats())  # Время выполнения и число вызовов по командам
+        print(bot.prefetcher.stats())  # Попадания и промахи предзагрузки кандидатов
+        print(limiter_stats())  # Ожидания ограничителей частоты по ключам
+        print(breaker_stats())  # Размыкания цепи по методам API
+        bot.outbox.close()  # Отправляем сообщения, оставшиеся в очереди
+        bot.database.close()  # Записываем буфер отложенной записи
+        tracing.close()  # Выгружаем оставшиеся span
@@ -1,9 +1,24 @@
 import requests
+from requests.adapters import HTTPAdapter
 import json
-from pprint import pprint
 import datetime
 import time
 import random
+import heapq
+import threading
+from collections import deque
+from rate_limiter import TokenBucket, get_limiter, USER_TOKEN_RPS
+from circuit_breaker import get_breaker
+from metrics import counter, histogram
+from tracing import span
+from profiles import ProfileResolver
+from city_index import CityIndex
+
+
+VK_REQUEST_SECONDS = histogram("vk_request_seconds", "Время запросов к VK API по методам, секунды", ("method",))
+VK_ERROR_COUNT = counter(
+    "vk_errors_total", "Ошибки VK API по методам и кодам (код VK, http_<статус>, network, circuit_open)", ("method", "code")
+)
 
 
 class HttpException(Exception):
@@ -17,10 +32,191 @@ class HttpException(Exception):
         return f"http error: {self.status}\n{self.message}"
 
 
+class VkApiError(Exception):
+    """
+    Ошибка, которую VK вернул в теле ответа с кодом HTTP 200.
+
+    Атрибуты:
+        code (int): Код ошибки VK.
+        message (str): Текст ошибки.
+        method (str): Метод API, вызвавший ошибку.
+        transient (bool): Временная ли ошибка (повтор запроса может пройти).
+    """
+
+    transient = False
+
+    def __init__(self, code: int, message: str = "", method: str = None):
+        self.code = code
+        self.message = message
+        self.method = method
+
+    def __str__(self) -> str:
+        return f"vk error {self.code} in {self.method}: {self.message}"
+
+
+class VkTooManyRequests(VkApiError):
+    """Ошибка 6: слишком много запросов в секунду."""
+
+    transient = True
+
+
+class VkFloodControl(VkApiError):
+    """Ошибка 9: слишком много однотипных действий."""
+
+    transient = True
+
+
+class VkInternalError(VkApiError):
+    """Ошибка 10: внутренняя ошибка сервера VK."""
+
+    transient = True
+
+
+class VkCircuitOpen(VkApiError):
+    """Вызов отклонен без запроса: для метода разомкнута цепь после всплеска ошибок."""
+
+    def __init__(self, method: str):
+        super().__init__(0, "circuit breaker is open", method)
+
+
+VK_ERRORS = {6: VkTooManyRequests, 9: VkFloodControl, 10: VkInternalError}
+CITY_NOT_FOUND = "Город не найден"  # Ответ search_city и search_city_by_id, если города нет
+
+
+def vk_error(error: dict | None, method: str = None) -> VkApiError:
+    """
+    Превращает описание ошибки из ответа VK в исключение подходящего типа.
+
+    Параметры:
+        error (dict | None): Значение поля error ответа (или элемент execute_errors).
+        method (str): Метод API, вызвавший ошибку.
+
+    Возвращаемое значение:
+        Экземпляр VkApiError или его подкласса.
+    """
+    error = error or {}
+    code = error.get("error_code", 0)
+    return VK_ERRORS.get(code, VkApiError)(code, error.get("error_msg", ""), error.get("method", method))
+
+
+def retry_decision(error: Exception, method: str, attempt: int, max_retries: int, current=None) -> tuple:
+    """
+    Учитывает ошибку вызова API и решает, повторять ли вызов.
+
+    Общая логика синхронного и асинхронного клиентов: временные ошибки VK
+    (6, 9, 10), HTTP 5xx и сетевые ошибки повторяются, пока не исчерпаны
+    попытки, и считаются для размыкателя ошибкой. Постоянная ошибка VK
+    (например, нет доступа к профилю) не говорит о сбое метода.
+
+    Параметры:
+        error (Exception): HttpException, VkApiError или сетевая ошибка транспорта.
+        method (str): Метод API (для счетчиков).
+        attempt (int): Номер неудачной попытки, начиная с 0.
+        max_retries (int): Сколько раз можно повторить вызов.
+        current: Span вызова или None.
+
+    Возвращаемое значение:
+        Кортеж (исход для размыкателя, повторять ли вызов).
+    """
+    if isinstance(error, VkApiError):
+        code, transient = error.code, error.transient
+    elif isinstance(error, HttpException):
+        code, transient = f"http_{error.status}", error.status >= 500
+    else:
+        code, transient = "network", True
+    VK_ERROR_COUNT.inc(method, code)
+    if current is not None:
+        current.set(code=code)
+    return not transient, transient and attempt < max_retries
+
+
+def backoff_delay(attempt: int, base: float = 0.5, cap: float = 8.0) -> float:
+    """
+    Возвращает паузу перед повтором: экспоненциальный рост со случайным разбросом.
+
+    Случайная пауза от нуля до base * 2 ** attempt не дает клиентам,
+    получившим ошибку одновременно, повторить запросы тоже одновременно.
+
+    Параметры:
+        attempt (int): Номер неудачной попытки, начиная с 0.
+        base (float): Пауза после первой попытки, секунды.
+        cap (float): Максимальная пауза, секунды.
+
+    Возвращаемое значение:
+        Пауза в секундах.
+    """
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class VkTransport:
+    """
+    Общий HTTP-транспорт для запросов к API.
+
+    Держит пул keep-alive соединений, поэтому повторные запросы к api.vk.com
+    не тратят время на новое TCP+TLS рукопожатие. Один экземпляр можно
+    разделять между несколькими клиентами и потоками.
+
+    Параметры:
+        pool_size (int): Максимальное число одновременно открытых соединений к одному хосту.
+        timeout (float | tuple): Таймаут запроса по умолчанию (connect, read) в секундах.
+        gzip (bool): Запрашивать ли сжатые ответы.
+    """
+
+    def __init__(self, pool_size: int = 10, timeout: float | tuple = (3.05, 10), gzip: bool = True) -> None:
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.session = requests.Session()
+        # pool_block=True: при исчерпании пула запрос ждет свободное соединение, а не открывает лишнее
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, pool_block=True)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers["Accept-Encoding"] = "gzip, deflate" if gzip else "identity"
+
+    def request(self, http_method: str, url: str, timeout: float | tuple = None, **kwargs) -> requests.Response:
+        """
+        Отправляет запрос через пул соединений.
+
+        Параметры:
+            http_method (str): Метод запроса (GET/POST/...).
+            url (str): Полный адрес запроса.
+            timeout (float | tuple): Таймаут для этого запроса, по умолчанию таймаут транспорта.
+
+        Возвращаемое значение:
+            Объект ответа requests.Response.
+        """
+        return self.session.request(
+            http_method, url, timeout=timeout if timeout is not None else self.timeout, **kwargs
+        )
+
+    def close(self) -> None:
+        """Закрывает все соединения пула."""
+        self.session.close()
+
+
 class ApiBasic:
     """Базовый класс API, от него будут наследоваться Клиент VK."""
 
     host = ""
+    transport = None  # Транспорт по умолчанию, общий для всех клиентов
+    limiter: TokenBucket = None  # Ограничитель частоты запросов для ключа доступа
+    max_retries = 3  # Повторы при временных ошибках VK (6, 9, 10), ошибках HTTP 5xx и сетевых ошибках
+    backoff_base = 0.5  # Пауза после первой неудачной попытки, секунды
+    backoff_cap = 8.0  # Максимальная пауза между попытками, секунды
+    _transport_lock = threading.Lock()
+
+    @classmethod
+    def default_transport(cls) -> VkTransport:
+        """
+        Возвращает общий транспорт, создавая его при первом обращении.
+
+        Возвращаемое значение:
+            Экземпляр VkTransport, разделяемый всеми клиентами.
+        """
+        if ApiBasic.transport is None:
+            with ApiBasic._transport_lock:
+                if ApiBasic.transport is None:
+                    ApiBasic.transport = VkTransport()
+        return ApiBasic.transport
 
     def _send_request(
         self,
@@ -28,12 +224,18 @@ class ApiBasic:
         uri_path: str,
         params: dict = None,
         json: dict = None,
-        response_type: str = None
+        response_type: str = None,
+        timeout: float | tuple = None,
+        data: dict = None
     ) -> dict | Exception:
         """
         Метод для отправки всех запросов к API.
 
-        Обрабатывает исключения, логирует запросы и т.д.
+        Ошибки VK из тела ответа превращаются в исключения VkApiError.
+        Временные ошибки (6, 9, 10, HTTP 5xx и сетевые ошибки) повторяются
+        с экспоненциальной паузой и случайным разбросом. Исходы вызовов учитывает
+        размыкатель цепи метода: после всплеска ошибок вызовы сразу отклоняются.
+        Любое другое исключение считается для размыкателя ошибкой.
 
         Параметры:
             http_method (str): Метод запроса (GET/POST/PUT/PATCH/DELETE).
@@ -41,122 +243,441 @@ class ApiBasic:
             params (dict): Параметры запроса.
             json (dict): Данные в формате JSON для отправки.
             response_type (dict): Тип ответа (например, json).
+            timeout (float | tuple): Таймаут запроса, по умолчанию таймаут транспорта.
+            data (dict): Данные формы для отправки в теле запроса.
+
+        Возвращаемое значение:
+            Ответ от API в формате словаря.
+
+        Исключения:
+            HttpException: Если сервер вернул код ошибки HTTP.
+            VkApiError: Если VK вернул ошибку в теле ответа.
+            VkCircuitOpen: Если цепь метода разомкнута.
+            requests.RequestException: Если сетевая ошибка повторилась max_retries раз.
+        """
+        method = uri_path.rsplit("/", 1)[-1]
+        breaker = get_breaker(method)
+        transport = self.transport or self.default_transport()
+        with span(f"vk {method}", method=method) as current:
+            for attempt in range(self.max_retries + 1):
+                if current is not None:
+                    current.set(attempts=attempt + 1)
+                token = breaker.allow()
+                if token is None:
+                    VK_ERROR_COUNT.inc(method, "circuit_open")
+                    raise VkCircuitOpen(method)  # не добавляем нагрузку на ключ, который уже ограничен
+                # Исход записывается в finally: иначе неожиданное исключение (ответ не в JSON)
+                # оставило бы пробный вызов разомкнутой цепи незавершенным навсегда
+                success = False
+                try:
+                    if self.limiter is not None:
+                        self.limiter.acquire()  # ждем ровно столько, сколько требует лимит ключа
+                    started = time.perf_counter()
+                    try:
+                        response = transport.request(
+                            http_method,
+                            f"{self.host}/{uri_path}",
+                            params=params,
+                            json=json,
+                            data=data,
+                            timeout=timeout
+                        )  # отправляем запрос через пул соединений
+                    finally:
+                        VK_REQUEST_SECONDS.observe(time.perf_counter() - started, method)
+                    if response.status_code >= 400:
+                        # если с сервера приходит ошибка, выбрасываем исключение
+                        raise HttpException(response.status_code, response.text)
+                    if response_type != "json":
+                        success = True
+                        return None
+                    response = response.json()
+                    if "error" in response:
+                        raise vk_error(response["error"], method)
+                    success = True
+                    return response
+                except (requests.RequestException, HttpException, VkApiError) as e:
+                    success, retry = retry_decision(e, method, attempt, self.max_retries, current)
+                    if not retry:
+                        raise
+                finally:
+                    breaker.record(token, success)
+                time.sleep(backoff_delay(attempt, self.backoff_base, self.backoff_cap))
+
+
+class BatchResult:
+    """
+    Отложенный результат вызова, поставленного в очередь VkBatch.
+
+    Значение становится доступно после отправки пакета; get() отправляет
+    пакет сам, если это еще не сделано. Если запрос execute не удался
+    (сеть, HTTP, ошибка VK), get() каждого вызова пакета выбрасывает это исключение.
+    """
+
+    def __init__(self, batch: "VkBatch", method: str, parser=None) -> None:
+        self.batch = batch
+        self.method = method
+        self.parser = parser
+        self.raw = None  # Ответ в том же формате, что и при прямом вызове: {"response": ...} или {"error": ...}
+        self.error = None  # Исключение, с которым завершился запрос execute
+        self.done = False
+
+    def resolve(self, raw: dict) -> None:
+        self.raw = raw
+        self.done = True
+
+    def fail(self, error: BaseException) -> None:
+        self.error = error
+        self.done = True
+
+    def get(self):
+        """
+        Возвращает результат вызова, при необходимости отправляя пакет.
 
         Возвращаемое значение:
-            Ответ от API в формате словаря или Exception в случае ошибки.
-        """
-        response = requests.request(
-            http_method,
-            f"{self.host}/{uri_path}",
-            params=params,
-            json=json
-        )  # отправляем запрос
-        if response.status_code >= 400:
-            # если с сервера приходит ошибка, выбрасываем исключение
-            raise HttpException(response.status_code, response.text)
-        if response_type == "json":
-            response = response.json()
-            return response
+            Результат, обработанный parser, или сырой ответ API.
+
+        Исключения:
+            VkApiError: Если вызов с parser завершился ошибкой.
+            Exception: Исключение запроса execute, если пакет не удалось отправить.
+        """
+        if not self.done:
+            self.batch.flush()
+        if self.error is not None:
+            raise self.error
+        if not self.parser:
+            return self.raw
+        if "response" not in self.raw:
+            raise vk_error(self.raw.get("error"), self.method)
+        return self.parser(self.raw)
+
+
+class VkBatch:
+    """
+    Пакет вызовов API, отправляемых одним запросом через метод execute.
+
+    VK выполняет до 25 вызовов за один execute, поэтому при заполнении
+    очереди пакет отправляется автоматически. Результаты раскладываются
+    по объектам BatchResult в порядке постановки в очередь.
+
+    Методы:
+        add: Ставит вызов в очередь.
+        flush: Отправляет накопленные вызовы.
+        code: Собирает код execute для списка вызовов.
+        results: Раскладывает ответ execute по вызовам.
+    """
+
+    max_calls = 25
+
+    def __init__(self, api: "My_VkApi") -> None:
+        self.api = api
+        self.calls = []  # Список кортежей (метод, параметры, BatchResult)
+
+    def __enter__(self) -> "VkBatch":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        if exc_type is None:
+            self.flush()
+
+    def add(self, method: str, params: dict, parser=None) -> BatchResult:
+        """
+        Ставит вызов метода API в очередь.
+
+        Параметры:
+            method (str): Имя метода, например, users.get.
+            params (dict): Параметры вызова без access_token и версии.
+            parser: Функция обработки ответа вида {"response": ...}.
+
+        Возвращаемое значение:
+            BatchResult, из которого можно получить результат после отправки.
+        """
+        result = BatchResult(self, method, parser)
+        self.calls.append((method, params, result))
+        if len(self.calls) >= self.max_calls:
+            self.flush()
+        return result
+
+    def flush(self) -> None:
+        """Отправляет накопленные вызовы одним запросом execute и раскладывает ответы."""
+        calls, self.calls = self.calls, []
+        if not calls:
+            return
+        try:
+            response = self.api._send_request(
+                http_method="POST",
+                uri_path="method/execute",
+                params=self.api.params,
+                data={"code": self.code([(method, params) for method, params, _ in calls])},
+                response_type="json",
+            )
+        except BaseException as e:
+            # Иначе результаты останутся без ответа, и get() упадет с TypeError вместо настоящей ошибки
+            for _, _, result in calls:
+                result.fail(e)
+            raise
+        raws = self.results(response, len(calls))
+        for (_, _, result), raw in zip(calls, raws):
+            result.resolve(raw)
+        # Неполный ответ execute: оставшиеся вызовы получают явную ошибку, а не пустой результат
+        for method, _, result in calls[len(raws):]:
+            result.fail(VkApiError(0, f"execute returned {len(raws)} results for {len(calls)} calls", method))
+
+    @staticmethod
+    def code(calls: list[tuple]) -> str:
+        """
+        Собирает код для метода execute.
+
+        Параметры:
+            calls (list[tuple]): Список пар (метод, параметры).
+
+        Возвращаемое значение:
+            Код VKScript, возвращающий массив результатов вызовов.
+        """
+        return "return [" + ",".join(
+            f"API.{method}({json.dumps(params, ensure_ascii=False)})" for method, params in calls
+        ) + "];"
+
+    @staticmethod
+    def results(response: dict, count: int) -> list[dict]:
+        """
+        Раскладывает ответ execute по вызовам.
+
+        Параметры:
+            response (dict): Ответ метода execute.
+            count (int): Число вызовов в пакете.
+
+        Возвращаемое значение:
+            Список ответов вида {"response": ...} или {"error": ...} в порядке вызовов.
+        """
+        if "response" not in response:
+            # Ошибка всего запроса execute: отдаем ее каждому вызову
+            return [{"error": response.get("error")}] * count
+        # Неудачные вызовы возвращают false, их ошибки идут по порядку в execute_errors
+        errors = iter(response.get("execute_errors", []))
+        return [
+            {"error": next(errors, None)} if item is False else {"response": item}
+            for item in response["response"]
+        ]
 
 
 class My_VkApi(ApiBasic):
     host = "https://api.vk.com/"
+    search_cap = 1000  # VK отдает не больше 1000 результатов users.search
+    profile_fields = "city,sex,bdate"  # Поля профиля, которые храним в кэше
+    default_profiles = ProfileResolver()  # Кэш профилей, общий для всех клиентов
+    cities = CityIndex()  # Локальный справочник городов, общий для всех клиентов
 
-    def __init__(self, token: str):
+    def __init__(
+        self,
+        token: str,
+        transport: VkTransport = None,
+        rps: float = USER_TOKEN_RPS,
+        profiles: ProfileResolver = None
+    ):
         """
         Инициализация клиента VK с токеном доступа.
 
         Параметры:
             token: Токен доступа для авторизации в API.
+            transport: HTTP-транспорт; по умолчанию общий для всех клиентов пул соединений.
+            rps: Лимит запросов в секунду для токена (3 для пользователя, 20 для сообщества).
+            profiles: Кэш профилей; по умолчанию общий для всех клиентов.
         """
         self.params = {"access_token": token, "v": "5.199"}
         self.user_token = token
+        self.transport = transport or self.default_transport()
+        self.limiter = get_limiter(token, rps)
+        self.profiles = profiles or self.default_profiles
+
+    def batch(self) -> VkBatch:
+        """
+        Создает пакет вызовов для отправки через execute.
+
+        Возвращаемое значение:
+            Экземпляр VkBatch, привязанный к этому клиенту.
+        """
+        return VkBatch(self)
 
-    def get_user_info(self, user_id: int) -> dict:
+    def _call(self, method: str, params: dict, parser=None, batch: VkBatch = None):
+        """
+        Выполняет вызов метода API сразу или ставит его в пакет.
+
+        Параметры:
+            method (str): Имя метода, например, users.get.
+            params (dict): Параметры вызова без access_token и версии.
+            parser: Функция обработки ответа.
+            batch (VkBatch): Пакет, в который нужно поставить вызов.
+
+        Возвращаемое значение:
+            Результат parser (или сырой ответ), либо BatchResult, если передан batch.
+        """
+        if batch is not None:
+            return batch.add(method, params, parser)
+        response = self._send_request(
+            http_method="GET",
+            uri_path=f"method/{method}",
+            params={**params, **self.params},
+            response_type="json",
+        )
+        return parser(response) if parser else response
+
+    def get_user_info(self, user_id: int, batch: VkBatch = None) -> dict:
         """
         Получает полную информацию о пользователе по его идентификатору.
 
         Параметры:
             user_id (int): Идентификатор пользователя.
+            batch (VkBatch): Пакет для отложенного вызова через execute.
 
         Возвращаемое значение:
             Словарь с информацией о пользователе (имя, фамилия, город, возраст, пол).
         """
-        user_info = dict()
-        user_info_resp = self._send_request(
-            http_method="GET",
-            uri_path="method/users.get",
-            params={"user_id": user_id, "fields": "city, sex, bdate", **self.params},
-            response_type="json",
+        if batch is None:
+            # Повторные обращения к одному пользователю обслуживаются из кэша профилей
+            return self._parse_user_info(user_id, self.profiles.get(user_id, self._fetch_profiles))
+        return self._call(
+            "users.get",
+            {"user_id": user_id, "fields": self.profile_fields},
+            parser=lambda response: self._parse_user_info(user_id, response["response"][0]),
+            batch=batch,
         )
 
+    @staticmethod
+    def _parse_user_info(user_id: int, user: dict) -> dict:
+        """
+        Приводит профиль из users.get к формату get_user_info.
+
+        Параметры:
+            user_id (int): Идентификатор пользователя.
+            user (dict): Элемент ответа users.get.
+
+        Возвращаемое значение:
+            Словарь {user_id: информация о пользователе}.
+        """
+        user_info = dict()
+
         # Если у пользователя скрыт возраст или год рождения, то берем его по умолчанию
         try:
-            user_city = user_info_resp["response"][0]["city"]["title"]
-            user_city_id = user_info_resp["response"][0]["city"]["id"]
+            user_city = user["city"]["title"]
+            user_city_id = user["city"]["id"]
         except:
             print("Город неизвестен")
             user_city = "Неизвестен"
-            user_city_id = 0
+            user_city_id = None
         try:
             age_user = datetime.datetime.now().year - int(
-                user_info_resp["response"][0]["bdate"].split(".")[2]
+                user["bdate"].split(".")[2]
             )
         except:
             print("Возраст неизвестен, по умолчанию 18")
             age_user = 18
 
         user_info[user_id] = {
-            "name": user_info_resp["response"][0]["first_name"],
-            "lastname": user_info_resp["response"][0]["last_name"],
+            "name": user["first_name"],
+            "lastname": user["last_name"],
             "city": user_city,
             "city_id": user_city_id,
             "age": age_user,
-            "sex": "Женский" if user_info_resp["response"][0]["sex"] == 1 else "Мужской"
-                   if user_info_resp["response"][0]["sex"] == 2 else "Неизвестный",
+            "sex": "Женский" if user["sex"] == 1 else "Мужской"
+                   if user["sex"] == 2 else "Неизвестный",
         }
         return user_info
 
-    def get_short_user_info(self, user_id: int) -> str:
+    def get_short_user_info(self, user_id: int, batch: VkBatch = None) -> str:
         """
         Получает короткую информацию о пользователе.
 
         Параметры:
             user_id (int): Идентификатор пользователя.
+            batch (VkBatch): Пакет для отложенного вызова через execute.
 
         Возвращаемое значение:
             Строка, содержащая имя и фамилию пользователя.
         """
-        response = self._send_request(
-            http_method="GET",
-            uri_path="method/users.get",
-            params={"user_id": user_id, **self.params},
-            response_type="json",
+        if batch is None:
+            profile = self.profiles.get(user_id, self._fetch_profiles)
+            return f"{profile['first_name']} {profile['last_name']}"
+        return self._call(
+            "users.get",
+            {"user_id": user_id},
+            parser=lambda response: f"{response['response'][0]['first_name']} {response['response'][0]['last_name']}",
+            batch=batch,
         )
-        return f"{response['response'][0]['first_name']} {response['response'][0]['last_name']}"
 
-    def get_user_photos(self, user_id: int) -> dict:
+    def get_user_photos(self, user_id: int, batch: VkBatch = None) -> dict:
         """
         Получает все фотографии пользователя.
 
         Параметры:
             user_id (int): Идентификатор пользователя.
+            batch (VkBatch): Пакет для отложенного вызова через execute.
 
         Возвращаемое значение:
             Словарь с информацией о фотографиях пользователя.
         """
-        return self._send_request(
+        return self._call(
+            "photos.get",
+            {"owner_id": user_id, "album_id": "profile", "extended": "1"},
+            batch=batch,
+        )
+
+    def get_candidates(self, user_ids: list[int]) -> dict:
+        """
+        Получает имена и фотографии сразу нескольких пользователей.
+
+        Имена берутся из кэша профилей (недостающие запрашиваются одним
+        users.get на все идентификаторы), а photos.get для всех пользователей
+        отправляются пакетами execute, поэтому 25 кандидатов обходятся одним
+        HTTP-запросом вместо 50.
+
+        Параметры:
+            user_ids (list[int]): Идентификаторы пользователей.
+
+        Возвращаемое значение:
+            Словарь {user_id: (имя и фамилия, ответ photos.get)}.
+        """
+        profiles = self.get_profiles(user_ids)
+        user_ids = [user_id for user_id in user_ids if user_id in profiles]
+        with self.batch() as batch:
+            photos = {user_id: self.get_user_photos(user_id, batch=batch) for user_id in user_ids}
+        return {
+            user_id: (
+                f"{profiles[user_id]['first_name']} {profiles[user_id]['last_name']}",
+                photos[user_id].get(),
+            )
+            for user_id in user_ids
+        }
+
+    def get_profiles(self, user_ids: list[int]) -> dict:
+        """
+        Получает профили пользователей через кэш профилей.
+
+        Параметры:
+            user_ids (list[int]): Идентификаторы пользователей.
+
+        Возвращаемое значение:
+            Словарь {user_id: элемент ответа users.get}.
+        """
+        return self.profiles.get_many(user_ids, self._fetch_profiles)
+
+    def _fetch_profiles(self, user_ids: list[int]) -> list[dict]:
+        """
+        Запрашивает профили нескольких пользователей одним вызовом users.get.
+
+        Параметры:
+            user_ids (list[int]): Идентификаторы пользователей.
+
+        Возвращаемое значение:
+            Список профилей из ответа users.get.
+        """
+        response = self._send_request(
             http_method="GET",
-            uri_path="method/photos.get",
-            params={
-                "owner_id": user_id,
-                "album_id": "profile",
-                "extended": "1",
-                **self.params,
-            },
+            uri_path="method/users.get",
+            params={"user_ids": ",".join(map(str, user_ids)), "fields": self.profile_fields, **self.params},
             response_type="json",
         )
-    
+        return response["response"]
+
     def search_users(self, sex: int, age_from: int, age_to: int, city_id: int) -> list:
         """
         Получает список идентификаторов пользователей в зависимости от заданных параметров.
@@ -171,29 +692,121 @@ class My_VkApi(ApiBasic):
             Список идентификаторов найденных пользователей.
         """
         all_found_users_id = []
-        all_found_users = self._send_request(
-            http_method="GET",
-            uri_path="method/users.search",
-            params={
-                "sort": 1,  # Параметр, отвечающий за сортировку результатов. Значение `1` означает, что результаты сортируются по релевантности.
-                "sex": sex,  # Пол искомых пользователей. `1` — женский, `2` — мужской, `0` — не указывать пол.
-                "status": 1,  # Семейное положение. Значение `1` означает, что пользователи должны быть "неженаты" (то есть, ищем тех, кто свободен)
-                "age_from": age_from,  # Минимальный возраст пользователей (например, `18`).
-                "age_to": age_to,  # Максимальный возраст пользователей (например, `30`).
-                "has_photo": 1,  # Указывает, должны ли искомые пользователи иметь фотографии.
-                "count": 100,  # Количество возвращаемых результатов.
-                "online": 1,  # Указывает, должны ли пользователи быть онлайн.
-                "city": city_id,  # id города, в котором должны находиться искомые пользователи.
-                **self.params,
-            },
-            response_type="json",
-        )
+        all_found_users = self._search_users_page(sex, age_from, age_to, city_id, offset=0, count=100)
         for user in all_found_users["response"]["items"]:
             all_found_users_id.append(user["id"])
         random.shuffle(all_found_users_id)
 
         return all_found_users_id
 
+    def iter_search_users(
+        self,
+        sex: int,
+        age_from: int,
+        age_to: int,
+        city_id: int,
+        page_size: int = 200,
+        prefetch_at: int = 20
+    ):
+        """
+        Лениво перебирает идентификаторы найденных пользователей постранично.
+
+        Следующая страница users.search запрашивается, только когда в текущей
+        остается не больше prefetch_at кандидатов, поэтому в памяти держится
+        не больше двух страниц. Повторы между страницами отбрасываются, перебор
+        останавливается на лимите выдачи VK (search_cap результатов).
+
+        Параметры:
+            sex (int): Пол искомых пользователей (1 - женский, 2 - мужской, 0 - не указывать).
+            age_from (int): Минимальный возраст пользователей.
+            age_to (int): Максимальный возраст пользователей.
+            city_id (int): id города, в котором должны находиться искомые пользователи.
+            page_size (int): Размер страницы (не больше 1000).
+            prefetch_at (int): Сколько кандидатов должно остаться, чтобы запросить следующую страницу.
+
+        Возвращаемое значение:
+            Генератор идентификаторов пользователей.
+        """
+        seen = set()
+        queue = deque()
+        offset = 0
+        limit = self.search_cap
+        while True:
+            if len(queue) <= prefetch_at and offset < limit:
+                page = self._search_users_page(
+                    sex, age_from, age_to, city_id, offset=offset, count=min(page_size, limit - offset)
+                )
+                limit = min(limit, page["response"]["count"])
+                self.profiles.put(page["response"]["items"])  # Имена кандидатов потом не нужно запрашивать
+                offset += page_size
+                found_users_id = [user["id"] for user in page["response"]["items"]]
+                if not found_users_id:
+                    offset = limit  # Выдача закончилась раньше заявленного количества
+                random.shuffle(found_users_id)
+                queue.extend(found_users_id)
+            if not queue:
+                return
+            user_id = queue.popleft()
+            if user_id not in seen:
+                seen.add(user_id)
+                yield user_id
+
+    def _search_users_page(
+        self, sex: int, age_from: int, age_to: int, city_id: int, offset: int, count: int
+    ) -> dict:
+        """
+        Запрашивает одну страницу users.search.
+
+        Параметры:
+            sex (int): Пол искомых пользователей.
+            age_from (int): Минимальный возраст пользователей.
+            age_to (int): Максимальный возраст пользователей.
+            city_id (int): id города.
+            offset (int): Смещение от начала выдачи.
+            count (int): Количество результатов на странице.
+
+        Возвращаемое значение:
+            Ответ API в формате словаря.
+        """
+        return self._send_request(
+            http_method="GET",
+            uri_path="method/users.search",
+            params={**self._search_params(sex, age_from, age_to, city_id, offset, count), **self.params},
+            response_type="json",
+        )
+
+    @classmethod
+    def _search_params(
+        cls, sex: int, age_from: int, age_to: int, city_id: int, offset: int, count: int
+    ) -> dict:
+        """
+        Собирает параметры users.search без access_token и версии.
+
+        Параметры:
+            sex (int): Пол искомых пользователей.
+            age_from (int): Минимальный возраст пользователей.
+            age_to (int): Максимальный возраст пользователей.
+            city_id (int): id города.
+            offset (int): Смещение от начала выдачи.
+            count (int): Количество результатов на странице.
+
+        Возвращаемое значение:
+            Словарь параметров запроса.
+        """
+        return {
+            "sort": 1,  # Параметр, отвечающий за сортировку результатов. Значение `1` означает, что результаты сортируются по релевантности.
+            "sex": sex,  # Пол искомых пользователей. `1` — женский, `2` — мужской, `0` — не указывать пол.
+            "status": 1,  # Семейное положение. Значение `1` означает, что пользователи должны быть "неженаты" (то есть, ищем тех, кто свободен)
+            "age_from": age_from,  # Минимальный возраст пользователей (например, `18`).
+            "age_to": age_to,  # Максимальный возраст пользователей (например, `30`).
+            "has_photo": 1,  # Указывает, должны ли искомые пользователи иметь фотографии.
+            "count": count,  # Количество возвращаемых результатов.
+            "offset": offset,  # Смещение от начала выдачи для постраничного перебора.
+            "online": 1,  # Указывает, должны ли пользователи быть онлайн.
+            "city": city_id,  # id города, в котором должны находиться искомые пользователи.
+            "fields": cls.profile_fields,  # Поля профиля для кэша профилей.
+        }
+
     def find_users_photos(self, find_users: dict) -> list[list[str]]:
         """Получает топ 3 фото пользователей по количеству лайков.
 
@@ -205,18 +818,20 @@ class My_VkApi(ApiBasic):
         """
 
         all_persons = []
+        items = find_users["response"]["items"]
 
-        for element in find_users["response"]["items"]:
-            time.sleep(0.2)
-            all_foto = dict(
-                self.get_user_photos(element["id"])
-            )  # Получаем все фото пользователя
+        # Фото всех пользователей запрашиваем пакетами execute, а не по одному запросу на человека
+        with self.batch() as batch:
+            all_photos = {element["id"]: self.get_user_photos(element["id"], batch=batch) for element in items}
+        # Получаем топ 3 фото по количеству лайков для всех пользователей сразу
+        top_photos = get_top_likes_many({user_id: all_foto.get() for user_id, all_foto in all_photos.items()})
 
+        for element in items:
             person = [
                 element["first_name"],
                 element["last_name"],
                 "https://vk.com/id" + str(element["id"]),
-                get_top3_likes(all_foto),  # Получаем топ 3 фото по количеству лайков
+                top_photos[element["id"]],
             ]
             all_persons.append(person)
 
@@ -230,18 +845,43 @@ class My_VkApi(ApiBasic):
             city (str): Название города для поиска.
 
         Возвращаемое значение:
-            Название найденного города или сообщение о том, что город не найден.
+            Название и id найденного города или сообщение о том, что город не найден.
+            Сначала город ищется в локальном справочнике, в VK уходят только промахи.
         """
+        indexed_city = self._indexed_city(self.cities, city)
+        if indexed_city is not None:
+            return indexed_city
         found_city = self._send_request(
             http_method="GET",
             uri_path="method/database.getCities",
             params={"q": city, "need_all": 0, "count": 1, **self.params},
             response_type="json",
         )
-        if found_city["response"]["count"] == 0:
-            return "Город не найден"
-        else:
-            return found_city["response"]["items"][0]["title"], found_city["response"]["items"][0]["id"]
+        return self._parse_city(self.cities, city, found_city)
+
+    @staticmethod
+    def _indexed_city(cities: CityIndex, city: str) -> tuple | str | None:
+        """
+        Ищет город в локальном справочнике (общая часть синхронного и асинхронного клиентов).
+
+        Возвращаемое значение:
+            (название, id), CITY_NOT_FOUND, если известно, что города нет, или None,
+            если нужен запрос к VK.
+        """
+        indexed_city = cities.find_by_name(city)
+        if indexed_city is None:
+            return None
+        return CITY_NOT_FOUND if indexed_city[1] is None else indexed_city
+
+    @staticmethod
+    def _parse_city(cities: CityIndex, city: str, response: dict) -> tuple | str:
+        """Разбирает ответ database.getCities и запоминает результат в справочнике."""
+        if response["response"]["count"] == 0:
+            cities.add_missing(city)
+            return CITY_NOT_FOUND
+        city_title, city_id = response["response"]["items"][0]["title"], response["response"]["items"][0]["id"]
+        cities.add(city_id, city_title, query=city)  # Следующий такой запрос обойдется без VK
+        return city_title, city_id
 
     def search_city_by_id(self, city_id: int) -> str:
         """
@@ -253,17 +893,92 @@ class My_VkApi(ApiBasic):
         Возвращаемое значение:
             Название найденного города или сообщение о том, что город не найден.
         """
+        indexed_city = self.cities.find_by_id(city_id)
+        if indexed_city is not None:
+            return indexed_city
         found_city = self._send_request(
             http_method="GET",
             uri_path="method/database.getCitiesById",
             params={"city_ids": city_id, **self.params},
             response_type="json",
         )
+        return self._parse_city_by_id(self.cities, city_id, found_city)
+
+    @staticmethod
+    def _parse_city_by_id(cities: CityIndex, city_id: int, response: dict) -> str:
+        """Разбирает ответ database.getCitiesById и запоминает город в справочнике."""
+        if not response["response"] or not response["response"][0]["title"]:
+            return CITY_NOT_FOUND
+        cities.add(city_id, response["response"][0]["title"])
+        return response["response"][0]["title"]
+
+    def send_message(
+        self, user_id: int, message: str, random_id: int, keyboard: str = None, attachment: str = None
+    ) -> dict:
+        """
+        Отправляет сообщение пользователю (для ключа сообщества).
+
+        Параметры:
+            user_id (int): Идентификатор получателя.
+            message (str): Текст сообщения.
+            random_id (int): Уникальный идентификатор сообщения; повторная отправка
+                с тем же random_id не создает дубль.
+            keyboard (str): Клавиатура в формате JSON.
+            attachment (str): Вложения.
+
+        Возвращаемое значение:
+            Ответ API в формате словаря.
+        """
+        data = {"user_id": user_id, "message": message, "random_id": random_id}
+        if keyboard is not None:
+            data["keyboard"] = keyboard
+        if attachment is not None:
+            data["attachment"] = attachment
+        return self._send_request(
+            http_method="POST",
+            uri_path="method/messages.send",
+            params=self.params,
+            data=data,
+            response_type="json",
+        )
+
+
+def get_top_likes(all_foto: dict, k: int = 3) -> str:
+    """
+    Возвращает k фото с наибольшим количеством лайков из всех фото пользователя.
 
-        if not found_city["response"][0]["title"]:
-            return "Город не найден"
-        else:
-            return found_city["response"][0]["title"]
+    Фото выбираются частичной выборкой через кучу (O(n log k)), строки вложений
+    собираются только для выбранных фото.
+
+    Параметры:
+        all_foto (dict): Ответ photos.get с extended=1 (содержит likes.count) или {"error": ...}.
+        k (int): Сколько фото выбрать.
+
+    Возвращаемое значение:
+        Строка с идентификаторами топ k фото или сообщение о том, что фотографии отсутствуют.
+    """
+    if "response" not in all_foto or all_foto["response"]["count"] == 0:
+        # Ошибка вызова внутри execute (например, закрытый профиль) - фото тоже нет
+        return "фотографии нет"
+
+    top_photos = heapq.nlargest(
+        k, all_foto["response"]["items"], key=lambda photo: photo.get("likes", {}).get("count", 0)
+    )
+    return " ,".join(f'photo{photo["owner_id"]}_{photo["id"]}' for photo in top_photos)
+
+
+def get_top_likes_many(photo_sets: dict, k: int = 3) -> dict:
+    """
+    Выбирает топ k фото по лайкам сразу для нескольких пользователей за один проход.
+
+    Параметры:
+        photo_sets (dict): Словарь {user_id: ответ photos.get}.
+        k (int): Сколько фото выбрать для каждого пользователя.
+
+    Возвращаемое значение:
+        Словарь {user_id: строка с идентификаторами топ k фото}.
+    """
+    return {user_id: get_top_likes(all_foto, k) for user_id, all_foto in photo_sets.items()}
 
 
 def get_top3_likes(all_foto: dict) -> str:
@@ -276,18 +991,7 @@ def get_top3_likes(all_foto: dict) -> str:
     Возвращаемое значение:
         Строка с идентификаторами топ 3 фото или сообщение о том, что фотографии отсутствуют.
     """
-    foto_count = 3
-    list_foto = list()
-
-    if all_foto["response"]["count"] == 0:
-        return "фотографии нет"
-    elif all_foto["response"]["count"] < 3:
-        foto_count = all_foto["response"]["count"]
-
-    for i in all_foto["response"]["items"]:
-        list_foto.append(f'photo{i["owner_id"]}_{i["id"]}')
-
-    return " ,".join(sorted(list_foto, key=lambda x: x[1], reverse=True)[:foto_count])
+    return get_top_likes(all_foto, 3)
 
 
 if __name__ == '__main__':
@@ -299,4 +1003,3 @@ if __name__ == '__main__':
         user_token = data_json["access_token"]
 
     vk_user = My_VkApi(user_token)
-    # pprint(vk_user.get_user_info(user_id))
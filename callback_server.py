@@ -0,0 +1,272 @@
+import argparse
+import json
+import socket
+import threading
+import zlib
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+from vk_api.longpoll import VkEventType
+
+import tracing
+from dispatcher import EventDispatcher
+from metrics import METRICS_PORT, counter, start_metrics_server
+
+CALLBACK_REQUESTS = counter(
+    "callback_requests_total", "Запросы Callback API (status: accepted, rejected, duplicate, forwarded)", ("status",)
+)
+
+
+class CallbackEvent:
+    """
+    Событие Callback API в том виде, который ожидает VkBot.process_event.
+
+    Атрибуты:
+        type: VkEventType.MESSAGE_NEW для нового сообщения, иначе None.
+        to_me (bool): Входящее ли сообщение.
+        user_id (int): VK ID отправителя.
+        text (str): Текст сообщения.
+        event_id (str): Идентификатор события VK (для отбрасывания повторов).
+    """
+
+    def __init__(self, payload: dict) -> None:
+        self.event_id = payload.get("event_id")
+        self.type = None
+        self.to_me = False
+        self.user_id = None
+        self.text = ""
+        if payload.get("type") == "message_new":
+            message = payload.get("object", {}).get("message", {})
+            self.type = VkEventType.MESSAGE_NEW
+            self.to_me = not message.get("out")
+            self.user_id = message.get("from_id")
+            self.text = message.get("text", "")
+
+
+class CallbackHandler(BaseHTTPRequestHandler):
+    """Обработчик HTTP-запросов Callback API: разбирает тело и сразу отвечает."""
+
+    def do_POST(self) -> None:
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            self._reply(400, "bad request")
+            return
+        self._reply(*self.server.handle_payload(payload, body))
+
+    def _reply(self, status: int, text: str) -> None:
+        data = text.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "text/plain")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args) -> None:
+        pass  # Не пишем в консоль каждый запрос VK
+
+
+class CallbackServer(ThreadingHTTPServer):
+    """
+    HTTP-сервер для приема событий VK Callback API.
+
+    Отвечает на запрос подтверждения строкой confirmation, проверяет
+    секретный ключ и ставит события в ограниченные очереди EventDispatcher.
+    VK получает "ok" сразу, не дожидаясь обработки. Если очередь заполнена,
+    сервер отвечает 503: VK повторит запрос позже (обратное давление).
+    Повторно доставленные события с тем же event_id отбрасываются.
+
+    Несколько процессов бота делят входящий поток через общий список peers:
+    каждый процесс слушает свой адрес (на одном или на разных хостах, за
+    балансировщиком). Событие пользователя обрабатывает процесс
+    peers[crc32(user_id) % len(peers)], остальные пересылают ему тело запроса.
+    Так сессия поиска, порядок событий и отбрасывание повторов пользователя
+    живут в одном процессе.
+
+    Общий порт (reuse_port, SO_REUSEPORT) ядро раздает процессам без учета
+    пользователя, поэтому он подходит только для обработки без состояния:
+    у VkBot сессии поиска, порядок событий и множество event_id свои в каждом
+    процессе. С peers общий порт несовместим - пересланное событие снова
+    попало бы в случайный процесс.
+
+    Методы:
+        handle_payload: Обрабатывает тело запроса VK.
+        stats: Счетчики принятых, отклоненных и пересланных событий.
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address: tuple,
+        dispatcher: EventDispatcher,
+        confirmation: str,
+        secret: str = None,
+        peers: list[str] = None,
+        index: int = 0,
+        reuse_port: bool = False,
+        forward_timeout: float = 5,
+        max_seen_events: int = 10000
+    ) -> None:
+        """
+        Параметры:
+            address (tuple): Адрес и порт для прослушивания.
+            dispatcher (EventDispatcher): Диспетчер, обрабатывающий события.
+            confirmation (str): Строка подтверждения сервера из настроек Callback API сообщества.
+            secret (str): Секретный ключ из настроек Callback API; если не задан, не проверяется.
+            peers (list[str]): Адреса всех процессов бота (включая этот) для распределения пользователей.
+            index (int): Номер этого процесса в peers.
+            reuse_port (bool): Разрешить нескольким процессам слушать один порт
+                (только для обработки без состояния, без peers).
+            forward_timeout (float): Таймаут пересылки события другому процессу, секунды.
+            max_seen_events (int): Сколько последних event_id помнить для отбрасывания повторов.
+
+        Исключения:
+            ValueError: Если reuse_port задан вместе с peers.
+        """
+        if reuse_port and peers:
+            raise ValueError("reuse_port cannot be combined with peers: forwarded events would land on a random process")
+        self.reuse_port = reuse_port
+        self.dispatcher = dispatcher
+        self.confirmation = confirmation
+        self.secret = secret
+        self.peers = peers or []
+        self.index = index
+        self.forward_timeout = forward_timeout
+        self.max_seen_events = max_seen_events
+        self.seen_events = OrderedDict()
+        self.http = requests.Session()  # Keep-alive соединения к другим процессам
+        self.lock = threading.Lock()
+        self.accepted = 0
+        self.rejected = 0  # Отклонено из-за заполненной очереди
+        self.duplicates = 0
+        self.forwarded = 0
+        super().__init__(address, CallbackHandler)
+
+    def server_bind(self) -> None:
+        if self.reuse_port:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        super().server_bind()
+
+    def handle_payload(self, payload: dict, body: bytes) -> tuple:
+        """
+        Обрабатывает тело запроса VK.
+
+        Параметры:
+            payload (dict): Разобранное тело запроса.
+            body (bytes): Исходное тело запроса (для пересылки другому процессу).
+
+        Возвращаемое значение:
+            Кортеж (код ответа HTTP, текст ответа).
+        """
+        if payload.get("type") == "confirmation":
+            return 200, self.confirmation
+        if self.secret is not None and payload.get("secret") != self.secret:
+            return 403, "forbidden"
+        event = CallbackEvent(payload)
+        if event.type is None:
+            return 200, "ok"  # Остальные типы событий боту не нужны
+        # crc32, а не hash: номер процесса не должен совпадать с номером рабочего потока диспетчера
+        owner = zlib.crc32(str(event.user_id).encode()) % len(self.peers) if self.peers else self.index
+        if owner != self.index:
+            return self._forward(self.peers[owner], body)
+        with self.lock:
+            # event_id резервируется под той же блокировкой, что и проверка:
+            # одновременные повторные доставки не пройдут проверку обе
+            duplicate = event.event_id is not None and event.event_id in self.seen_events
+            if duplicate:
+                self.duplicates += 1
+            elif event.event_id is not None:
+                self.seen_events[event.event_id] = True
+                while len(self.seen_events) > self.max_seen_events:
+                    self.seen_events.popitem(last=False)
+        if duplicate:
+            CALLBACK_REQUESTS.inc("duplicate")
+            return 200, "ok"
+        if not self.dispatcher.submit(event, timeout=0):
+            with self.lock:
+                self.rejected += 1
+                if event.event_id is not None:
+                    self.seen_events.pop(event.event_id, None)  # VK повторит событие, его нужно принять
+            CALLBACK_REQUESTS.inc("rejected")
+            return 503, "busy"
+        CALLBACK_REQUESTS.inc("accepted")
+        with self.lock:
+            self.accepted += 1
+        return 200, "ok"
+
+    def _forward(self, peer: str, body: bytes) -> tuple:
+        """Пересылает тело запроса процессу, которому принадлежит пользователь."""
+        try:
+            response = self.http.post(
+                peer, data=body, headers={"Content-Type": "application/json"}, timeout=self.forward_timeout
+            )
+        except requests.RequestException as e:
+            print(f"Error forwarding event to {peer}: {e}")
+            return 503, "busy"
+        CALLBACK_REQUESTS.inc("forwarded")
+        with self.lock:
+            self.forwarded += 1
+        return response.status_code, response.text
+
+    def stats(self) -> dict:
+        """
+        Возвращает счетчики сервера.
+
+        Возвращаемое значение:
+            Словарь с числом принятых, отклоненных, повторных и пересланных событий.
+        """
+        with self.lock:
+            return {
+                "accepted": self.accepted,
+                "rejected": self.rejected,
+                "duplicates": self.duplicates,
+                "forwarded": self.forwarded,
+            }
+
+
+if __name__ == "__main__":
+    from VK_bot import VkBot
+
+    parser = argparse.ArgumentParser(description="Прием событий VK Callback API")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--peers", default="", help="адреса всех процессов бота через запятую")
+    parser.add_argument("--index", type=int, default=0, help="номер этого процесса в --peers")
+    parser.add_argument(
+        "--reuse-port", action="store_true",
+        help="общий порт для нескольких процессов; только без состояния, несовместим с --peers"
+    )
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--queue-size", type=int, default=100)
+    parser.add_argument("--metrics-port", type=int, default=METRICS_PORT, help="порт /metrics; 0 - не запускать")
+    args = parser.parse_args()
+
+    with open("token.json", "r") as file:
+        data_json = json.load(file)
+    # Соединения с БД открываются при первом событии: процесс быстрее начинает принимать запросы VK
+    bot = VkBot("token.json", use_longpoll=False, lazy_connect=True)
+    dispatcher = EventDispatcher(bot.process_event, workers=args.workers, queue_size=args.queue_size)
+    server = CallbackServer(
+        (args.host, args.port),
+        dispatcher,
+        confirmation=data_json["callback_confirmation"],
+        secret=data_json.get("callback_secret") or None,
+        peers=[peer for peer in args.peers.split(",") if peer],
+        index=args.index,
+        reuse_port=args.reuse_port,
+    )
+    if args.metrics_port:
+        start_metrics_server(args.metrics_port)
+    print(f"Callback server is running on {args.host}:{args.port}, startup times: {bot.startup_times}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        dispatcher.shutdown()  # Дорабатываем уже принятые события
+        print(server.stats(), dispatcher.stats(), bot.prefetcher.stats())
+        bot.outbox.close()  # Отправляем сообщения, оставшиеся в очереди
+        bot.database.close()  # Записываем буфер отложенной записи
+        tracing.close()  # Выгружаем оставшиеся span
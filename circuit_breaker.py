@@ -0,0 +1,156 @@
+import threading
+import time
+from collections import deque
+
+from metrics import gauge
+
+CLOSED, OPEN, HALF_OPEN = 0, 1, 2  # Значения метрики состояния цепи
+CIRCUIT_STATE = gauge(
+    "vk_circuit_state", "Состояние размыкателя метода: 0 - замкнут, 1 - разомкнут, 2 - идет пробный вызов", ("method",)
+)
+
+
+class CircuitBreaker:
+    """
+    Размыкатель цепи для одного метода API.
+
+    Хранит исходы последних window вызовов. Если среди них не меньше
+    min_calls и доля временных ошибок достигает error_rate, цепь
+    размыкается на cooldown секунд: вызовы сразу отклоняются, не нагружая
+    уже ограниченный ключ. По истечении паузы пропускается один пробный
+    вызов; успех замыкает цепь, ошибка снова размыкает ее.
+
+    allow выдает токен вызова, и record учитывает исход только по нему:
+    исход пробного вызова решает судьбу цепи, даже если одновременно
+    завершаются вызовы, начатые до размыкания, а исходы таких устаревших
+    вызовов не учитываются. Состояние цепи выводится в метрику vk_circuit_state.
+
+    Методы:
+        allow: Выдает токен вызова, если его можно выполнить сейчас.
+        record: Записывает исход вызова по его токену.
+        stats: Состояние и счетчики.
+    """
+
+    def __init__(
+        self,
+        name: str = "",
+        window: int = 20,
+        min_calls: int = 10,
+        error_rate: float = 0.5,
+        cooldown: float = 10
+    ) -> None:
+        """
+        Параметры:
+            name (str): Имя метода для счетчиков.
+            window (int): Сколько последних исходов учитывать.
+            min_calls (int): Минимальное число исходов для размыкания.
+            error_rate (float): Доля ошибок, при которой цепь размыкается.
+            cooldown (float): Время, на которое цепь размыкается, секунды.
+        """
+        self.name = name
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.cooldown = cooldown
+        self.outcomes = deque(maxlen=window)  # True - успех, False - временная ошибка
+        self.opened_at = None  # Момент размыкания; None - цепь замкнута
+        self.epoch = 0  # Номер периода состояния цепи: растет при каждом размыкании и замыкании
+        self.probe = None  # Токен выполняющегося пробного вызова
+        self.lock = threading.Lock()
+        self.trips = 0  # Сколько раз цепь размыкалась
+        self.rejected = 0  # Сколько вызовов отклонено без запроса
+        CIRCUIT_STATE.set(CLOSED, name)
+
+    def allow(self) -> tuple | None:
+        """
+        Проверяет, можно ли выполнить вызов, и выдает его токен.
+
+        Возвращаемое значение:
+            Токен для record, если цепь замкнута или пора сделать пробный вызов; иначе None.
+        """
+        with self.lock:
+            if self.opened_at is None:
+                return self.epoch, False
+            if self.probe is None and time.monotonic() - self.opened_at >= self.cooldown:
+                self.probe = (self.epoch, True)
+                CIRCUIT_STATE.set(HALF_OPEN, self.name)
+                return self.probe
+            self.rejected += 1
+            return None
+
+    def record(self, token: tuple, success: bool) -> None:
+        """
+        Записывает исход вызова.
+
+        Параметры:
+            token (tuple): Токен, выданный allow перед вызовом.
+            success (bool): False, если вызов завершился временной ошибкой.
+        """
+        with self.lock:
+            if token == self.probe:
+                self.probe = None
+                self.epoch += 1
+                if success:
+                    self.opened_at = None
+                    self.outcomes.clear()
+                    CIRCUIT_STATE.set(CLOSED, self.name)
+                else:
+                    self.opened_at = time.monotonic()
+                    CIRCUIT_STATE.set(OPEN, self.name)
+                return
+            if self.opened_at is not None or token != (self.epoch, False):
+                return  # Вызов начат до смены состояния цепи: его исход уже ничего не решает
+            self.outcomes.append(success)
+            failures = self.outcomes.count(False)
+            if len(self.outcomes) >= self.min_calls and failures >= self.error_rate * len(self.outcomes):
+                self.opened_at = time.monotonic()
+                self.epoch += 1
+                self.trips += 1
+                CIRCUIT_STATE.set(OPEN, self.name)
+
+    def stats(self) -> dict:
+        """
+        Возвращает состояние и счетчики размыкателя.
+
+        Возвращаемое значение:
+            Словарь с состоянием цепи (closed, open или half-open), числом размыканий и отклоненных вызовов.
+        """
+        with self.lock:
+            return {
+                "state": "closed" if self.opened_at is None else "open" if self.probe is None else "half-open",
+                "trips": self.trips,
+                "rejected": self.rejected,
+                "errors": self.outcomes.count(False),
+                "calls": len(self.outcomes),
+            }
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(method: str) -> CircuitBreaker:
+    """
+    Возвращает общий размыкатель для метода API, создавая его при первом обращении.
+
+    Параметры:
+        method (str): Имя метода, например, users.search.
+
+    Возвращаемое значение:
+        Экземпляр CircuitBreaker.
+    """
+    with _breakers_lock:
+        if method not in _breakers:
+            _breakers[method] = CircuitBreaker(method)
+        return _breakers[method]
+
+
+def breaker_stats() -> dict:
+    """
+    Возвращает счетчики всех размыкателей.
+
+    Возвращаемое значение:
+        Словарь {метод: счетчики}.
+    """
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return {breaker.name: breaker.stats() for breaker in breakers}
@@ -0,0 +1,181 @@
+import json
+import os
+import threading
+from collections import OrderedDict
+
+
+class CityIndex:
+    """
+    Локальный справочник городов VK, сохраняемый на диск.
+
+    Хранит соответствие id -> название и название -> id (без учета регистра).
+    На диск попадают только канонические пары (id, название) из ответов VK:
+    каждый новый город дописывается в конец файла одной строкой JSON, поэтому
+    запись не зависит от размера справочника. Тексты запросов пользователей
+    (синонимы вроде "мск") и запросы, по которым город не найден, хранятся
+    только в памяти, не больше max_aliases и max_missing соответственно.
+    Справочник читается с диска при первом обращении, а не при создании,
+    чтобы не замедлять импорт и запуск бота.
+
+    Методы:
+        find_by_name: Ищет город по названию.
+        find_by_id: Ищет название города по id.
+        add: Запоминает город.
+        add_missing: Запоминает название, по которому город не найден.
+        save: Перезаписывает файл без повторов.
+    """
+
+    def __init__(self, path: str = "cities.json", max_missing: int = 10000, max_aliases: int = 10000) -> None:
+        """
+        Параметры:
+            path (str): Путь к файлу справочника (по одному JSON-объекту на строку).
+            max_missing (int): Сколько ненайденных названий помнить.
+            max_aliases (int): Сколько текстов запросов, отличных от названия города, помнить.
+        """
+        self.path = path
+        self.max_missing = max_missing
+        self.max_aliases = max_aliases
+        self.lock = threading.Lock()
+        self.by_id = dict()  # id -> название
+        self.by_name = dict()  # нормализованное название -> id
+        self.aliases = OrderedDict()  # нормализованный текст запроса -> id, только в памяти
+        self.missing = set()  # нормализованные названия, по которым город не найден
+        self.loaded = False
+        self.load_lock = threading.Lock()
+
+    @staticmethod
+    def normalize(name: str) -> str:
+        """Приводит название к виду для поиска без учета регистра."""
+        return " ".join(name.split()).casefold()
+
+    def load(self) -> None:
+        """
+        Загружает справочник из файла, если он есть.
+
+        Строка файла - {"id": ..., "title": ...} или прежний формат {"by_id": {...}};
+        поврежденные строки пропускаются. Если повторов в файле больше, чем
+        городов, файл переписывается без них.
+        """
+        lines = 0
+        by_id = dict()
+        try:
+            with open(self.path, "r", encoding="utf-8") as file:
+                for line in file:
+                    try:
+                        record = json.loads(line)
+                        if "by_id" in record:
+                            by_id.update((int(city_id), title) for city_id, title in record["by_id"].items())
+                        else:
+                            by_id[int(record["id"])] = record["title"]
+                    except (ValueError, KeyError, TypeError, AttributeError):
+                        continue
+                    lines += 1
+        except OSError:
+            self.loaded = True
+            return
+        with self.lock:
+            self.by_id = by_id
+            self.by_name = {self.normalize(title): city_id for city_id, title in by_id.items()}
+        self.loaded = True
+        if lines > 2 * len(by_id):
+            self.save()
+
+    def _ensure_loaded(self) -> None:
+        """Загружает справочник при первом обращении."""
+        if not self.loaded:
+            with self.load_lock:
+                if not self.loaded:
+                    self.load()
+
+    def save(self) -> None:
+        """Перезаписывает файл без повторов через временный файл, чтобы не оставить его поврежденным."""
+        with self.lock:
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as file:
+                for city_id, title in self.by_id.items():
+                    file.write(json.dumps({"id": city_id, "title": title}, ensure_ascii=False) + "\n")
+            os.replace(tmp_path, self.path)
+
+    def find_by_name(self, name: str) -> tuple | None:
+        """
+        Ищет город по названию.
+
+        Параметры:
+            name (str): Название города.
+
+        Возвращаемое значение:
+            (название, id), если город известен; (None, None), если известно, что его нет;
+            None, если название в справочнике не встречалось.
+        """
+        self._ensure_loaded()
+        key = self.normalize(name)
+        with self.lock:
+            if key in self.missing:
+                return None, None
+            city_id = self.by_name.get(key)
+            if city_id is None:
+                city_id = self.aliases.get(key)
+                if city_id is None:
+                    return None
+                self.aliases.move_to_end(key)
+            return self.by_id[city_id], city_id
+
+    def find_by_id(self, city_id: int) -> str | None:
+        """
+        Ищет название города по id.
+
+        Параметры:
+            city_id (int): id города.
+
+        Возвращаемое значение:
+            Название города или None, если его нет в справочнике.
+        """
+        self._ensure_loaded()
+        with self.lock:
+            return self.by_id.get(int(city_id))
+
+    def add(self, city_id: int, title: str, query: str = None) -> None:
+        """
+        Запоминает город; новый город дописывается в файл.
+
+        Параметры:
+            city_id (int): id города.
+            title (str): Название города.
+            query (str): Текст запроса, по которому город был найден (запоминается только в памяти).
+        """
+        self._ensure_loaded()
+        city_id = int(city_id)
+        with self.lock:
+            changed = self.by_id.get(city_id) != title
+            self.by_id[city_id] = title
+            self.by_name[self.normalize(title)] = city_id
+            if query and self.normalize(query) not in self.by_name:
+                key = self.normalize(query)
+                self.aliases[key] = city_id
+                self.aliases.move_to_end(key)
+                while len(self.aliases) > self.max_aliases:
+                    self.aliases.popitem(last=False)
+            if query:
+                self.missing.discard(self.normalize(query))
+            if changed:
+                self._append(city_id, title)
+
+    def _append(self, city_id: int, title: str) -> None:
+        """Дописывает город в конец файла (вызывается под блокировкой)."""
+        try:
+            with open(self.path, "a", encoding="utf-8") as file:
+                file.write(json.dumps({"id": city_id, "title": title}, ensure_ascii=False) + "\n")
+        except OSError as e:
+            print(f"Error saving city index: {e}")  # Справочник - кэш, город останется в памяти
+
+    def add_missing(self, query: str) -> None:
+        """
+        Запоминает название, по которому VK не нашел город.
+
+        Параметры:
+            query (str): Текст запроса.
+        """
+        with self.lock:
+            if len(self.missing) >= self.max_missing:
+                self.missing.clear()
+            self.missing.add(self.normalize(query))
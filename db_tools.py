@@ -1,7 +1,48 @@
 import psycopg2
+import psycopg2.pool
+import psycopg2.errors
+import psycopg2.extras
+import atexit
 import configparser
+import functools
+import re
+import sys
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from contextlib import contextmanager
 from typing import List, Optional
 
+from metrics import counter, gauge, histogram
+from tracing import span
+
+DB_QUERY_SECONDS = histogram("db_query_seconds", "Время выполнения методов DB_editor, секунды", ("method",))
+DB_QUERY_ERRORS = counter("db_query_errors_total", "Методы DB_editor, завершившиеся исключением", ("method",))
+DB_FLUSH_FAILURES = counter("db_write_behind_failures_total", "Неудачные сбросы буфера отложенной записи")
+DB_FLUSH_DROPPED = counter("db_write_behind_dropped_total", "Записи, отброшенные после повторных неудач сброса буфера")
+
+
+def timed_query(func):
+    """
+    Декоратор метода DB_editor: учитывает время выполнения и ошибки в метриках db_query_*
+    и открывает span метода в трассе текущего события.
+    """
+    name = f"db {func.__name__}"
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            with span(name, method=func.__name__):
+                return func(*args, **kwargs)
+        except Exception:
+            DB_QUERY_ERRORS.inc(func.__name__)
+            raise
+        finally:
+            DB_QUERY_SECONDS.observe(time.perf_counter() - started, func.__name__)
+    return wrapper
+
 
 class DB_creator:
     """Класс для создания БД.
@@ -12,6 +53,7 @@ class DB_creator:
 
     Методы:
         get_settings: Читает данные из конфигурационного файла.
+        get_pool_settings: Читает настройки пула соединений из конфигурационного файла.
         create_database: Создает базу данных, если она не существует.
         create_tables: Создает необходимые таблицы для хранения данных.
         del_table: Удаление таблиц (для отладки)
@@ -76,6 +118,23 @@ class DB_creator:
         port = config["SETTINGS"]["port"]
         return database, user, password, host, port
 
+    def get_pool_settings(file_name: str = "settings.ini") -> tuple:
+        """
+        Читает настройки пула соединений из конфигурационного файла.
+
+        Параметры:
+            file_name (str): Имя файла конфигурации.
+
+        Возвращает:
+            tuple: Минимальный и максимальный размер пула, время ожидания соединения в секундах
+        """
+        config = configparser.ConfigParser()
+        config.read(file_name)
+        pool_min = config.getint("SETTINGS", "pool_min", fallback=1)
+        pool_max = config.getint("SETTINGS", "pool_max", fallback=10)
+        pool_timeout = config.getfloat("SETTINGS", "pool_timeout", fallback=30)
+        return pool_min, pool_max, pool_timeout
+
     def create_database(database: str = "vkinder") -> None:
         """
         Создает новую базу данных.
@@ -102,6 +161,9 @@ class DB_creator:
         Создает таблицы в базе данных, если они не существуют.
         Создает 4 таблицы: 'users', 'black_list', 'favourite_users' и 'favourites'. Метод выводит
         сообщение об успешном создании таблиц.
+
+        Таблицы создаются в исходном виде, индексы и последующие изменения
+        схемы применяет DB_migrator.
         """
         try:
             self.cur.execute(
@@ -162,10 +224,12 @@ class DB_creator:
         Этот метод в первую очередь удаляет таблицы в следующем порядке:
         favourites, favourite_users, black_list, users.
         Это необходимо для того, чтобы избежать ошибок внешнего ключа.
+        Вместе с таблицами удаляется журнал миграций.
         """
         try:
             self.cur.execute(
                 """
+                DROP TABLE IF EXISTS schema_migrations;
                 DROP TABLE IF EXISTS favourites CASCADE;
                 DROP TABLE IF EXISTS favourite_users CASCADE;
                 DROP TABLE IF EXISTS black_list CASCADE;
@@ -178,6 +242,212 @@ class DB_creator:
             print(f"Error deleting tables: {e}")
 
 
+class DB_migrator(DB_creator):
+    """Класс для обновления схемы БД версионными миграциями.
+
+    Применяет к существующей базе миграции, которые еще не были применены,
+    не удаляя данные. Примененные версии записываются в таблицу
+    schema_migrations. Каждая миграция выполняется в отдельной транзакции
+    под advisory-блокировкой, поэтому одновременный запуск нескольких
+    экземпляров не применит миграцию дважды.
+
+    Методы:
+        get_version: Возвращает номер последней примененной миграции.
+        migrate: Создает таблицы и применяет недостающие миграции.
+
+    Примечания:
+        Новую миграцию добавляют в конец списка migrations со следующим номером.
+        Уже примененные миграции не изменяют.
+    """
+
+    lock_id = 20240717  # Ключ advisory-блокировки на время применения миграции
+
+    migrations = [
+        (
+            1,
+            "Индексы для выборок черного списка и избранного",
+            """
+            -- Последняя запись черного списка пользователя (delete_last_blocked)
+            CREATE INDEX IF NOT EXISTS black_list_user_id_black_list_id_idx
+                ON black_list (user_id, black_list_id DESC);
+            -- Проверка, в избранном ли профиль у других пользователей (удаление избранного)
+            CREATE INDEX IF NOT EXISTS favourites_favourite_user_id_idx
+                ON favourites (favourite_user_id);
+            """,
+        ),
+        (
+            2,
+            "users.city_id: INTEGER, NULL - город неизвестен",
+            """
+            ALTER TABLE users ALTER COLUMN city_id DROP NOT NULL;
+            ALTER TABLE users ALTER COLUMN city_id TYPE INTEGER
+                USING NULLIF(substring(city_id FROM '^[0-9]+$'), '0')::integer;
+            """,
+        ),
+    ]
+
+    def create_migrations_table(self) -> None:
+        """
+        Создает таблицу с журналом примененных миграций, если она не существует.
+        """
+        self.cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER PRIMARY KEY,
+                description VARCHAR(255) NOT NULL,
+                applied_at TIMESTAMP NOT NULL DEFAULT now()
+            );
+            """
+        )
+
+    def get_version(self) -> int:
+        """
+        Возвращает номер последней примененной миграции.
+
+        Возвращаемое значение:
+            int: Номер версии схемы (0, если миграции не применялись).
+        """
+        self.create_migrations_table()
+        self.cur.execute("SELECT COALESCE(max(version), 0) FROM schema_migrations;")
+        return self.cur.fetchone()[0]
+
+    def migrate(self) -> int:
+        """
+        Создает таблицы, если их нет, и применяет недостающие миграции по порядку.
+
+        При ошибке миграция откатывается целиком, и следующие миграции не применяются.
+
+        Возвращаемое значение:
+            int: Количество примененных миграций.
+        """
+        applied = 0
+        self.create_tables()
+        try:
+            self.create_migrations_table()
+            self.conn.autocommit = False
+            for version, description, sql in self.migrations:
+                try:
+                    self.cur.execute("SELECT pg_advisory_xact_lock(%s);", (self.lock_id,))
+                    self.cur.execute("SELECT 1 FROM schema_migrations WHERE version = %s;", (version,))
+                    if self.cur.fetchone():
+                        self.conn.rollback()  # Уже применена, снимаем блокировку
+                        continue
+                    self.cur.execute(sql)
+                    self.cur.execute(
+                        "INSERT INTO schema_migrations(version, description) VALUES(%s, %s);",
+                        (version, description),
+                    )
+                    self.conn.commit()
+                    applied += 1
+                    print(f"Migration {version} has been applied: {description}")
+                except Exception as e:
+                    self.conn.rollback()
+                    print(f"Error applying migration {version}: {e}")
+                    break
+        finally:
+            self.conn.autocommit = True
+        print(f"Schema version: {self.get_version()}")
+        return applied
+
+
+class ConnectionPool:
+    """Ограниченный потокобезопасный пул соединений с PostgreSQL.
+
+    Обертка над psycopg2.pool.ThreadedConnectionPool: если все соединения
+    заняты, поток ждет освобождения (не дольше timeout), а не получает
+    ошибку. Соединения, оборванные во время запроса, закрываются и
+    при следующем запросе заменяются новыми. С lazy=True соединения
+    открываются при первом запросе, а не при создании пула.
+
+    Методы:
+        connection: Контекстный менеджер, выдающий соединение из пула.
+        stats: Метрики ожидания соединения.
+        close: Закрывает все соединения пула.
+    """
+
+    def __init__(
+        self, minconn: int, maxconn: int, timeout: float = 30, lazy: bool = False, **connect_kwargs
+    ) -> None:
+        """
+        Параметры:
+            minconn (int): Сколько соединений открыть сразу.
+            maxconn (int): Максимальное число соединений.
+            timeout (float): Максимальное время ожидания свободного соединения в секундах.
+            lazy (bool): Открывать ли соединения только при первом запросе.
+            connect_kwargs: Параметры psycopg2.connect.
+        """
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.connect_kwargs = connect_kwargs
+        self.open_lock = threading.Lock()
+        self.pool = None if lazy else psycopg2.pool.ThreadedConnectionPool(minconn, maxconn, **connect_kwargs)
+        self.slots = threading.BoundedSemaphore(maxconn)
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.checkouts = 0  # Сколько раз выдавалось соединение
+        self.wait_time = 0.0  # Суммарное время ожидания соединения, секунды
+        self.max_wait = 0.0  # Самое долгое ожидание соединения, секунды
+
+    @contextmanager
+    def connection(self):
+        """
+        Выдает соединение из пула и возвращает его после использования.
+
+        Исключения:
+            psycopg2.pool.PoolError: Если свободное соединение не появилось за timeout секунд.
+        """
+        started = time.perf_counter()
+        if not self.slots.acquire(timeout=self.timeout):
+            raise psycopg2.pool.PoolError("connection pool checkout timed out")
+        waited = time.perf_counter() - started
+        with self.lock:
+            self.checkouts += 1
+            self.wait_time += waited
+            self.max_wait = max(self.max_wait, waited)
+        broken = False
+        try:
+            conn = self._open().getconn()
+            try:
+                conn.autocommit = True
+                yield conn
+            except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                broken = True
+                raise
+            finally:
+                self.pool.putconn(conn, close=broken or conn.closed != 0)
+        finally:
+            self.slots.release()
+
+    def _open(self) -> psycopg2.pool.ThreadedConnectionPool:
+        """Возвращает пул psycopg2, создавая его при первом запросе в режиме lazy."""
+        if self.pool is None:
+            with self.open_lock:
+                if self.pool is None:
+                    self.pool = psycopg2.pool.ThreadedConnectionPool(
+                        self.minconn, self.maxconn, **self.connect_kwargs
+                    )
+        return self.pool
+
+    def stats(self) -> dict:
+        """
+        Возвращает метрики пула.
+
+        Возвращаемое значение:
+            Словарь с числом выдач соединения, суммарным и максимальным временем ожидания.
+        """
+        with self.lock:
+            return {
+                "checkouts": self.checkouts,
+                "wait_time": round(self.wait_time, 3),
+                "max_wait": round(self.max_wait, 3),
+            }
+
+    def close(self) -> None:
+        """Закрывает все соединения пула."""
+        if self.pool is not None:
+            self.pool.closeall()
+
+
 class DB_editor:
     """Класс для работы с базой данных.
 
@@ -197,30 +467,331 @@ class DB_editor:
         delete_all_favourites: Удаляет все записи из списка избранного пользователя.
         delete_last_blocked: Удаляет последнюю запись из черного списка пользователя.
         delete_all_blocked: Удаляет все записи из черного списка пользователя.
+        get_excluded_ids: Возвращает множество id, которые не нужно показывать пользователю.
+        cursor: Выдает курсор на соединении из пула.
+        execute: Выполняет частый запрос как подготовленный оператор.
+        flush: Записывает буфер отложенной записи.
+        pending_size: Число записей в буфере отложенной записи.
+        close: Закрывает все соединения пула.
 
     Примечания:
-        Настройки подключения хранятся в файле settings.ini
+        Настройки подключения и размеры пула соединений хранятся в файле settings.ini
+        Множества исключений (черный список и избранное) кэшируются в памяти
+        и обновляются методами добавления и удаления.
+        Частые запросы (register_user, get_user_city, get_black_list_user_id,
+        get_favourites) подготавливаются на сервере один раз на соединение
+        и дальше выполняются по имени, без повторного разбора и планирования.
+        Время выполнения публичных методов попадает в метрику db_query_seconds.
     """
 
-    def __init__(self, database: str = "vkinder") -> None:
+    max_cached_exclusions = 10000  # Для скольких пользователей держать множества исключений
+    max_registered_users = 100000  # Сколько зарегистрированных пользователей помнить
+    max_flush_attempts = 5  # После скольких неудачных сбросов подряд пачка отбрасывается
+
+    def __init__(
+        self,
+        database: str = "vkinder",
+        write_behind: bool = False,
+        flush_size: int = 100,
+        flush_interval: float = 1.0,
+        use_prepared: bool = True,
+        lazy_connect: bool = False
+    ) -> None:
         """
-        Инициализация соединения с базой данных PostgreSQL.
+        Инициализация пула соединений с базой данных PostgreSQL.
 
         Параметры:
             database (str): Имя Базы Данных.
-
-        Создает соединение с базой данных, настраивает курсор и
-        устанавливает режим автокоммита для всех транзакций.
+            write_behind (bool): Копить ли вставки (register_user, add_to_black_list,
+                add_to_favourites) в буфере и записывать их пачками.
+            flush_size (int): При скольких накопленных записях буфер сбрасывается сразу.
+            flush_interval (float): Как часто буфер сбрасывается по времени, секунды.
+            use_prepared (bool): Выполнять ли частые запросы как подготовленные операторы (PREPARE/EXECUTE).
+            lazy_connect (bool): Открывать ли соединения с БД при первом запросе, а не при создании.
+
+        Создает пул соединений с размерами из settings.ini. Каждая операция
+        берет соединение из пула, работает со своим курсором в режиме
+        автокоммита и возвращает соединение, поэтому методы можно вызывать
+        из нескольких потоков одновременно.
         """
         self.database = database
         database, user, password, host, port = DB_creator.get_settings()
-        self.conn = psycopg2.connect(
+        pool_min, pool_max, pool_timeout = DB_creator.get_pool_settings()
+        self.pool = ConnectionPool(
+            pool_min, pool_max, pool_timeout, lazy=lazy_connect,
             database=self.database, user=user, password=password, host=host, port=port
         )
-        self.cur = self.conn.cursor()
-        self.conn.autocommit = True
+        self.exclusions = OrderedDict()  # user_id -> множество id из черного списка и избранного
+        self.exclusions_lock = threading.Lock()
+        self.registered_users = set()  # Пользователи, которые точно есть в таблице users
+
+        # Подготовленные операторы: соединение -> имена операторов, подготовленных в его сессии.
+        # Новое соединение пула (в том числе после обрыва) не найдется в словаре,
+        # и операторы будут подготовлены заново
+        self.use_prepared = use_prepared
+        self.prepared = weakref.WeakKeyDictionary()
+        self.prepared_lock = threading.Lock()
+
+        # Буфер отложенной записи
+        self.write_behind = write_behind
+        self.flush_size = flush_size
+        self.pending_lock = threading.Lock()
+        self.pending_users = dict()  # user_id -> (age, sex, city_id)
+        self.pending_black_list = set()  # (user_id, black_list_user_id)
+        self.pending_favourites = dict()  # (user_id, favourite_user_vk_id) -> (name, last_name, attachments)
+        self.pending_user_ids = set()  # Пользователи, у которых есть незаписанные изменения
+        self.flushing_user_ids = set()  # Пользователи, изменения которых записываются прямо сейчас
+        self.flush_lock = threading.Lock()  # Один сброс за раз; чтение ждет на ней конца записи
+        self.flush_failures = 0  # Неудачные сбросы подряд
+        self.flush_stop = threading.Event()
+        gauge("db_write_behind_pending", "Записи в буфере отложенной записи", callback=self.pending_size)
+        if write_behind:
+            self.flush_thread = threading.Thread(
+                target=self._flush_loop, args=(flush_interval,), name="db-write-behind", daemon=True
+            )
+            self.flush_thread.start()
+            atexit.register(self.flush)  # Буфер записывается даже при завершении без close()
+
+    @contextmanager
+    def cursor(self):
+        """
+        Выдает курсор на соединении из пула для одной операции.
+        """
+        with self.pool.connection() as conn:
+            with conn.cursor() as cur:
+                yield cur
 
-    def register_user(self, user_id: int, age: int, sex: int, city_id: str) -> None:
+    def execute(self, cur, name: str, query: str, params: tuple) -> None:
+        """
+        Выполняет запрос как подготовленный оператор сессии соединения.
+
+        При первом выполнении на соединении запрос подготавливается (PREPARE),
+        дальше выполняется по имени (EXECUTE). Если подготовленные операторы
+        выключены, запрос выполняется обычным образом.
+
+        Параметры:
+            cur: Курсор, полученный из cursor().
+            name (str): Имя подготовленного оператора.
+            query (str): Текст запроса с параметрами %s.
+            params (tuple): Значения параметров.
+        """
+        if not self.use_prepared:
+            cur.execute(query, params)
+            return
+        with self.prepared_lock:
+            prepared = self.prepared.setdefault(cur.connection, set())
+        if name not in prepared:
+            cur.execute(f"PREPARE {name} AS {self._positional(query)}")
+            prepared.add(name)
+        placeholders = ", ".join(["%s"] * len(params))
+        try:
+            cur.execute(f"EXECUTE {name} ({placeholders})", params)
+        except psycopg2.errors.InvalidSqlStatementName:
+            # Сессия была сброшена (например, DISCARD ALL) - готовим оператор заново
+            prepared.clear()
+            cur.execute(f"PREPARE {name} AS {self._positional(query)}")
+            prepared.add(name)
+            cur.execute(f"EXECUTE {name} ({placeholders})", params)
+
+    @staticmethod
+    def _positional(query: str) -> str:
+        """Заменяет параметры %s на позиционные $1, $2, ... для PREPARE."""
+        numbers = iter(range(1, query.count("%s") + 1))
+        return re.sub(r"%s", lambda match: f"${next(numbers)}", query)
+
+    def close(self) -> None:
+        """Записывает буфер и закрывает все соединения пула."""
+        self.flush_stop.set()
+        self.flush()
+        atexit.unregister(self.flush)  # Пул закрыт, повторный сброс при выходе уже не запишет буфер
+        self.pool.close()
+
+    def _mark_registered(self, user_ids) -> None:
+        """Запоминает пользователей, которые точно есть в таблице users."""
+        if len(self.registered_users) > self.max_registered_users:
+            self.registered_users = set()
+        self.registered_users.update(user_ids)
+
+    def _flush_loop(self, interval: float) -> None:
+        """Фоновый сброс буфера отложенной записи по времени."""
+        while not self.flush_stop.wait(interval):
+            self.flush()
+
+    def _enqueue(self, user_id: int) -> None:
+        """Отмечает пользователя как имеющего незаписанные изменения и сбрасывает буфер при переполнении."""
+        with self.pending_lock:
+            self.pending_user_ids.add(user_id)
+            pending = len(self.pending_users) + len(self.pending_black_list) + len(self.pending_favourites)
+        if pending >= self.flush_size:
+            self.flush()
+
+    def pending_size(self) -> int:
+        """Возвращает число записей в буфере отложенной записи."""
+        with self.pending_lock:
+            return len(self.pending_users) + len(self.pending_black_list) + len(self.pending_favourites)
+
+    def _flush_pending(self, user_id: int) -> None:
+        """
+        Сбрасывает буфер, если в нем есть изменения пользователя, от которых зависит чтение.
+
+        Если изменения пользователя уже записывает другой поток, flush ждет
+        окончания этой записи на flush_lock, поэтому чтение видит свои записи.
+        """
+        if not self.write_behind:
+            return
+        with self.pending_lock:
+            dirty = user_id in self.pending_user_ids or user_id in self.flushing_user_ids
+        if dirty:
+            self.flush()
+
+    @timed_query
+    def flush(self) -> None:
+        """
+        Записывает накопленные вставки многострочными запросами в одной транзакции.
+
+        Пользователи записываются первыми, так как на них ссылаются черный список и избранное.
+        Пока пачка записывается, ее пользователи остаются отмеченными, и чтения
+        их данных ждут фиксации транзакции. Если запись не удалась, пачка
+        возвращается в буфер и повторяется при следующем сбросе; после
+        max_flush_attempts неудач подряд она отбрасывается.
+        """
+        with self.flush_lock:
+            with self.pending_lock:
+                users, self.pending_users = self.pending_users, dict()
+                black_list, self.pending_black_list = self.pending_black_list, set()
+                favourites, self.pending_favourites = self.pending_favourites, dict()
+                self.flushing_user_ids, self.pending_user_ids = self.pending_user_ids, set()
+            try:
+                if not (users or black_list or favourites):
+                    return
+                try:
+                    self._write_pending(users, black_list, favourites)
+                except Exception as e:
+                    DB_FLUSH_FAILURES.inc()
+                    self.flush_failures += 1
+                    if self.flush_failures >= self.max_flush_attempts:
+                        self.flush_failures = 0
+                        DB_FLUSH_DROPPED.inc(amount=len(users) + len(black_list) + len(favourites))
+                        print(f"Error flushing write-behind buffer, batch dropped: {e}")
+                    else:
+                        print(f"Error flushing write-behind buffer, will retry: {e}")
+                        self._requeue(users, black_list, favourites)
+                else:
+                    self.flush_failures = 0
+                    self._mark_registered(users)
+            finally:
+                with self.pending_lock:
+                    self.flushing_user_ids = set()
+
+    def _requeue(self, users: dict, black_list: set, favourites: dict) -> None:
+        """Возвращает незаписанную пачку в буфер; более новые записи буфера остаются как есть."""
+        with self.pending_lock:
+            for user_id, values in users.items():
+                self.pending_users.setdefault(user_id, values)
+            self.pending_black_list.update(black_list)
+            for key, values in favourites.items():
+                self.pending_favourites.setdefault(key, values)
+            self.pending_user_ids.update(self.flushing_user_ids)
+
+    def _write_pending(self, users: dict, black_list: set, favourites: dict) -> None:
+        """Записывает пачку буфера в одной транзакции: либо вся пачка, либо ничего."""
+        with self.pool.connection() as conn:
+            conn.autocommit = False  # Пул вернет автокоммит при следующей выдаче соединения
+            with conn, conn.cursor() as cur:
+                if users:
+                    psycopg2.extras.execute_values(
+                        cur,
+                        """
+                    INSERT INTO users(user_id, age, sex, city_id) 
+                    VALUES %s
+                    ON CONFLICT (user_id) DO NOTHING;
+                    """,
+                        [(user_id, *values) for user_id, values in users.items()],
+                        page_size=len(users),
+                    )
+                if black_list:
+                    psycopg2.extras.execute_values(
+                        cur,
+                        """
+                    INSERT INTO black_list(user_id, black_list_user_id) 
+                    VALUES %s
+                    ON CONFLICT (user_id, black_list_user_id) DO NOTHING;
+                    """,
+                        list(black_list),
+                        page_size=len(black_list),
+                    )
+                if favourites:
+                    # Профили избранных и связи с пользователями - одним запросом на всю пачку
+                    psycopg2.extras.execute_values(
+                        cur,
+                        """
+                    WITH pending(user_id, name, last_name, favourite_user_vk_id, attachments) AS (
+                        VALUES %s
+                    ), inserted AS (
+                        INSERT INTO favourite_users(name, last_name, favourite_user_vk_id, attachments) 
+                        SELECT DISTINCT ON (favourite_user_vk_id)
+                            name, last_name, favourite_user_vk_id, attachments::text[]
+                        FROM pending
+                        ON CONFLICT (favourite_user_vk_id) DO NOTHING
+                        RETURNING favourite_user_id, favourite_user_vk_id
+                    ), favourite AS (
+                        SELECT favourite_user_id, favourite_user_vk_id FROM inserted
+                        UNION ALL
+                        SELECT favourite_user_id, favourite_user_vk_id FROM favourite_users
+                        WHERE favourite_user_vk_id IN (SELECT favourite_user_vk_id FROM pending)
+                    )
+                    INSERT INTO favourites(user_id, favourite_user_id) 
+                    SELECT DISTINCT pending.user_id, favourite.favourite_user_id
+                    FROM pending
+                    JOIN favourite USING (favourite_user_vk_id)
+                    ON CONFLICT (user_id, favourite_user_id) DO NOTHING;
+                    """,
+                        [
+                            (user_id, name, last_name, favourite_user_vk_id, attachments if attachments else None)
+                            for (user_id, favourite_user_vk_id), (name, last_name, attachments) in favourites.items()
+                        ],
+                        page_size=len(favourites),
+                    )
+
+    @timed_query
+    def get_excluded_ids(self, user_id: int) -> set:
+        """
+        Возвращает множество id из черного списка и избранного пользователя.
+
+        Множество загружается из БД один раз и дальше обновляется методами
+        добавления и удаления, поэтому проверка кандидата - O(1) без запросов к БД.
+
+        Параметры:
+            user_id (int): Идентификатор пользователя.
+
+        Возвращаемое значение:
+            Множество идентификаторов, которые не нужно показывать пользователю.
+        """
+        with self.exclusions_lock:
+            if user_id in self.exclusions:
+                self.exclusions.move_to_end(user_id)
+                return self.exclusions[user_id]
+        excluded = set(self.get_black_list_user_id(user_id) or [])
+        excluded.update(favourite["favourite_user_vk_id"] for favourite in self.get_favourites(user_id) or [])
+        with self.exclusions_lock:
+            self.exclusions[user_id] = excluded
+            while len(self.exclusions) > self.max_cached_exclusions:
+                self.exclusions.popitem(last=False)
+        return excluded
+
+    def _exclude(self, user_id: int, excluded_user_id: int) -> None:
+        """Добавляет id в закэшированное множество исключений пользователя, если оно загружено."""
+        with self.exclusions_lock:
+            if user_id in self.exclusions:
+                self.exclusions[user_id].add(int(excluded_user_id))
+
+    def _invalidate_exclusions(self, user_id: int) -> None:
+        """Сбрасывает множество исключений пользователя, оно будет загружено заново при следующем обращении."""
+        with self.exclusions_lock:
+            self.exclusions.pop(user_id, None)
+
+    @timed_query
+    def register_user(self, user_id: int, age: int, sex: int, city_id: Optional[int]) -> None:
         """
         Создает запись о пользователе в таблице users.
 
@@ -228,20 +799,32 @@ class DB_editor:
             user_id (int): Уникальный идентификатор пользователя в VK.
             age (int): Возраст пользователя.
             sex (int): Пол пользователя (1 или 2).
-            city_id (str): ID города пользователя или "Неизвестен".
+            city_id (Optional[int]): ID города пользователя или None, если город неизвестен.
         """
+        if user_id in self.registered_users:
+            return  # Запись уже есть, вставка ничего бы не изменила
+        if self.write_behind:
+            with self.pending_lock:
+                self.pending_users.setdefault(user_id, (age, sex, city_id))
+            self._enqueue(user_id)
+            return
         try:
-            self.cur.execute(
-                """
-            INSERT INTO users(user_id, age, sex, city_id) 
-            VALUES(%s, %s, %s, %s)
-            ON CONFLICT (user_id) DO NOTHING;
-            """,
-                (user_id, age, sex, city_id),
-            )
+            with self.cursor() as cur:
+                self.execute(
+                    cur,
+                    "register_user",
+                    """
+                INSERT INTO users(user_id, age, sex, city_id) 
+                VALUES(%s, %s, %s, %s)
+                ON CONFLICT (user_id) DO NOTHING
+                """,
+                    (user_id, age, sex, city_id),
+                )
+                self._mark_registered([user_id])
         except Exception as e:
             print(e)
 
+    @timed_query
     def add_to_black_list(self, user_id: int, black_list_user_id: int) -> None:
         """
         Добавляет пользователя в черный список.
@@ -251,18 +834,27 @@ class DB_editor:
             black_list_user_id (int): Уникальный идентификатор пользователя,
             которого необходимо добавить в черный список.
         """
+        if self.write_behind:
+            with self.pending_lock:
+                self.pending_black_list.add((user_id, black_list_user_id))
+            self._exclude(user_id, black_list_user_id)
+            self._enqueue(user_id)
+            return
         try:
-            self.cur.execute(
-                """
-            INSERT INTO black_list(user_id, black_list_user_id) 
-            VALUES(%s, %s)
-            ON CONFLICT (user_id, black_list_user_id) DO NOTHING;
-            """,
-                (user_id, black_list_user_id),
-            )
+            with self.cursor() as cur:
+                cur.execute(
+                    """
+                INSERT INTO black_list(user_id, black_list_user_id) 
+                VALUES(%s, %s)
+                ON CONFLICT (user_id, black_list_user_id) DO NOTHING;
+                """,
+                    (user_id, black_list_user_id),
+                )
+                self._exclude(user_id, black_list_user_id)
         except Exception as e:
             print(e)
 
+    @timed_query
     def add_to_favourites(
         self,
         user_id: int,
@@ -270,7 +862,7 @@ class DB_editor:
         last_name: str,
         favourite_user_vk_id: int,
         attachments: Optional[List[str]],
-    ) -> None:
+    ) -> Optional[int]:
         """
         Добавляет пользователя в избранное.
 
@@ -280,44 +872,51 @@ class DB_editor:
             last_name (str): Фамилия избранного пользователя.
             favourite_user_vk_id (int): VK ID профиля избранного пользователя.
             attachments (Optional[List[str]]): Список вложений (3 ссылки на фотографии).
+
+        Возвращаемое значение:
+            int: 1, если запись добавлена, 0, если она уже была; None в случае ошибки.
+                При отложенной записи - 1, если запись поставлена в буфер, 0, если она
+                уже ждала в буфере (есть ли она в базе, станет известно только при сбросе).
         """
+        if self.write_behind:
+            key = (user_id, favourite_user_vk_id)
+            with self.pending_lock:
+                buffered = int(key not in self.pending_favourites)
+                self.pending_favourites[key] = (name, last_name, attachments)
+            self._exclude(user_id, favourite_user_vk_id)
+            self._enqueue(user_id)
+            return buffered
         try:
-            self.cur.execute(
-                """
-            INSERT INTO favourite_users(name, last_name, favourite_user_vk_id, attachments) 
-            VALUES(%s, %s, %s, %s)
-            ON CONFLICT (favourite_user_vk_id) DO NOTHING;
-            """,
-                (name, last_name, favourite_user_vk_id, attachments if attachments else None),
-            )
-
-            # Получаем id последнего добавленного или существующего.favorite_user_id
-            self.cur.execute(
-                "SELECT favourite_user_id FROM favourite_users WHERE favourite_user_vk_id = %s",
-                (favourite_user_vk_id,),
-            )
-
-            favourite_user_id = self.cur.fetchone()
-
-            if (
-                favourite_user_id
-            ):  # Если пользователь был успешно добавлен или уже существует
-                favourite_user_id = favourite_user_id[0]  # Извлекаем id
-                # Теперь добавляем запись в таблицу favourites
-                self.cur.execute(
+            with self.cursor() as cur:
+                # Профиль избранного и связь с пользователем добавляются одним запросом:
+                # id профиля берется из вставленной строки или из уже существующей
+                cur.execute(
                     """
+                WITH inserted AS (
+                    INSERT INTO favourite_users(name, last_name, favourite_user_vk_id, attachments) 
+                    VALUES(%s, %s, %s, %s)
+                    ON CONFLICT (favourite_user_vk_id) DO NOTHING
+                    RETURNING favourite_user_id
+                ), favourite AS (
+                    SELECT favourite_user_id FROM inserted
+                    UNION ALL
+                    SELECT favourite_user_id FROM favourite_users WHERE favourite_user_vk_id = %s
+                )
                 INSERT INTO favourites(user_id, favourite_user_id) 
-                VALUES(%s, %s)
+                SELECT %s, favourite_user_id FROM favourite LIMIT 1
                 ON CONFLICT (user_id, favourite_user_id) DO NOTHING;
                 """,
-                    (user_id, favourite_user_id),
+                    (name, last_name, favourite_user_vk_id, attachments if attachments else None,
+                     favourite_user_vk_id, user_id),
                 )
-            else:
-                print("Error fetching favourite user ID.")
+                self._exclude(user_id, favourite_user_vk_id)
+                return cur.rowcount
 
         except Exception as e:
             print(e)
+            return None
 
+    @timed_query
     def get_favourites(self, user_id: int) -> Optional[List[dict]]:
         """
         Возвращает список избранных пользователей для указанного пользователя.
@@ -330,76 +929,94 @@ class DB_editor:
             имя (`name`), фамилию (`last_name`) и VK ID (`favourite_user_vk_id`) избранного пользователя,
             или None в случае ошибки.
         """
+        self._flush_pending(user_id)  # Сначала записываем отложенные вставки пользователя
         try:
-            self.cur.execute(
-                """
-            SELECT name, last_name, favourite_user_vk_id
-            FROM favourite_users
-            JOIN favourites ON favourite_users.favourite_user_id = favourites.favourite_user_id
-            WHERE user_id = %s
-            """,
-                (user_id,),
-            )
+            with self.cursor() as cur:
+                self.execute(
+                    cur,
+                    "get_favourites",
+                    """
+                SELECT name, last_name, favourite_user_vk_id
+                FROM favourite_users
+                JOIN favourites ON favourite_users.favourite_user_id = favourites.favourite_user_id
+                WHERE user_id = %s
+                """,
+                    (user_id,),
+                )
 
-            # Преобразуем результат в список словарей для удобства
-            result = self.cur.fetchall()
-            return [
-                {"name": row[0], "last_name": row[1], "favourite_user_vk_id": row[2]}
-                for row in result
-            ]
+                # Преобразуем результат в список словарей для удобства
+                result = cur.fetchall()
+                return [
+                    {"name": row[0], "last_name": row[1], "favourite_user_vk_id": row[2]}
+                    for row in result
+                ]
 
         except Exception as e:
             print(f"Error fetching favourites: {e}")
             return None
 
-    def get_user_city(self, user_id: int) -> str:
+    @timed_query
+    def get_user_city(self, user_id: int, default: Optional[int] = None) -> Optional[int]:
         """
         Получает город пользователя.
 
         Параметры:
             user_id (int): Идентификатор пользователя.
+            default (Optional[int]): Город, который возвращается, если пользователя нет в базе.
 
         Возвращаемое значение:
-            Название города пользователя или None в случае ошибки.
+            ID города пользователя, None, если город неизвестен или в случае ошибки,
+            или default, если пользователя нет в базе.
         """
+        self._flush_pending(user_id)  # Сначала записываем отложенные вставки пользователя
         try:
-            self.cur.execute(
-                """
-                SELECT city_id
-                FROM users
-                WHERE user_id = %s
-                """,
-                (user_id,),
-            )
-            result = self.cur.fetchone()
-            return result[0] if result else None  # Проверка на наличие результата
+            with self.cursor() as cur:
+                self.execute(
+                    cur,
+                    "get_user_city",
+                    """
+                    SELECT city_id
+                    FROM users
+                    WHERE user_id = %s
+                    """,
+                    (user_id,),
+                )
+                result = cur.fetchone()
+                if result:
+                    self._mark_registered([user_id])
+                return result[0] if result else default  # Проверка на наличие результата
         except Exception as e:
             print(f"Error fetching user city_id: {e}")
             return None
 
-    def update_user_city(self, user_id: int, city_id: str) -> None:
+    @timed_query
+    def update_user_city(self, user_id: int, city_id: Optional[int]) -> None:
         """
         Обновляет город пользователя.
 
         Параметры:
             user_id (int): Идентификатор пользователя.
+            city_id (Optional[int]): ID нового города или None, чтобы сбросить город.
 
         Возвращаемое значение:
             Новое название города, которое будет сохранено.
         """
+        self._flush_pending(user_id)  # Сначала записываем отложенные вставки пользователя
         try:
-            self.cur.execute(
-                """
-            UPDATE users
-            SET city_id = %s
-            WHERE user_id = %s;
-            """,
-                (city_id, user_id),
-            )
-            self.cur.connection.commit()
+            with self.cursor() as cur:
+                cur.execute(
+                    """
+                UPDATE users
+                SET city_id = %s
+                WHERE user_id = %s;
+                """,
+                    (city_id, user_id),
+                )
+                cur.connection.commit()
         except Exception as e:
             print(f"Error updating user city_id: {e}")
 
+    @timed_query
     def get_black_list_user_id(self, user_id: int) -> list[int] | None:
         """
         Получает список идентификаторов пользователей из черного списка для данного пользователя.
@@ -410,23 +1027,28 @@ class DB_editor:
         Возвращаемое значение:
             Список идентификаторов черного списка или None в случае ошибки.
         """
+        self._flush_pending(user_id)  # Сначала записываем отложенные вставки пользователя
         try:
-            self.cur.execute(
-                """
-            SELECT black_list_user_id
-            FROM black_list
-            WHERE user_id = %s
-            """,
-                (user_id,),
-            )
-            # Преобразуем результат в список
-            return [row[0] for row in self.cur.fetchall()]
+            with self.cursor() as cur:
+                self.execute(
+                    cur,
+                    "get_black_list_user_id",
+                    """
+                SELECT black_list_user_id
+                FROM black_list
+                WHERE user_id = %s
+                """,
+                    (user_id,),
+                )
+                # Преобразуем результат в список
+                return [row[0] for row in cur.fetchall()]
 
         except Exception as e:
             print(f"Error fetching black list: {e}")
             return None
         
-    def delete_last_favourite(self, user_id: int) -> bool:
+    @timed_query
+    def delete_last_favourite(self, user_id: int) -> Optional[int]:
         """
         Удаляет последнюю запись из списка избранного пользователя.
 
@@ -434,51 +1056,50 @@ class DB_editor:
             user_id (int): Идентификатор пользователя, для которого будет удалено последнее избранное.
 
         Возвращаемое значение:
-            bool: True, если запись успешно удалена; 
-                None, если запись отсутствует; 
-                или False в случае ошибки.
+            int: Количество удаленных записей (1 или 0, если список пуст);
+                None в случае ошибки.
         """
+        self._flush_pending(user_id)  # Сначала записываем отложенные вставки пользователя
         try:
-            self.cur.execute(
-                """
-                SELECT favourite_user_id FROM favourites 
-                WHERE user_id = %s 
-                ORDER BY favourite_user_id DESC 
-                LIMIT 1;
-            """,
-                (user_id,)
-            )
-            last_favourite = self.cur.fetchone()  # Получаем последнюю запись
-
-            if last_favourite:
-                favourite_user_id = last_favourite[0]  # ID последнего избранного пользователя
-                
-                self.cur.execute(
+            with self.cursor() as cur:
+                # Выбор последней записи, ее удаление и удаление профиля - одним запросом.
+                # Профиль удаляется, только если он больше ни у кого не в избранном
+                cur.execute(
                     """
-                    DELETE FROM favourites 
-                    WHERE user_id=%s AND favourite_user_id=%s;
+                    WITH last_favourite AS (
+                        SELECT favourite_user_id FROM favourites 
+                        WHERE user_id = %s 
+                        ORDER BY favourite_user_id DESC 
+                        LIMIT 1
+                    ), removed AS (
+                        DELETE FROM favourites 
+                        WHERE user_id = %s
+                            AND favourite_user_id IN (SELECT favourite_user_id FROM last_favourite)
+                        RETURNING favourite_user_id
+                    ), removed_users AS (
+                        DELETE FROM favourite_users 
+                        WHERE favourite_user_id IN (SELECT favourite_user_id FROM removed)
+                            AND NOT EXISTS (
+                                SELECT 1 FROM favourites
+                                WHERE favourites.favourite_user_id = favourite_users.favourite_user_id
+                                    AND favourites.user_id <> %s
+                            )
+                    )
+                    SELECT count(*) FROM removed;
                     """,
-                    (user_id, favourite_user_id)
+                    (user_id, user_id, user_id)
                 )
-
-                self.cur.execute(
-                    """
-                    DELETE FROM favourite_users 
-                    WHERE favourite_user_id=%s;
-                    """,
-                    (favourite_user_id,)
-                )
-
-                self.conn.commit() 
-                return True
-            else:
-                print("Нет записей для удаления.")
-                return None
+                deleted = cur.fetchone()[0]
+                self._invalidate_exclusions(user_id)
+                if not deleted:
+                    print("Нет записей для удаления.")
+                return deleted
         except Exception as e:
             print(f"Произошла ошибка: {e}")
             return None
         
-    def delete_all_favourites(self, user_id: int) -> bool:
+    @timed_query
+    def delete_all_favourites(self, user_id: int) -> Optional[int]:
         """
         Удаляет все записи из списка избранного пользователя.
 
@@ -486,47 +1107,43 @@ class DB_editor:
             user_id (int): Идентификатор пользователя, для которого будут удалены все избранные записи.
 
         Возвращаемое значение:
-            bool: True, если все записи успешно удалены;
-                False в случае ошибки.
+            int: Количество удаленных записей;
+                None в случае ошибки.
         """
+        self._flush_pending(user_id)  # Сначала записываем отложенные вставки пользователя
         try:
-            self.cur.execute(
-                """
-                    SELECT DISTINCT favourite_user_id FROM favourites
-                    WHERE user_id = %s;
-                """,
-                (user_id,)
-            )
-            favourite_user_ids = self.cur.fetchall()  # Получаем все уникальные favorite_user_id
-
-            self.cur.execute(
-                """
-                    DELETE FROM favourites
-                    WHERE user_id = %s;
-                """,
-                (user_id,)
-            )
-
-            for favourite_user_id in favourite_user_ids:
-                favourite_user_id = favourite_user_id[0]  # Извлекаем ID
-                self.cur.execute(
+            with self.cursor() as cur:
+                # Записи избранного и профили, которые больше ни у кого не в избранном, - одним запросом
+                cur.execute(
                     """
+                    WITH removed AS (
+                        DELETE FROM favourites
+                        WHERE user_id = %s
+                        RETURNING favourite_user_id
+                    ), removed_users AS (
                         DELETE FROM favourite_users
-                        WHERE favourite_user_id = %s;
+                        WHERE favourite_user_id IN (SELECT favourite_user_id FROM removed)
+                            AND NOT EXISTS (
+                                SELECT 1 FROM favourites
+                                WHERE favourites.favourite_user_id = favourite_users.favourite_user_id
+                                    AND favourites.user_id <> %s
+                            )
+                    )
+                    SELECT count(*) FROM removed;
                     """,
-                    (favourite_user_id,)
+                    (user_id, user_id)
                 )
-
-            self.conn.commit()
-            print(f"Все избранные записи для пользователя {user_id} удалены.")
-            return True
+                deleted = cur.fetchone()[0]
+                self._invalidate_exclusions(user_id)
+                print(f"Все избранные записи для пользователя {user_id} удалены.")
+                return deleted
 
         except Exception as e:
             print(f"Произошла ошибка: {e}")
-            self.conn.rollback()  # В случае ошибки откатить транзакцию
             return None
         
-    def delete_last_blocked(self, user_id: int) -> bool:
+    @timed_query
+    def delete_last_blocked(self, user_id: int) -> Optional[int]:
         """
         Удаляет последнюю запись из черного списка пользователя.
 
@@ -534,39 +1151,33 @@ class DB_editor:
             user_id (int): Идентификатор пользователя, для которого будет удален последний заблокированный.
 
         Возвращаемое значение:
-            bool: True, если запись успешно удалена;
-                False в случае ошибки.
+            int: Количество удаленных записей (1 или 0, если список пуст);
+                None в случае ошибки.
         """
+        self._flush_pending(user_id)  # Сначала записываем отложенные вставки пользователя
         try:
-            self.cur.execute(
-                """
-                SELECT black_list_id FROM black_list 
-                WHERE user_id = %s 
-                ORDER BY black_list_id DESC 
-                LIMIT 1;
-            """,
-                (user_id,)
-            )
-            last_blocked = self.cur.fetchone()  # Получаем последнюю запись
-
-            if last_blocked:
-                black_list_id = last_blocked[0]  # ID последнего избранного пользователя
-                
-                self.cur.execute(
+            with self.cursor() as cur:
+                cur.execute(
                     """
+                    WITH last_blocked AS (
+                        SELECT black_list_id FROM black_list 
+                        WHERE user_id = %s 
+                        ORDER BY black_list_id DESC 
+                        LIMIT 1
+                    )
                     DELETE FROM black_list  
-                    WHERE user_id=%s AND black_list_id=%s;
+                    WHERE black_list_id IN (SELECT black_list_id FROM last_blocked);
                     """,
-                    (user_id, black_list_id)
+                    (user_id,)
                 )
-            self.conn.commit() 
-            return True
+                self._invalidate_exclusions(user_id)
+                return cur.rowcount
         except Exception as e:
             print(f"Произошла ошибка: {e}")
-            self.conn.rollback()  # В случае ошибки откатить транзакцию
             return None
         
-    def delete_all_blocked(self, user_id: int) -> bool:
+    @timed_query
+    def delete_all_blocked(self, user_id: int) -> Optional[int]:
         """
         Удаляет все записи из черного списка пользователя.
 
@@ -574,25 +1185,25 @@ class DB_editor:
             user_id (int): Идентификатор пользователя, для которого будут удалены все заблокированные записи.
 
         Возвращаемое значение:
-            bool: True, если все записи успешно удалены; 
-                False в случае ошибки.
+            int: Количество удаленных записей;
+                None в случае ошибки.
         """
+        self._flush_pending(user_id)  # Сначала записываем отложенные вставки пользователя
         try:
-            self.cur.execute(
-                """
-                DELETE FROM black_list 
-                WHERE user_id = %s;
-                """,
-                (user_id,)
-            )
-            
-            self.conn.commit()
-            print(f"Все записи из black_list для пользователя {user_id} удалены.")
-            return True
+            with self.cursor() as cur:
+                cur.execute(
+                    """
+                    DELETE FROM black_list 
+                    WHERE user_id = %s;
+                    """,
+                    (user_id,)
+                )
+                self._invalidate_exclusions(user_id)
+                print(f"Все записи из black_list для пользователя {user_id} удалены.")
+                return cur.rowcount
             
         except Exception as e:
             print(f"Произошла ошибка: {e}")
-            self.conn.rollback()  # В случае ошибки откатить транзакцию
             return None
         
 
@@ -601,10 +1212,10 @@ def test_create_db():
     Для отлатки класса DB_creator
     """
     DB_creator.create_database(database)  # создаём базу данных
-    with DB_creator(database) as db:
+    with DB_migrator(database) as db:
         print("Status OK" if db.conn.closed == 0 else "Connection is closed")
         db.del_table()  # удаляем таблицы
-        db.create_tables()  # создаём таблицы
+        db.migrate()  # создаём таблицы и применяем миграции
 
         print("Completed!")
     print("Connection is closed" if db.conn.closed == 1 else "Close connection!")
@@ -616,7 +1227,7 @@ def test_edit_db():
     """
     # данные нашего пользователя (получает бот)
     vk_id = 1
-    vk_user_city = "Санкт-Петербург"
+    vk_user_city = 2  # Санкт-Петербург
     vk_user_sex = 2
     vk_user_age = 32
     vk_user = DB_editor(database)
@@ -651,7 +1262,18 @@ def test_edit_db():
     print(vk_user.get_favourites(vk_id))
 
 
+def migrate_db():
+    """
+    Применяет недостающие миграции к существующей БД без удаления данных
+    """
+    with DB_migrator(database) as db:
+        db.migrate()
+
+
 if __name__ == "__main__":
     database = "vkinder"
-    test_create_db()
+    if sys.argv[1:] == ["migrate"]:
+        migrate_db()
+    else:
+        test_create_db()
     # test_edit_db()
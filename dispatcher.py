@@ -0,0 +1,147 @@
+import queue
+import threading
+import time
+
+from metrics import counter, gauge, histogram
+from tracing import trace
+
+BOT_EVENTS = counter("bot_events_total", "Обработанные события (status: ok или error)", ("status",))
+BOT_EVENT_SECONDS = histogram("bot_event_seconds", "Время от получения события до конца обработки, секунды")
+BOT_EVENT_HANDLE_SECONDS = histogram("bot_event_handle_seconds", "Время работы обработчика события, секунды")
+
+
+class EventDispatcher:
+    """
+    Распределяет события long-poll по пулу рабочих потоков.
+
+    Событие попадает в очередь потока, выбранного по хешу event.user_id,
+    поэтому события одного пользователя обрабатываются строго по порядку,
+    а события разных пользователей - параллельно. Очереди ограничены:
+    если очередь потока заполнена, submit ждет, и чтение long-poll
+    приостанавливается, а не копит события в памяти. С timeout submit
+    вместо ожидания отказывает, и источник события может повторить его позже.
+
+    Методы:
+        submit: Ставит событие в очередь его рабочего потока.
+        stats: Метрики очередей и времени обработки.
+        shutdown: Дожидается обработки принятых событий и останавливает потоки.
+    """
+
+    _stop = object()  # Маркер остановки рабочего потока
+
+    def __init__(self, handler, workers: int = 8, queue_size: int = 100) -> None:
+        """
+        Параметры:
+            handler: Функция обработки одного события.
+            workers (int): Число рабочих потоков.
+            queue_size (int): Максимальная длина очереди одного потока.
+        """
+        self.handler = handler
+        self.queues = [queue.Queue(maxsize=queue_size) for _ in range(workers)]
+        self.lock = threading.Lock()
+        self.submitted = 0
+        self.rejected = 0  # События, не принятые из-за заполненной очереди
+        self.processed = 0
+        self.errors = 0  # События, обработка которых завершилась исключением
+        self.max_depth = 0  # Самая длинная очередь потока, замеченная при постановке события
+        self.total_time = 0.0  # Суммарное время от постановки в очередь до конца обработки, секунды
+        self.max_time = 0.0
+        self.handle_time = 0.0  # Суммарное время работы обработчика, секунды
+        self.threads = [
+            threading.Thread(target=self._work, args=(events,), name=f"dispatcher-{number}", daemon=True)
+            for number, events in enumerate(self.queues)
+        ]
+        for thread in self.threads:
+            thread.start()
+        gauge(
+            "bot_dispatcher_queue_depth", "События в очередях рабочих потоков",
+            callback=lambda: sum(events.qsize() for events in self.queues)
+        )
+
+    def submit(self, event, timeout: float = None) -> bool:
+        """
+        Ставит событие в очередь рабочего потока его пользователя.
+
+        Параметры:
+            event: Событие long-poll; события без user_id попадают в один и тот же поток.
+            timeout (float): Сколько ждать места в заполненной очереди; None - ждать без ограничения,
+                0 - не ждать.
+
+        Возвращаемое значение:
+            True, если событие принято; False, если очередь так и осталась заполненной.
+        """
+        events = self.queues[hash(getattr(event, "user_id", None)) % len(self.queues)]
+        try:
+            events.put((time.perf_counter(), event), timeout=timeout)
+        except queue.Full:
+            with self.lock:
+                self.rejected += 1
+            return False
+        with self.lock:
+            self.submitted += 1
+            self.max_depth = max(self.max_depth, events.qsize())
+        return True
+
+    def _work(self, events: queue.Queue) -> None:
+        """Обрабатывает события из очереди потока до получения маркера остановки."""
+        while True:
+            item = events.get()
+            if item is self._stop:
+                return
+            queued, event = item
+            started = time.perf_counter()
+            failed = False
+            try:
+                # Корневой span трассы события (если событие попало в выборку)
+                user_id = getattr(event, "user_id", None)
+                with trace("event", user_id=user_id, queue_wait_ms=round((started - queued) * 1000, 3)):
+                    self.handler(event)
+            except Exception as e:
+                failed = True  # Ошибка одного события не должна останавливать поток
+                print(f"Error processing event: {e}")
+            finished = time.perf_counter()
+            BOT_EVENTS.inc("error" if failed else "ok")
+            BOT_EVENT_SECONDS.observe(finished - queued)
+            BOT_EVENT_HANDLE_SECONDS.observe(finished - started)
+            with self.lock:
+                self.processed += 1
+                self.errors += failed
+                self.total_time += finished - queued
+                self.max_time = max(self.max_time, finished - queued)
+                self.handle_time += finished - started
+
+    def stats(self) -> dict:
+        """
+        Возвращает метрики диспетчера.
+
+        Возвращаемое значение:
+            Словарь с текущей длиной очереди каждого потока, максимальной замеченной длиной,
+            числом принятых, отклоненных, обработанных и упавших событий, средним и максимальным временем
+            от постановки в очередь до конца обработки и средним временем работы обработчика (секунды).
+        """
+        with self.lock:
+            processed = self.processed or 1
+            return {
+                "queue_depth": [events.qsize() for events in self.queues],
+                "max_queue_depth": self.max_depth,
+                "submitted": self.submitted,
+                "rejected": self.rejected,
+                "processed": self.processed,
+                "errors": self.errors,
+                "avg_time": round(self.total_time / processed, 4),
+                "max_time": round(self.max_time, 4),
+                "avg_handle_time": round(self.handle_time / processed, 4),
+            }
+
+    def shutdown(self, wait: bool = True) -> None:
+        """
+        Останавливает рабочие потоки после обработки уже принятых событий.
+
+        Параметры:
+            wait (bool): Ждать ли завершения потоков.
+        """
+        for events in self.queues:
+            events.put(self._stop)
+        if wait:
+            for thread in self.threads:
+                thread.join()
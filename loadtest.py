@@ -0,0 +1,682 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from vk_api.longpoll import VkEventType
+
+from VK_async import AsyncVkApi, AsyncVkBot
+from VK_bot import VkBot
+from VK_class import My_VkApi
+from city_index import CityIndex
+from db_tools import DB_QUERY_SECONDS, DB_editor, timed_query
+from dispatcher import EventDispatcher
+from rate_limiter import GROUP_TOKEN_RPS, USER_TOKEN_RPS, get_limiter
+
+USER_TOKEN = "loadtest-user-token"  # Ключи, которые получает бот в нагрузочном тесте
+GROUP_TOKEN = "loadtest-group-token"
+
+# Сценарий пользователя: тексты сообщений по порядку
+SCRIPT = (
+    "Начать",
+    "Поиск пары",
+    "Пропустить",
+    "Пропустить",
+    "Добавить в избранное",
+    "Пропустить",
+    "Добавить в Чёрный список",
+    "Просмотреть избранное",
+    "Убрать последнюю запись",
+    "Вернуться в главное меню",
+)
+
+
+class FakeVkHandler(BaseHTTPRequestHandler):
+    """Обрабатывает запросы к методам API фейкового сервера VK."""
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self) -> None:
+        self._handle()
+
+    def do_POST(self) -> None:
+        self._handle()
+
+    def _handle(self) -> None:
+        url = urlparse(self.path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            params.update({key: values[0] for key, values in parse_qs(self.rfile.read(length).decode()).items()})
+        method = url.path.rsplit("/", 1)[-1]
+        body = self.server.api.check(params) if method == "longpoll" else self.server.api.call(method, params)
+        data = json.dumps(body, ensure_ascii=False).encode()
+        try:
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        except ConnectionError:
+            pass  # Клиент закрыл соединение, не дождавшись ответа long poll (остановка бота)
+
+    def log_message(self, format, *args) -> None:
+        pass  # Не пишем в консоль каждый запрос
+
+
+class FakeVkApi:
+    """
+    Локальный сервер, отвечающий как API VK на методы, которые вызывает бот:
+    users.get, users.search, photos.get, database.getCities, database.getCitiesById,
+    messages.send, messages.getLongPollServer и execute с этими методами внутри.
+    По адресу /longpoll сервер отвечает как сервер User Long Poll (версия 3):
+    отдает сообщения, поставленные через push, для AsyncLongPoll и VkLongPoll.
+
+    Каждый HTTP-запрос ждет latency (плюс случайный разброс jitter) и с
+    вероятностью error_rate возвращает временную ошибку VK (6 или 10), которую
+    клиент повторяет. Ответы детерминированы по id пользователя: у каждого
+    no_city_every-го пользователя город в профиле не указан.
+
+    Методы:
+        start: Запускает сервер в фоновом потоке.
+        call: Отвечает на вызов метода.
+        push: Ставит входящее сообщение пользователя в очередь long poll.
+        check: Отвечает на запрос событий long poll.
+        stats: Число HTTP-запросов и вызовов по методам.
+        close: Останавливает сервер.
+    """
+
+    search_total = 1000  # Сколько кандидатов находит users.search
+
+    def __init__(self, latency: float = 0.02, jitter: float = 0.01, error_rate: float = 0.0,
+                 no_city_every: int = 5, seed: int = None) -> None:
+        """
+        Параметры:
+            latency (float): Задержка ответа, секунды.
+            jitter (float): Максимальная случайная добавка к задержке, секунды.
+            error_rate (float): Доля запросов, на которые возвращается временная ошибка.
+            no_city_every (int): У каждого какого пользователя нет города в профиле (0 - у всех есть).
+            seed (int): Начальное значение генератора случайных чисел.
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.no_city_every = no_city_every
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = Counter()  # Метод -> число HTTP-запросов
+        self.calls = Counter()  # Метод -> число вызовов, включая вызовы внутри execute
+        self.errors = Counter()  # Метод -> число внедренных ошибок
+        self.server = None
+        self.url = None
+        self.updates = []  # События long poll; номер события (ts) - индекс в списке
+        self.longpoll = threading.Condition()
+        self.closed = False
+
+    def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """
+        Запускает сервер в фоновом потоке.
+
+        Возвращаемое значение:
+            Адрес сервера для My_VkApi.host.
+        """
+        self.server = ThreadingHTTPServer((host, port), FakeVkHandler)
+        self.server.daemon_threads = True
+        self.server.api = self
+        threading.Thread(target=self.server.serve_forever, name="fake-vk", daemon=True).start()
+        self.url = f"http://{host}:{self.server.server_port}"
+        return self.url
+
+    def close(self) -> None:
+        """Останавливает сервер."""
+        with self.longpoll:
+            self.closed = True
+            self.longpoll.notify_all()  # Не держим ожидающие запросы long poll
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+    def _failed(self, method: str) -> dict | None:
+        """С вероятностью error_rate возвращает временную ошибку VK для метода."""
+        with self.lock:
+            if self.random.random() >= self.error_rate:
+                return None
+            self.errors[method] += 1
+            code = self.random.choice((6, 10))
+        return {"error_code": code, "error_msg": "Injected by load test"}
+
+    def call(self, method: str, params: dict) -> dict:
+        """
+        Отвечает на вызов метода API.
+
+        Параметры:
+            method (str): Название метода, например, users.get.
+            params (dict): Параметры запроса.
+
+        Возвращаемое значение:
+            Тело ответа: {"response": ...} или {"error": ...}.
+        """
+        with self.lock:
+            self.requests[method] += 1
+        time.sleep(self.latency + self.random.uniform(0, self.jitter))
+        error = self._failed(method)
+        if error is not None:
+            return {"error": error}
+        if method == "execute":
+            return self._execute(params["code"])
+        return {"response": self._response(method, params)}
+
+    def push(self, user_id: int, text: str) -> int:
+        """
+        Ставит входящее сообщение пользователя в очередь long poll.
+
+        Параметры:
+            user_id (int): Отправитель.
+            text (str): Текст сообщения.
+
+        Возвращаемое значение:
+            id сообщения (message_id события).
+        """
+        with self.longpoll:
+            message_id = len(self.updates) + 1
+            # [4, message_id, флаги, peer_id, время, текст, доп. поля]: флаг 1 - непрочитанное входящее
+            self.updates.append([VkEventType.MESSAGE_NEW.value, message_id, 1, user_id, int(time.time()), text, {}])
+            self.longpoll.notify_all()
+        return message_id
+
+    def check(self, params: dict) -> dict:
+        """
+        Отвечает на запрос событий long poll (act=a_check).
+
+        Ждет новых событий не дольше wait секунд, как сервер VK.
+
+        Параметры:
+            params (dict): Параметры запроса: ts, wait.
+
+        Возвращаемое значение:
+            {"ts": ..., "updates": [...]}.
+        """
+        ts = int(params.get("ts", 0))
+        with self.longpoll:
+            self.longpoll.wait_for(lambda: len(self.updates) > ts or self.closed, float(params.get("wait", 25)))
+            return {"ts": len(self.updates), "updates": self.updates[ts:]}
+
+    def _execute(self, code: str) -> dict:
+        """Выполняет вызовы из кода execute вида API.метод({...}); ошибки вызовов - в execute_errors."""
+        decoder = json.JSONDecoder()
+        results, errors = [], []
+        position = code.find("API.")
+        while position != -1:
+            bracket = code.index("(", position)
+            method = code[position + 4:bracket]
+            params, end = decoder.raw_decode(code, bracket + 1)
+            error = self._failed(method)
+            if error is None:
+                results.append(self._response(method, {key: str(value) for key, value in params.items()}))
+            else:
+                results.append(False)
+                errors.append({**error, "method": method})
+            position = code.find("API.", end)
+        response = {"response": results}
+        if errors:
+            response["execute_errors"] = errors
+        return response
+
+    def _profile(self, user_id: int) -> dict:
+        profile = {
+            "id": user_id,
+            "first_name": f"Имя{user_id}",
+            "last_name": f"Фамилия{user_id}",
+            "sex": 1 + user_id % 2,
+            "bdate": f"1.1.{1980 + user_id % 20}",
+        }
+        if not (self.no_city_every and user_id % self.no_city_every == 0):
+            profile["city"] = {"id": 1, "title": "Москва"}
+        return profile
+
+    def _response(self, method: str, params: dict):
+        with self.lock:
+            self.calls[method] += 1
+        if method == "users.get":
+            user_ids = params.get("user_ids") or params.get("user_id")
+            return [self._profile(int(user_id)) for user_id in str(user_ids).split(",")]
+        if method == "users.search":
+            offset = int(params.get("offset", 0))
+            count = max(0, min(int(params.get("count", 20)), self.search_total - offset))
+            # Кандидаты не пересекаются с симулируемыми пользователями
+            return {"count": self.search_total, "items": [self._profile(10 ** 6 + offset + i) for i in range(count)]}
+        if method == "photos.get":
+            owner_id = int(params["owner_id"])
+            items = [{"owner_id": owner_id, "id": photo_id, "likes": {"count": (owner_id * photo_id) % 97}}
+                     for photo_id in range(1, 6)]
+            return {"count": len(items), "items": items}
+        if method == "database.getCities":
+            title = params.get("q", "")
+            return {"count": 1, "items": [{"id": 1000 + sum(map(ord, title)) % 1000, "title": title}]}
+        if method == "database.getCitiesById":
+            return [{"id": int(city_id), "title": f"Город {city_id}"} for city_id in str(params["city_ids"]).split(",")]
+        if method == "messages.send":
+            return int(params.get("random_id", 0)) or 1
+        if method == "messages.getLongPollServer":
+            with self.longpoll:
+                return {"key": "loadtest", "server": f"{self.url}/longpoll", "ts": len(self.updates)}
+        return 1
+
+    def stats(self) -> dict:
+        """
+        Возвращает счетчики сервера.
+
+        Возвращаемое значение:
+            Словарь с числом HTTP-запросов, вызовов (включая вызовы внутри execute)
+            и внедренных ошибок по методам.
+        """
+        with self.lock:
+            return {"requests": dict(self.requests), "calls": dict(self.calls), "errors": dict(self.errors)}
+
+
+class MemoryDatabase:
+    """
+    Хранилище в памяти с методами DB_editor, которые вызывает бот.
+
+    Нужно, чтобы нагрузочный тест не требовал PostgreSQL. Методы обернуты
+    timed_query, поэтому вызовы учитываются в той же метрике db_query_seconds,
+    что и вызовы DB_editor.
+    """
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.cities = dict()  # user_id -> city_id
+        self.favourites = dict()  # user_id -> [(имя, фамилия, VK ID)]
+        self.black_list = dict()  # user_id -> [VK ID]
+
+    @timed_query
+    def register_user(self, user_id: int, age: int, sex: int, city_id: int | None) -> None:
+        with self.lock:
+            self.cities.setdefault(user_id, city_id)
+
+    @timed_query
+    def get_user_city(self, user_id: int, default: int | None = None) -> int | None:
+        with self.lock:
+            return self.cities.get(user_id, default)
+
+    @timed_query
+    def update_user_city(self, user_id: int, city_id: int | None) -> None:
+        with self.lock:
+            self.cities[user_id] = city_id
+
+    @timed_query
+    def get_excluded_ids(self, user_id: int) -> set:
+        with self.lock:
+            return set(self.black_list.get(user_id, ())) | {vk_id for _, _, vk_id in self.favourites.get(user_id, ())}
+
+    @timed_query
+    def add_to_favourites(self, user_id: int, name: str, last_name: str, favourite_user_vk_id: int,
+                          attachments: str = None) -> None:
+        with self.lock:
+            self.favourites.setdefault(user_id, []).append((name, last_name, favourite_user_vk_id))
+
+    @timed_query
+    def add_to_black_list(self, user_id: int, black_list_user_id: int) -> None:
+        with self.lock:
+            self.black_list.setdefault(user_id, []).append(black_list_user_id)
+
+    @timed_query
+    def get_favourites(self, user_id: int) -> list[dict]:
+        with self.lock:
+            return [
+                {"name": name, "last_name": last_name, "favourite_user_vk_id": vk_id}
+                for name, last_name, vk_id in self.favourites.get(user_id, ())
+            ]
+
+    @timed_query
+    def get_black_list_user_id(self, user_id: int) -> list[int]:
+        with self.lock:
+            return list(self.black_list.get(user_id, ()))
+
+    @timed_query
+    def delete_last_favourite(self, user_id: int) -> int | None:
+        with self.lock:
+            favourites = self.favourites.get(user_id)
+            return favourites.pop()[2] if favourites else None
+
+    @timed_query
+    def delete_all_favourites(self, user_id: int) -> int:
+        with self.lock:
+            return len(self.favourites.pop(user_id, ()))
+
+    @timed_query
+    def delete_last_blocked(self, user_id: int) -> int | None:
+        with self.lock:
+            blocked = self.black_list.get(user_id)
+            return blocked.pop() if blocked else None
+
+    @timed_query
+    def delete_all_blocked(self, user_id: int) -> int:
+        with self.lock:
+            return len(self.black_list.pop(user_id, ()))
+
+    def close(self) -> None:
+        pass
+
+
+class SimulatedEvent:
+    """Новое сообщение от симулируемого пользователя в том виде, который ожидает VkBot.process_event."""
+
+    def __init__(self, user_id: int, text: str) -> None:
+        self.type = VkEventType.MESSAGE_NEW
+        self.to_me = True
+        self.user_id = user_id
+        self.text = text
+        self.done = threading.Event()  # Устанавливается, когда событие обработано
+        self.failed = False
+
+
+def percentile(values: list[float], q: float) -> float:
+    """
+    Возвращает квантиль по отсортированному списку (ближайший ранг).
+
+    Параметры:
+        values (list[float]): Отсортированные значения.
+        q (float): Квантиль от 0 до 1.
+    """
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, max(0, round(q * len(values)) - 1))]
+
+
+def query_counts() -> Counter:
+    """Возвращает число вызовов методов БД из метрики db_query_seconds."""
+    with DB_QUERY_SECONDS.lock:
+        return Counter({key[0]: histogram.count for key, histogram in DB_QUERY_SECONDS.values.items()})
+
+
+@contextmanager
+def fake_vk(api: FakeVkApi, vk_rps: float = 0.0):
+    """
+    Направляет клиенты VK (синхронный и асинхронный) на фейковый сервер.
+
+    На время работы подменяет адрес API и справочник городов (временный файл,
+    чтобы не менять cities.json) и задает скорость ограничителей ключей.
+
+    Параметры:
+        api (FakeVkApi): Запущенный фейковый сервер.
+        vk_rps (float): Лимит запросов в секунду на ключ; 0 - без лимита.
+
+    Возвращаемое значение:
+        Путь к временному файлу с ключами для конструктора бота.
+    """
+    saved = (My_VkApi.host, My_VkApi.cities, AsyncVkApi.host, AsyncVkApi.cities)
+    cities_dir = tempfile.TemporaryDirectory()
+    My_VkApi.host = AsyncVkApi.host = api.url
+    My_VkApi.cities = AsyncVkApi.cities = CityIndex(os.path.join(cities_dir.name, "cities.json"))
+    # Ограничители ключей создаются с лимитами VK, как у бота, а скорость меняется на заданную
+    for token, limit in ((USER_TOKEN, USER_TOKEN_RPS), (GROUP_TOKEN, GROUP_TOKEN_RPS)):
+        get_limiter(token, limit).set_rate(vk_rps or 10 ** 9)
+    token_path = os.path.join(cities_dir.name, "token.json")
+    with open(token_path, "w") as token_file:
+        json.dump({"group_access_token": GROUP_TOKEN, "access_token": USER_TOKEN}, token_file)
+    try:
+        yield token_path
+    finally:
+        My_VkApi.host, My_VkApi.cities, AsyncVkApi.host, AsyncVkApi.cities = saved
+        cities_dir.cleanup()
+
+
+def user_script(user_id: int, rounds: int, no_city_every: int) -> tuple:
+    """Возвращает сообщения пользователя: пользователи без города в профиле сначала называют город."""
+    script = SCRIPT * rounds
+    if no_city_every and user_id % no_city_every == 0:
+        script = (f"Город{user_id % 10}",) + script
+    return script
+
+
+def report(latencies: list[tuple], elapsed: float, api: FakeVkApi, db_calls: Counter) -> dict:
+    """
+    Составляет общую часть отчета нагрузочного теста.
+
+    Параметры:
+        latencies (list[tuple]): Пары (задержка события, завершилось ли оно ошибкой).
+        elapsed (float): Длительность теста, секунды.
+        api (FakeVkApi): Фейковый сервер со счетчиками.
+        db_calls (Counter): Вызовы методов БД за время теста.
+    """
+    events = len(latencies)
+    durations = sorted(duration for duration, _ in latencies)
+    vk = api.stats()
+    per_event = events or 1
+    return {
+        "events": events,
+        "errors": sum(failed for _, failed in latencies),
+        "seconds": round(elapsed, 3),
+        "throughput": round(events / elapsed, 1) if elapsed else 0.0,
+        "latency": {
+            "p50": round(percentile(durations, 0.5), 4),
+            "p95": round(percentile(durations, 0.95), 4),
+            "p99": round(percentile(durations, 0.99), 4),
+            "max": round(durations[-1], 4) if durations else 0.0,
+        },
+        "vk_requests_per_event": round(sum(vk["requests"].values()) / per_event, 2),
+        "vk_calls_per_event": {method: round(count / per_event, 3) for method, count in sorted(vk["calls"].items())},
+        "db_calls_per_event": round(sum(db_calls.values()) / per_event, 2),
+        "db_methods_per_event": {method: round(count / per_event, 3) for method, count in sorted(db_calls.items())},
+        "vk": vk,
+    }
+
+
+def run(users: int = 20, rounds: int = 3, workers: int = 8, latency: float = 0.02, jitter: float = 0.01,
+        error_rate: float = 0.0, vk_rps: float = 0.0, no_city_every: int = 5, postgres: bool = False,
+        seed: int = None) -> dict:
+    """
+    Прогоняет бота под нагрузкой и возвращает отчет.
+
+    users пользователей одновременно отправляют сообщения сценария SCRIPT
+    (rounds повторов); каждый ждет обработки своего сообщения, прежде чем
+    отправить следующее, как живой пользователь ждет ответа. Пользователи
+    без города в профиле сначала отправляют название города. События идут
+    через EventDispatcher, как в VK_bot.py, поэтому задержка события включает
+    ожидание в очереди рабочего потока.
+
+    Параметры:
+        users (int): Число симулируемых пользователей.
+        rounds (int): Сколько раз каждый пользователь проходит сценарий.
+        workers (int): Число рабочих потоков диспетчера.
+        latency (float): Задержка ответа фейкового VK, секунды.
+        jitter (float): Случайная добавка к задержке, секунды.
+        error_rate (float): Доля запросов к VK, завершающихся временной ошибкой.
+        vk_rps (float): Лимит запросов в секунду на ключ; 0 - без лимита (мерим бота, а не лимиты VK).
+        no_city_every (int): У каждого какого пользователя нет города в профиле (0 - у всех есть).
+        postgres (bool): Использовать DB_editor с базой из settings.ini вместо хранилища в памяти.
+        seed (int): Начальное значение генератора случайных чисел.
+
+    Возвращаемое значение:
+        Словарь: число событий и ошибок, пропускная способность (событий в секунду),
+        задержки p50/p95/p99/max (секунды), запросы к VK и вызовы БД на событие
+        и счетчики фейкового VK, диспетчера и очереди отправки.
+    """
+    api = FakeVkApi(latency, jitter, error_rate, no_city_every, seed)
+    api.start()
+    with fake_vk(api, vk_rps) as token_path:
+        database = DB_editor(write_behind=True) if postgres else MemoryDatabase()
+        bot = VkBot(token_path, use_longpoll=False, database=database)
+        db_before = query_counts()
+        latencies, elapsed, dispatcher = _run_threads(bot, users, rounds, workers, no_city_every)
+        bot.outbox.close()  # Дожидаемся отправки сообщений, чтобы учесть messages.send
+        bot.prefetcher.shutdown()
+        bot.database.close()
+        db_calls = query_counts() - db_before
+    api.close()
+    return {
+        **report(latencies, elapsed, api, db_calls),
+        "dispatcher": dispatcher.stats(),
+        "outbox": bot.outbox.stats(),
+        "prefetch": bot.prefetcher.stats(),
+    }
+
+
+def _run_threads(bot: VkBot, users: int, rounds: int, workers: int, no_city_every: int) -> tuple:
+    """Прогоняет сценарии пользователей через EventDispatcher; возвращает задержки, время и диспетчер."""
+    latencies = []
+    latencies_lock = threading.Lock()
+
+    def handle(event: SimulatedEvent) -> None:
+        try:
+            bot.process_event(event)
+        except Exception:
+            event.failed = True
+            raise  # Ошибку учтет и напечатает диспетчер
+        finally:
+            event.done.set()
+
+    def simulate(user_id: int) -> None:
+        for text in user_script(user_id, rounds, no_city_every):
+            event = SimulatedEvent(user_id, text)
+            submitted = time.perf_counter()
+            dispatcher.submit(event)
+            event.done.wait()
+            with latencies_lock:
+                latencies.append((time.perf_counter() - submitted, event.failed))
+
+    dispatcher = EventDispatcher(handle, workers=workers, queue_size=100)
+    threads = [threading.Thread(target=simulate, args=(user_id,), daemon=True) for user_id in range(1, users + 1)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    dispatcher.shutdown()
+    return latencies, elapsed, dispatcher
+
+
+def run_async(users: int = 20, rounds: int = 3, latency: float = 0.02, jitter: float = 0.01,
+              error_rate: float = 0.0, vk_rps: float = 0.0, no_city_every: int = 5, max_inflight: int = 1000,
+              seed: int = None) -> dict:
+    """
+    Прогоняет AsyncVkBot под нагрузкой и возвращает отчет в том же формате, что и run.
+
+    Сообщения пользователей приходят боту так же, как в работе: через
+    messages.getLongPollServer и запросы AsyncLongPoll к фейковому серверу.
+    Пользователь отправляет следующее сообщение, когда бот обработал
+    предыдущее; задержка события включает доставку через long poll.
+
+    Параметры:
+        users (int): Число симулируемых пользователей.
+        rounds (int): Сколько раз каждый пользователь проходит сценарий.
+        latency (float): Задержка ответа фейкового VK, секунды.
+        jitter (float): Случайная добавка к задержке, секунды.
+        error_rate (float): Доля запросов к VK, завершающихся временной ошибкой.
+        vk_rps (float): Лимит запросов в секунду на ключ; 0 - без лимита.
+        no_city_every (int): У каждого какого пользователя нет города в профиле (0 - у всех есть).
+        max_inflight (int): Сколько событий бот обрабатывает одновременно.
+        seed (int): Начальное значение генератора случайных чисел.
+
+    Возвращаемое значение:
+        Словарь с теми же полями, что у run, и счетчиками команд бота.
+    """
+    api = FakeVkApi(latency, jitter, error_rate, no_city_every, seed)
+    api.start()
+    with fake_vk(api, vk_rps) as token_path:
+        result = asyncio.run(_run_async_bot(api, token_path, users, rounds, no_city_every, max_inflight))
+    api.close()
+    latencies, elapsed, db_calls, router_stats = result
+    return {**report(latencies, elapsed, api, db_calls), "router": router_stats}
+
+
+async def _run_async_bot(api: FakeVkApi, token_path: str, users: int, rounds: int, no_city_every: int,
+                         max_inflight: int) -> tuple:
+    """Запускает AsyncVkBot.run и сценарии пользователей в одном цикле событий."""
+    bot = AsyncVkBot(token_path, max_inflight=max_inflight, database=MemoryDatabase())
+    processed = dict()  # message_id -> asyncio.Event
+    failed = set()
+    process_event = bot.process_event
+
+    async def tracked(event) -> None:
+        try:
+            await process_event(event)
+        except Exception:
+            failed.add(event.message_id)
+            raise  # Ошибку учтет и напечатает AsyncVkBot
+        finally:
+            processed.setdefault(event.message_id, asyncio.Event()).set()
+
+    bot.process_event = tracked
+    latencies = []
+
+    async def simulate(user_id: int) -> None:
+        for text in user_script(user_id, rounds, no_city_every):
+            submitted = time.perf_counter()
+            message_id = api.push(user_id, text)  # Не ждет: только ставит событие в очередь
+            await processed.setdefault(message_id, asyncio.Event()).wait()
+            latencies.append((time.perf_counter() - submitted, message_id in failed))
+
+    # Как и VK, long poll отдает только события после получения ts: подключаемся до первых сообщений
+    await bot.longpoll.update_longpoll_server()
+    db_before = query_counts()
+    runner = asyncio.create_task(bot.run())
+    started = time.perf_counter()
+    await asyncio.gather(*(simulate(user_id) for user_id in range(1, users + 1)))
+    elapsed = time.perf_counter() - started
+    runner.cancel()  # AsyncVkBot.run дорабатывает начатые события и закрывает соединения
+    await asyncio.gather(runner, return_exceptions=True)
+    return latencies, elapsed, query_counts() - db_before, bot.router.stats()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Нагрузочный тест бота с фейковым сервером VK")
+    parser.add_argument("--users", type=int, default=20, help="число одновременных пользователей")
+    parser.add_argument("--rounds", type=int, default=3, help="сколько раз каждый проходит сценарий")
+    parser.add_argument("--workers", type=int, default=8, help="рабочие потоки диспетчера")
+    parser.add_argument("--latency", type=float, default=0.02, help="задержка ответа VK, секунды")
+    parser.add_argument("--jitter", type=float, default=0.01, help="случайная добавка к задержке, секунды")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля запросов с временной ошибкой VK")
+    parser.add_argument("--vk-rps", type=float, default=0, help="лимит запросов в секунду на ключ; 0 - без лимита")
+    parser.add_argument("--no-city-every", type=int, default=5, help="у каждого N-го пользователя нет города")
+    parser.add_argument("--postgres", action="store_true", help="писать в базу из settings.ini вместо памяти")
+    parser.add_argument("--async-bot", action="store_true", help="нагружать AsyncVkBot через long poll")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--json", action="store_true", help="вывести полный отчет в JSON")
+    args = parser.parse_args()
+    if args.async_bot and args.postgres:
+        parser.error("--postgres is not supported with --async-bot")
+
+    if args.async_bot:
+        result = run_async(
+            users=args.users,
+            rounds=args.rounds,
+            latency=args.latency,
+            jitter=args.jitter,
+            error_rate=args.error_rate,
+            vk_rps=args.vk_rps,
+            no_city_every=args.no_city_every,
+            seed=args.seed,
+        )
+    else:
+        result = run(
+            users=args.users,
+            rounds=args.rounds,
+            workers=args.workers,
+            latency=args.latency,
+            jitter=args.jitter,
+            error_rate=args.error_rate,
+            vk_rps=args.vk_rps,
+            no_city_every=args.no_city_every,
+            postgres=args.postgres,
+            seed=args.seed,
+        )
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+    else:
+        latency = result["latency"]
+        print(f"events: {result['events']} (errors: {result['errors']}) in {result['seconds']} s")
+        print(f"throughput: {result['throughput']} events/s")
+        print(f"latency: p50={latency['p50']} p95={latency['p95']} p99={latency['p99']} max={latency['max']} s")
+        print(f"VK requests per event: {result['vk_requests_per_event']}, calls: {result['vk_calls_per_event']}")
+        print(f"DB calls per event: {result['db_calls_per_event']}, methods: {result['db_methods_per_event']}")
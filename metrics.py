@@ -0,0 +1,336 @@
+import bisect
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+METRICS_PORT = 9100  # Порт HTTP-эндпоинта метрик по умолчанию
+
+
+class LatencyHistogram:
+    """
+    Гистограмма времени выполнения с фиксированными границами корзин.
+
+    Методы:
+        observe: Учитывает одно измерение.
+        quantile: Оценивает квантиль по корзинам.
+        snapshot: Счетчики гистограммы.
+    """
+
+    bounds = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)  # Верхние границы корзин, секунды
+
+    def __init__(self) -> None:
+        self.counts = [0] * (len(self.bounds) + 1)  # Последняя корзина - больше всех границ
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float) -> None:
+        """
+        Учитывает одно измерение (вызывается под блокировкой владельца).
+
+        Параметры:
+            seconds (float): Длительность, секунды.
+        """
+        self.counts[bisect.bisect_left(self.bounds, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def quantile(self, q: float) -> float:
+        """
+        Оценивает квантиль сверху: возвращает границу корзины, в которую он попадает.
+
+        Параметры:
+            q (float): Квантиль от 0 до 1.
+
+        Возвращаемое значение:
+            Граница корзины в секундах (для последней корзины - максимальное измерение).
+        """
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return self.max
+
+    def snapshot(self) -> dict:
+        """
+        Возвращает счетчики гистограммы.
+
+        Возвращаемое значение:
+            Словарь с числом измерений, суммой, средним, максимумом, оценками p50/p95/p99
+            и накопленными счетчиками корзин {граница: число измерений не больше границы}.
+        """
+        cumulative = 0
+        buckets = dict()
+        for bound, count in zip(self.bounds, self.counts):
+            cumulative += count
+            buckets[bound] = cumulative
+        return {
+            "count": self.count,
+            "sum": round(self.total, 4),
+            "avg": round(self.total / (self.count or 1), 4),
+            "max": round(self.max, 4),
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+            "buckets": buckets,
+        }
+
+
+class Metric:
+    """
+    Метрика с набором меток: значения хранятся отдельно для каждого сочетания меток.
+
+    Обновление - одна блокировка и поиск в словаре, поэтому метрики
+    можно не выключать в рабочем режиме.
+    """
+
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: tuple = ()) -> None:
+        """
+        Параметры:
+            name (str): Имя метрики.
+            documentation (str): Описание для строки HELP.
+            labels (tuple): Имена меток.
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.lock = threading.Lock()
+        self.values = dict()  # Кортеж значений меток -> значение
+
+    def samples(self) -> list[tuple]:
+        """Возвращает список (суффикс имени, метки, значение) для вывода."""
+        with self.lock:
+            return [("", dict(zip(self.labels, key)), value) for key, value in self.values.items()]
+
+
+class Counter(Metric):
+    """Монотонно растущий счетчик."""
+
+    type = "counter"
+
+    def inc(self, *labels, amount: float = 1) -> None:
+        """
+        Увеличивает счетчик.
+
+        Параметры:
+            labels: Значения меток в порядке их имен.
+            amount (float): Величина увеличения.
+        """
+        key = tuple(str(label) for label in labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """Текущее значение; может вычисляться функцией в момент чтения метрик."""
+
+    type = "gauge"
+
+    def __init__(self, name: str, documentation: str, labels: tuple = (), callback=None) -> None:
+        """
+        Параметры:
+            name (str): Имя метрики.
+            documentation (str): Описание для строки HELP.
+            labels (tuple): Имена меток.
+            callback: Функция без аргументов, возвращающая значение (для метрики без меток).
+        """
+        super().__init__(name, documentation, labels)
+        self.callback = callback
+
+    def set(self, value: float, *labels) -> None:
+        """
+        Устанавливает значение.
+
+        Параметры:
+            value (float): Новое значение.
+            labels: Значения меток в порядке их имен.
+        """
+        with self.lock:
+            self.values[tuple(str(label) for label in labels)] = value
+
+    def samples(self) -> list[tuple]:
+        if self.callback is not None:
+            try:
+                return [("", {}, self.callback())]
+            except Exception as e:
+                print(f"Error reading gauge {self.name}: {e}")
+                return []
+        return super().samples()
+
+
+class Histogram(Metric):
+    """Гистограмма длительностей (LatencyHistogram на каждое сочетание меток)."""
+
+    type = "histogram"
+
+    def observe(self, seconds: float, *labels) -> None:
+        """
+        Учитывает одно измерение.
+
+        Параметры:
+            seconds (float): Длительность, секунды.
+            labels: Значения меток в порядке их имен.
+        """
+        key = tuple(str(label) for label in labels)
+        with self.lock:
+            histogram = self.values.get(key)
+            if histogram is None:
+                histogram = self.values[key] = LatencyHistogram()
+            histogram.observe(seconds)
+
+    def samples(self) -> list[tuple]:
+        samples = []
+        with self.lock:
+            for key, histogram in self.values.items():
+                labels = dict(zip(self.labels, key))
+                cumulative = 0
+                for bound, count in zip(histogram.bounds, histogram.counts):
+                    cumulative += count
+                    samples.append(("_bucket", {**labels, "le": str(bound)}, cumulative))
+                samples.append(("_bucket", {**labels, "le": "+Inf"}, histogram.count))
+                samples.append(("_sum", labels, histogram.total))
+                samples.append(("_count", labels, histogram.count))
+        return samples
+
+
+class Registry:
+    """
+    Набор метрик процесса и их вывод в текстовом формате Prometheus.
+
+    Методы:
+        counter: Возвращает счетчик, создавая его при первом обращении.
+        gauge: Возвращает метрику текущего значения.
+        histogram: Возвращает гистограмму.
+        render: Выводит все метрики в текстовом формате Prometheus.
+    """
+
+    def __init__(self) -> None:
+        self.metrics = dict()  # Имя -> Metric
+        self.lock = threading.Lock()
+
+    def _get(self, cls, name: str, documentation: str, labels: tuple, **kwargs) -> Metric:
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = cls(name, documentation, labels, **kwargs)
+            return metric
+
+    def counter(self, name: str, documentation: str, labels: tuple = ()) -> Counter:
+        """
+        Возвращает счетчик, создавая его при первом обращении.
+
+        Параметры:
+            name (str): Имя метрики.
+            documentation (str): Описание метрики.
+            labels (tuple): Имена меток.
+        """
+        return self._get(Counter, name, documentation, labels)
+
+    def gauge(self, name: str, documentation: str, labels: tuple = (), callback=None) -> Gauge:
+        """
+        Возвращает метрику текущего значения. Новый callback заменяет прежний.
+
+        Параметры:
+            name (str): Имя метрики.
+            documentation (str): Описание метрики.
+            labels (tuple): Имена меток.
+            callback: Функция, вычисляющая значение при чтении метрик.
+        """
+        gauge = self._get(Gauge, name, documentation, labels)
+        if callback is not None:
+            gauge.callback = callback
+        return gauge
+
+    def histogram(self, name: str, documentation: str, labels: tuple = ()) -> Histogram:
+        """
+        Возвращает гистограмму длительностей, создавая ее при первом обращении.
+
+        Параметры:
+            name (str): Имя метрики.
+            documentation (str): Описание метрики.
+            labels (tuple): Имена меток.
+        """
+        return self._get(Histogram, name, documentation, labels)
+
+    @staticmethod
+    def _escape(value: str) -> str:
+        return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+    def render(self) -> str:
+        """
+        Выводит все метрики в текстовом формате Prometheus.
+
+        Возвращаемое значение:
+            Текст для ответа эндпоинта /metrics.
+        """
+        with self.lock:
+            metrics = sorted(self.metrics.values(), key=lambda metric: metric.name)
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {self._escape(metric.documentation)}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for suffix, labels, value in metric.samples():
+                label_text = ",".join(f'{name}="{self._escape(str(label))}"' for name, label in labels.items())
+                lines.append(f"{metric.name}{suffix}{{{label_text}}} {value}" if label_text else f"{metric.name}{suffix} {value}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()  # Метрики процесса
+
+
+def counter(name: str, documentation: str, labels: tuple = ()) -> Counter:
+    """Возвращает счетчик из общего набора метрик."""
+    return REGISTRY.counter(name, documentation, labels)
+
+
+def gauge(name: str, documentation: str, labels: tuple = (), callback=None) -> Gauge:
+    """Возвращает метрику текущего значения из общего набора метрик."""
+    return REGISTRY.gauge(name, documentation, labels, callback)
+
+
+def histogram(name: str, documentation: str, labels: tuple = ()) -> Histogram:
+    """Возвращает гистограмму из общего набора метрик."""
+    return REGISTRY.histogram(name, documentation, labels)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """Отдает метрики по GET /metrics."""
+
+    def do_GET(self) -> None:
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        data = self.server.registry.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args) -> None:
+        pass  # Не пишем в консоль каждый опрос метрик
+
+
+def start_metrics_server(port: int = METRICS_PORT, host: str = "127.0.0.1", registry: Registry = REGISTRY):
+    """
+    Запускает HTTP-эндпоинт /metrics в фоновом потоке.
+
+    Параметры:
+        port (int): Порт.
+        host (str): Адрес; по умолчанию только локальные подключения.
+        registry (Registry): Набор метрик для вывода.
+
+    Возвращаемое значение:
+        Запущенный ThreadingHTTPServer (остановка - shutdown()).
+    """
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    server.registry = registry
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
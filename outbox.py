@@ -0,0 +1,255 @@
+import random
+import threading
+import time
+from collections import deque
+
+import requests
+
+from VK_class import HttpException, VkApiError
+from metrics import counter, gauge, histogram
+from tracing import current_context
+
+OUTBOX_MESSAGES = counter("bot_outbox_messages_total", "Исходящие сообщения (status: sent, failed)", ("status",))
+OUTBOX_KEYBOARDS_COALESCED = counter(
+    "bot_outbox_keyboards_coalesced_total", "Клавиатуры, убранные из сообщений, которые ждали отправки"
+)
+OUTBOX_LATENCY_SECONDS = histogram(
+    "bot_outbox_latency_seconds", "Время от постановки сообщения в очередь до отправки, секунды"
+)
+
+_random = random.SystemRandom()
+
+
+def new_random_id() -> int:
+    """
+    Возвращает случайный random_id для messages.send.
+
+    VK не отправляет повторно сообщение с уже использованным random_id,
+    поэтому идентификатор создается один раз на сообщение и переиспользуется
+    при повторных попытках отправки.
+
+    Возвращаемое значение:
+        Положительное 31-битное целое число.
+    """
+    return _random.randrange(1, 2 ** 31)
+
+
+class OutgoingMessage:
+    """
+    Сообщение в очереди отправки.
+
+    Атрибуты:
+        user_id (int): Идентификатор получателя.
+        message (str): Текст сообщения.
+        keyboard (str): Клавиатура в формате JSON.
+        attachment (str): Вложения.
+        random_id (int): Идентификатор сообщения для защиты от дублей при повторе.
+        replaceable (bool): Клавиатуру сообщения можно не отправлять, если пользователю
+            уже стоит в очереди следующее сообщение с клавиатурой; текст отправляется всегда.
+        queued (float): Момент постановки в очередь.
+        context: Контекст трассы события, отправившего сообщение (None вне трассы).
+    """
+
+    def __init__(self, user_id: int, message: str, keyboard=None, attachment=None, replaceable: bool = False) -> None:
+        self.user_id = user_id
+        self.message = message
+        self.keyboard = keyboard
+        self.attachment = attachment
+        self.random_id = new_random_id()
+        self.replaceable = replaceable
+        self.queued = time.perf_counter()
+        self.context = current_context()
+
+
+class MessageOutbox:
+    """
+    Очередь исходящих сообщений, отправляемых фоновыми потоками.
+
+    Обработчик события только ставит сообщение в очередь и не ждет
+    messages.send. Частоту отправки ограничивает общий ограничитель ключа
+    сообщества в клиенте VK (20 запросов в секунду). Сообщения одному
+    пользователю уходят строго по порядку, а пользователи обслуживаются
+    по кругу: длинная очередь одного пользователя не задерживает остальных.
+
+    С coalesce=True новое сообщение с клавиатурой убирает клавиатуру из еще
+    не отправленных сообщений того же пользователя, помеченных replaceable:
+    при всплеске пользователь получает все тексты, а клавиатура перерисовывается
+    один раз. Сами сообщения не отбрасываются - у них есть текст для пользователя.
+
+    Методы:
+        send: Ставит сообщение в очередь.
+        stats: Счетчики очереди.
+        close: Дожидается отправки очереди и останавливает потоки.
+    """
+
+    def __init__(
+        self,
+        send,
+        workers: int = 4,
+        max_pending: int = 10000,
+        coalesce: bool = True,
+        retries: int = 2,
+        retry_delay: float = 0.5
+    ) -> None:
+        """
+        Параметры:
+            send: Функция отправки (user_id, message, random_id, keyboard, attachment) -> ответ API.
+            workers (int): Число потоков отправки.
+            max_pending (int): Максимальное число неотправленных сообщений.
+            coalesce (bool): Убирать ли устаревшие клавиатуры из неотправленных сообщений.
+            retries (int): Сколько раз повторить отправку при сетевой ошибке.
+            retry_delay (float): Пауза перед повтором, секунды.
+        """
+        self.send_func = send
+        self.max_pending = max_pending
+        self.coalesce = coalesce
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.condition = threading.Condition()
+        self.pending = dict()  # user_id -> deque сообщений пользователя
+        self.ready = deque()  # Пользователи с сообщениями, которые сейчас никто не отправляет
+        self.pending_count = 0
+        self.closed = False
+        self.sent = 0
+        self.failed = 0
+        self.coalesced = 0  # Клавиатуры, убранные при объединении
+        self.total_latency = 0.0  # Суммарное время от постановки в очередь до отправки, секунды
+        self.max_latency = 0.0
+        self.threads = [
+            threading.Thread(target=self._work, name=f"outbox-{number}", daemon=True) for number in range(workers)
+        ]
+        for thread in self.threads:
+            thread.start()
+        gauge("bot_outbox_pending", "Неотправленные сообщения в очереди", callback=lambda: self.pending_count)
+
+    def send(self, user_id: int, message: str, keyboard=None, attachment=None, replaceable: bool = False,
+             timeout: float = None) -> bool:
+        """
+        Ставит сообщение в очередь отправки.
+
+        Параметры:
+            user_id (int): Идентификатор получателя.
+            message (str): Текст сообщения.
+            keyboard: Клавиатура для сообщения.
+            attachment: Вложения для сообщения.
+            replaceable (bool): Клавиатуру сообщения может заменить следующая (см. описание класса).
+            timeout (float): Сколько ждать места в заполненной очереди; None - ждать без ограничения.
+
+        Возвращаемое значение:
+            True, если сообщение поставлено в очередь; False, если очередь так и осталась заполненной.
+        """
+        outgoing = OutgoingMessage(user_id, message, keyboard, attachment, replaceable)
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.pending_count < self.max_pending, timeout):
+                return False
+            queue = self.pending.get(user_id)
+            if queue is None:
+                queue = self.pending[user_id] = deque()
+                self.ready.append(user_id)
+            elif self.coalesce and keyboard is not None:
+                # Клавиатура из нового сообщения заменяет клавиатуры, которые еще не отправлены
+                coalesced = 0
+                for item in queue:
+                    if item.replaceable and item.keyboard is not None:
+                        item.keyboard = None
+                        coalesced += 1
+                if coalesced:
+                    self.coalesced += coalesced
+                    OUTBOX_KEYBOARDS_COALESCED.inc(amount=coalesced)
+            queue.append(outgoing)
+            self.pending_count += 1
+            self.condition.notify_all()
+        return True
+
+    def _next(self) -> OutgoingMessage | None:
+        """Берет первое сообщение следующего по кругу пользователя (вызывается под блокировкой)."""
+        user_id = self.ready.popleft()
+        outgoing = self.pending[user_id].popleft()
+        self.pending_count -= 1
+        return outgoing
+
+    def _work(self) -> None:
+        """Отправляет сообщения, пока очередь не закрыта и не опустела."""
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.ready or (self.closed and not self.pending_count))
+                if not self.ready:
+                    return
+                outgoing = self._next()
+                self.condition.notify_all()  # Освободилось место для send
+            ok = False
+            try:
+                ok = outgoing.context.run(self._deliver, outgoing) if outgoing.context else self._deliver(outgoing)
+            finally:
+                # Возвращаем пользователя в круг в любом случае: иначе его следующие сообщения
+                # останутся в очереди навсегда, а close() будет ждать их без конца
+                latency = time.perf_counter() - outgoing.queued
+                OUTBOX_MESSAGES.inc("sent" if ok else "failed")
+                OUTBOX_LATENCY_SECONDS.observe(latency)
+                with self.condition:
+                    self.sent += ok
+                    self.failed += not ok
+                    self.total_latency += latency
+                    self.max_latency = max(self.max_latency, latency)
+                    # Пока сообщение отправлялось, пользователь был вне круга - так сохраняется порядок
+                    if self.pending[outgoing.user_id]:
+                        self.ready.append(outgoing.user_id)
+                    else:
+                        del self.pending[outgoing.user_id]
+                    self.condition.notify_all()
+
+    def _deliver(self, outgoing: OutgoingMessage) -> bool:
+        """Отправляет сообщение, повторяя попытку с тем же random_id при сетевой ошибке."""
+        for attempt in range(self.retries + 1):
+            try:
+                self.send_func(
+                    outgoing.user_id, outgoing.message, outgoing.random_id, outgoing.keyboard, outgoing.attachment
+                )
+                return True
+            except VkApiError as e:
+                # Временные ошибки клиент уже повторил, остальные повтором не исправить
+                print(f"Error sending message: {e}")
+                return False
+            except (requests.RequestException, HttpException) as e:
+                if attempt == self.retries:
+                    print(f"Error sending message: {e}")
+                    return False
+                time.sleep(self.retry_delay)
+            except Exception as e:
+                # Неожиданная ошибка (например, в разборе ответа) не должна останавливать поток отправки
+                print(f"Error sending message: {e}")
+                return False
+        return False
+
+    def stats(self) -> dict:
+        """
+        Возвращает счетчики очереди.
+
+        Возвращаемое значение:
+            Словарь с числом ожидающих, отправленных и неотправленных сообщений, убранных клавиатур,
+            средним и максимальным временем от постановки в очередь до отправки (секунды).
+        """
+        with self.condition:
+            done = (self.sent + self.failed) or 1
+            return {
+                "pending": self.pending_count,
+                "sent": self.sent,
+                "failed": self.failed,
+                "coalesced": self.coalesced,
+                "avg_latency": round(self.total_latency / done, 4),
+                "max_latency": round(self.max_latency, 4),
+            }
+
+    def close(self, wait: bool = True) -> None:
+        """
+        Закрывает очередь: потоки отправляют оставшиеся сообщения и завершаются.
+
+        Параметры:
+            wait (bool): Ждать ли завершения потоков.
+        """
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        if wait:
+            for thread in self.threads:
+                thread.join()
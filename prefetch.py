@@ -0,0 +1,137 @@
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from metrics import counter
+from tracing import current_context
+
+PREFETCH_TOTAL = counter(
+    "bot_prefetch_total", "Запросы следующего кандидата (result: hit - уже готов, miss - пришлось ждать)", ("result",)
+)
+
+
+class SearchCursorError(Exception):
+    """Курсор поиска завершился исключением (ошибка VK, сети или разомкнутая цепь users.search)."""
+
+
+class CandidatePrefetcher:
+    """
+    Фоновая подготовка следующих кандидатов для показа.
+
+    Пока пользователь смотрит текущего кандидата, следующие depth кандидатов
+    из его курсора поиска разрешаются (имя и топ-3 фото) в пуле потоков.
+    Все кандидаты, добавленные в очередь за один раз, разрешаются одним
+    вызовом resolve (для бота - один users.get и один execute с photos.get
+    вместо запросов на каждого кандидата), а результат раздается их Future.
+    Очередь подготовленных кандидатов хранится в сессии пользователя, поэтому
+    она сбрасывается вместе с курсором. Курсор читается только в потоке,
+    обрабатывающем событие пользователя, а в фоновые потоки уходят лишь
+    идентификаторы кандидатов.
+
+    Методы:
+        next: Возвращает следующего подготовленного кандидата.
+        stats: Счетчики попаданий и промахов.
+        shutdown: Останавливает пул потоков.
+    """
+
+    def __init__(self, depth: int = 3, workers: int = 4) -> None:
+        """
+        Параметры:
+            depth (int): Сколько кандидатов готовить заранее для каждого пользователя.
+            workers (int): Число фоновых потоков.
+        """
+        self.depth = depth
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="prefetch")
+        self.lock = threading.Lock()
+        self.hits = 0  # Кандидат был готов к моменту запроса
+        self.misses = 0  # Пришлось ждать загрузки кандидата
+
+    def _fill(self, prefetched: deque, candidates, resolve, excluded) -> None:
+        """Дополняет очередь пользователя до depth кандидатов, пропуская исключенных."""
+        batch = dict()  # id кандидата -> Future его результата
+        while len(prefetched) + len(batch) < self.depth:
+            try:
+                candidate_id = next(candidates, None)
+            except Exception as e:
+                # Генератор после исключения закрыт: вызывающий должен начать поиск заново
+                raise SearchCursorError(str(e)) from e
+            if candidate_id is None:
+                break
+            if candidate_id in excluded or candidate_id in batch:
+                continue
+            batch[candidate_id] = Future()
+        self._submit(batch, resolve)
+        prefetched.extend(batch.values())
+
+    def _submit(self, batch: dict, resolve) -> None:
+        """Разрешает кандидатов пакета одним вызовом resolve в фоновом потоке."""
+        if not batch:
+            return
+        # Загрузка кандидатов попадает в трассу события, которое ее запустило
+        context = current_context()
+        if context is not None:
+            self.executor.submit(context.run, self._resolve, batch, resolve)
+        else:
+            self.executor.submit(self._resolve, batch, resolve)
+
+    @staticmethod
+    def _resolve(batch: dict, resolve) -> None:
+        """Вызывает resolve для всех кандидатов пакета и раздает результаты их Future."""
+        try:
+            results = resolve(list(batch))
+        except BaseException as e:
+            for future in batch.values():
+                future.set_exception(e)
+            return
+        for candidate_id, future in batch.items():
+            future.set_result(results.get(candidate_id))  # None - профиль недоступен, кандидат пропускается
+
+    def next(self, prefetched: deque, candidates, resolve, excluded=()) -> tuple:
+        """
+        Возвращает следующего кандидата и запускает подготовку следующих.
+
+        Параметры:
+            prefetched (deque): Очередь подготовленных кандидатов из сессии пользователя.
+            candidates: Итератор по идентификаторам кандидатов (курсор поиска).
+            resolve: Функция, получающая по списку идентификаторов словарь {id: данные кандидата};
+                кандидаты, которых нет в словаре, пропускаются.
+            excluded: Идентификаторы, которые нельзя показывать (черный список, избранное).
+
+        Возвращаемое значение:
+            Результат resolve для следующего кандидата.
+
+        Исключения:
+            StopIteration: Если кандидаты закончились.
+            SearchCursorError: Если курсор поиска выбросил исключение.
+        """
+        while True:
+            self._fill(prefetched, candidates, resolve, excluded)
+            if not prefetched:
+                raise StopIteration
+            future = prefetched.popleft()
+            hit = future.done()
+            PREFETCH_TOTAL.inc("hit" if hit else "miss")
+            with self.lock:
+                if hit:
+                    self.hits += 1
+                else:
+                    self.misses += 1
+            result = future.result()
+            if result is not None:
+                break
+        self._fill(prefetched, candidates, resolve, excluded)
+        return result
+
+    def stats(self) -> dict:
+        """
+        Возвращает счетчики предзагрузки.
+
+        Возвращаемое значение:
+            Словарь с числом попаданий и промахов.
+        """
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses}
+
+    def shutdown(self) -> None:
+        """Останавливает пул потоков, не дожидаясь незавершенных загрузок."""
+        self.executor.shutdown(wait=False, cancel_futures=True)
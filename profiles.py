@@ -0,0 +1,181 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class ProfileResolver:
+    """
+    Кэш профилей пользователей VK с временем жизни и ограничением размера.
+
+    Промахи запрашиваются пачкой одним вызовом users.get на много
+    идентификаторов. Если профиль уже запрашивается другим потоком,
+    повторный запрос не отправляется: вызывающий дожидается первого.
+
+    Методы:
+        get_many: Возвращает профили по списку идентификаторов.
+        get_many_async: То же для asyncio, с асинхронной функцией загрузки.
+        get: Возвращает профиль одного пользователя.
+        put: Кладет в кэш уже полученные профили (например, из users.search).
+        invalidate: Удаляет профили из кэша.
+        stats: Счетчики попаданий и промахов.
+    """
+
+    max_ids = 1000  # Сколько идентификаторов VK принимает в одном users.get
+
+    def __init__(self, max_size: int = 10000, ttl: float = 600, wait_timeout: float = 30) -> None:
+        """
+        Параметры:
+            max_size (int): Максимальное число профилей в кэше.
+            ttl (float): Время жизни профиля в секундах.
+            wait_timeout (float): Сколько ждать профиль, который загружает другой поток.
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.wait_timeout = wait_timeout
+        self.cache = OrderedDict()  # user_id -> (момент устаревания, профиль)
+        self.inflight = {}  # user_id -> threading.Event загрузки
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _lookup(self, user_id: int, now: float) -> dict | None:
+        """Возвращает профиль из кэша, если он не устарел (вызывается под блокировкой)."""
+        entry = self.cache.get(user_id)
+        if entry is None:
+            return None
+        if entry[0] < now:
+            del self.cache[user_id]
+            return None
+        self.cache.move_to_end(user_id)
+        return entry[1]
+
+    def put(self, profiles: list[dict]) -> None:
+        """
+        Кладет профили в кэш.
+
+        Параметры:
+            profiles (list[dict]): Элементы ответа users.get или users.search.
+        """
+        expires = time.monotonic() + self.ttl
+        with self.lock:
+            for profile in profiles:
+                self.cache[profile["id"]] = (expires, profile)
+                self.cache.move_to_end(profile["id"])
+            while len(self.cache) > self.max_size:
+                self.cache.popitem(last=False)
+
+    def get_many(self, user_ids: list[int], fetch) -> dict:
+        """
+        Возвращает профили пользователей, запрашивая недостающие пачкой.
+
+        Параметры:
+            user_ids (list[int]): Идентификаторы пользователей.
+            fetch: Функция, получающая список профилей по списку идентификаторов.
+
+        Возвращаемое значение:
+            Словарь {user_id: профиль}; профили, которые не удалось получить, отсутствуют.
+        """
+        found = dict()
+        to_fetch = []
+        to_wait = []
+        now = time.monotonic()
+        with self.lock:
+            for user_id in dict.fromkeys(user_ids):
+                profile = self._lookup(user_id, now)
+                if profile is not None:
+                    found[user_id] = profile
+                    self.hits += 1
+                elif user_id in self.inflight:
+                    to_wait.append((user_id, self.inflight[user_id]))
+                else:
+                    self.inflight[user_id] = threading.Event()
+                    to_fetch.append(user_id)
+                    self.misses += 1
+        try:
+            for start in range(0, len(to_fetch), self.max_ids):
+                profiles = fetch(to_fetch[start:start + self.max_ids])
+                self.put(profiles)
+                found.update((profile["id"], profile) for profile in profiles)
+        finally:
+            with self.lock:
+                for user_id in to_fetch:
+                    self.inflight.pop(user_id).set()
+        for user_id, loaded in to_wait:
+            loaded.wait(self.wait_timeout)
+            with self.lock:
+                profile = self._lookup(user_id, time.monotonic())
+            if profile is not None:
+                found[user_id] = profile
+        return found
+
+    async def get_many_async(self, user_ids: list[int], fetch) -> dict:
+        """
+        Возвращает профили пользователей, запрашивая недостающие пачкой, для кода на asyncio.
+
+        В отличие от get_many, не ждет профили, которые загружает другой поток:
+        ожидание threading.Event заблокировало бы цикл событий.
+
+        Параметры:
+            user_ids (list[int]): Идентификаторы пользователей.
+            fetch: Асинхронная функция, получающая список профилей по списку идентификаторов.
+
+        Возвращаемое значение:
+            Словарь {user_id: профиль}; профили, которые не удалось получить, отсутствуют.
+        """
+        found = dict()
+        to_fetch = []
+        now = time.monotonic()
+        with self.lock:
+            for user_id in dict.fromkeys(user_ids):
+                profile = self._lookup(user_id, now)
+                if profile is not None:
+                    found[user_id] = profile
+                    self.hits += 1
+                else:
+                    to_fetch.append(user_id)
+                    self.misses += 1
+        for start in range(0, len(to_fetch), self.max_ids):
+            profiles = await fetch(to_fetch[start:start + self.max_ids])
+            self.put(profiles)
+            found.update((profile["id"], profile) for profile in profiles)
+        return found
+
+    def get(self, user_id: int, fetch) -> dict:
+        """
+        Возвращает профиль одного пользователя.
+
+        Параметры:
+            user_id (int): Идентификатор пользователя.
+            fetch: Функция, получающая список профилей по списку идентификаторов.
+
+        Возвращаемое значение:
+            Профиль пользователя.
+
+        Исключения:
+            KeyError: Если VK не вернул профиль.
+        """
+        return self.get_many([user_id], fetch)[user_id]
+
+    def invalidate(self, user_ids: list[int] = None) -> None:
+        """
+        Удаляет профили из кэша.
+
+        Параметры:
+            user_ids (list[int]): Идентификаторы пользователей; если не указаны, кэш очищается полностью.
+        """
+        with self.lock:
+            if user_ids is None:
+                self.cache.clear()
+            else:
+                for user_id in user_ids:
+                    self.cache.pop(user_id, None)
+
+    def stats(self) -> dict:
+        """
+        Возвращает счетчики кэша.
+
+        Возвращаемое значение:
+            Словарь с размером кэша, числом попаданий и промахов.
+        """
+        with self.lock:
+            return {"size": len(self.cache), "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,169 @@
+import threading
+import time
+
+from metrics import counter
+
+
+USER_TOKEN_RPS = 3  # Лимит VK для ключа пользователя, запросов в секунду
+GROUP_TOKEN_RPS = 20  # Лимит VK для ключа сообщества, запросов в секунду
+
+LIMITER_WAIT_SECONDS = counter(
+    "vk_limiter_wait_seconds_total", "Время ожидания токена ограничителя, секунды", ("token",)
+)
+
+
+class TokenBucket:
+    """
+    Ограничитель частоты запросов по алгоритму "token bucket".
+
+    Каждый запрос забирает один токен, токены восполняются со скоростью rate
+    в секунду до capacity. Если токенов нет, вызывающий ждет ровно столько,
+    сколько нужно до появления своего токена. Очередь ожидающих честная:
+    токен резервируется под блокировкой, а ожидание идет уже без нее, поэтому
+    ограничитель можно использовать из нескольких потоков и из asyncio.
+
+    Методы:
+        acquire: Блокирующее получение токена.
+        acquire_async: Получение токена без блокировки цикла событий.
+        set_rate: Меняет скорость восполнения.
+        stats: Счетчики запросов и времени ожидания.
+    """
+
+    def __init__(self, rate: float, capacity: float = None, name: str = "") -> None:
+        """
+        Параметры:
+            rate (float): Скорость восполнения, токенов в секунду.
+            capacity (float): Максимальный запас токенов, по умолчанию равен rate.
+            name (str): Имя ограничителя для счетчиков (метка token метрики ожидания).
+        """
+        self.rate = rate
+        self.limit = rate  # Лимит ключа без учета set_rate (по нему get_limiter сверяет повторные запросы)
+        self.capacity = capacity or rate
+        self.name = name
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+        self.acquired = 0  # Всего выданных токенов
+        self.waits = 0  # Сколько раз пришлось ждать
+        self.wait_time = 0.0  # Суммарное время ожидания, секунды
+
+    def _reserve(self) -> float:
+        """
+        Резервирует токен и возвращает время, которое нужно подождать до его появления.
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            self.acquired += 1
+            if self.tokens >= 0:
+                return 0.0
+            delay = -self.tokens / self.rate
+            self.waits += 1
+            self.wait_time += delay
+            return delay
+
+    def set_rate(self, rate: float, capacity: float = None) -> None:
+        """
+        Меняет скорость восполнения, не меняя limit (например, чтобы снять лимит в нагрузочном тесте).
+
+        Параметры:
+            rate (float): Новая скорость, токенов в секунду.
+            capacity (float): Новый максимальный запас, по умолчанию равен rate.
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.rate = rate
+            self.capacity = capacity or rate
+            self.tokens = min(self.tokens, self.capacity)
+
+    def acquire(self) -> float:
+        """
+        Получает токен, при необходимости блокируя поток.
+
+        Возвращаемое значение:
+            Время ожидания в секундах.
+        """
+        delay = self._reserve()
+        if delay:
+            LIMITER_WAIT_SECONDS.inc(self.name, amount=delay)
+            time.sleep(delay)
+        return delay
+
+    async def acquire_async(self) -> float:
+        """
+        Получает токен, ожидая через asyncio.sleep.
+
+        Возвращаемое значение:
+            Время ожидания в секундах.
+        """
+        import asyncio  # Импорт asyncio заметно удлиняет запуск, а нужен только асинхронному боту
+
+        delay = self._reserve()
+        if delay:
+            LIMITER_WAIT_SECONDS.inc(self.name, amount=delay)
+            await asyncio.sleep(delay)
+        return delay
+
+    def stats(self) -> dict:
+        """
+        Возвращает счетчики ограничителя.
+
+        Возвращаемое значение:
+            Словарь с числом выданных токенов, ожиданий и суммарным временем ожидания.
+        """
+        with self.lock:
+            return {
+                "rate": self.rate,
+                "acquired": self.acquired,
+                "waits": self.waits,
+                "wait_time": round(self.wait_time, 3),
+            }
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(token: str, rate: float = USER_TOKEN_RPS) -> TokenBucket:
+    """
+    Возвращает общий ограничитель для ключа доступа, создавая его при первом обращении.
+
+    Лимиты VK действуют на ключ, а не на клиента, поэтому все экземпляры
+    клиента с одним токеном делят один ограничитель. Если ключ запрошен
+    с другим лимитом, ограничитель переходит на более строгий из них:
+    превышение лимита VK хуже лишнего ожидания.
+
+    Параметры:
+        token (str): Ключ доступа.
+        rate (float): Лимит ключа, запросов в секунду.
+
+    Возвращаемое значение:
+        Экземпляр TokenBucket.
+    """
+    with _limiters_lock:
+        if token not in _limiters:
+            _limiters[token] = TokenBucket(rate, name=f"...{token[-4:]}")
+        limiter = _limiters[token]
+        if rate < limiter.limit:
+            print(f"Limiter {limiter.name}: rate {limiter.limit} requested as {rate}, using {rate}")
+            limiter.limit = rate
+            limiter.set_rate(min(limiter.rate, rate))
+        elif rate > limiter.limit:
+            print(f"Limiter {limiter.name}: rate {limiter.limit} requested as {rate}, keeping {limiter.limit}")
+    return limiter
+
+
+def limiter_stats() -> dict:
+    """
+    Возвращает счетчики всех ограничителей.
+
+    Возвращаемое значение:
+        Словарь {имя ограничителя: счетчики}.
+    """
+    with _limiters_lock:
+        limiters = list(_limiters.values())
+    return {limiter.name: limiter.stats() for limiter in limiters}
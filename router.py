@@ -0,0 +1,179 @@
+import inspect
+import threading
+import time
+
+from metrics import LatencyHistogram, histogram
+from tracing import span
+
+BOT_COMMAND_SECONDS = histogram("bot_command_seconds", "Время выполнения команд бота, секунды", ("command",))
+
+
+class CommandRouter:
+    """
+    Таблица команд бота: нормализованный текст кнопки или синонима -> обработчик.
+
+    Команда находится одним поиском в словаре. Перед обработчиком
+    вызываются промежуточные обработчики (middleware); если один из них
+    вернул False, команда не выполняется. Каждый вызов замеряется:
+    по каждой команде ведутся счетчики вызовов и ошибок и гистограмма
+    времени выполнения. Текст, не совпавший ни с одной командой, уходит
+    в fallback и учитывается как команда unknown.
+
+    Методы:
+        normalize: Приводит текст к ключу таблицы.
+        register: Регистрирует команду и ее синонимы.
+        use: Добавляет промежуточный обработчик.
+        resolve: Находит команду по тексту.
+        dispatch: Выполняет команду.
+        dispatch_async: Выполняет команду с обработчиком-корутиной.
+        stats: Счетчики и гистограммы команд.
+    """
+
+    unknown = "unknown"  # Имя, под которым учитывается нераспознанный текст
+
+    def __init__(self, fallback=None) -> None:
+        """
+        Параметры:
+            fallback: Обработчик нераспознанного текста; принимает те же аргументы, что и команды.
+        """
+        self.fallback = fallback
+        self.routes = dict()  # Нормализованный текст -> (имя команды, обработчик)
+        self.middleware = []
+        self.lock = threading.Lock()
+        self.histograms = dict()  # Имя команды -> LatencyHistogram
+        self.errors = dict()  # Имя команды -> число вызовов, завершившихся исключением
+        self.blocked = dict()  # Имя команды -> число вызовов, остановленных middleware
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        """Приводит текст к ключу таблицы: без учета регистра, лишних пробелов и различия е/ё."""
+        return " ".join(text.split()).casefold().replace("ё", "е")
+
+    def register(self, name: str, handler, aliases: tuple = ()) -> None:
+        """
+        Регистрирует команду.
+
+        Параметры:
+            name (str): Текст кнопки; под ним же ведутся счетчики команды.
+            handler: Обработчик команды.
+            aliases (tuple): Другие тексты, вызывающие ту же команду.
+
+        Исключения:
+            ValueError: Если текст уже занят другой командой.
+        """
+        for text in (name, *aliases):
+            key = self.normalize(text)
+            if key in self.routes and self.routes[key][0] != name:
+                raise ValueError(f"'{text}' is already routed to '{self.routes[key][0]}'")
+            self.routes[key] = (name, handler)
+
+    def use(self, middleware) -> None:
+        """
+        Добавляет промежуточный обработчик, вызываемый перед каждой командой.
+
+        Параметры:
+            middleware: Функция (имя команды, *аргументы команды); если она вернула False,
+                команда не выполняется.
+        """
+        self.middleware.append(middleware)
+
+    def resolve(self, text: str) -> tuple:
+        """
+        Находит команду по тексту сообщения.
+
+        Параметры:
+            text (str): Текст сообщения.
+
+        Возвращаемое значение:
+            Кортеж (имя команды, обработчик); для нераспознанного текста - (unknown, fallback).
+        """
+        return self.routes.get(self.normalize(text or ""), (self.unknown, self.fallback))
+
+    def _allowed(self, name: str, args: tuple) -> bool:
+        """Вызывает middleware; False, если одно из них остановило команду."""
+        for middleware in self.middleware:
+            if middleware(name, *args) is False:
+                with self.lock:
+                    self.blocked[name] = self.blocked.get(name, 0) + 1
+                return False
+        return True
+
+    def _record(self, name: str, started: float, failed: bool) -> None:
+        """Учитывает время выполнения и исход команды."""
+        elapsed = time.perf_counter() - started
+        BOT_COMMAND_SECONDS.observe(elapsed, name)
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = LatencyHistogram()
+            histogram.observe(elapsed)
+            if failed:
+                self.errors[name] = self.errors.get(name, 0) + 1
+
+    def dispatch(self, text: str, *args):
+        """
+        Выполняет команду, соответствующую тексту.
+
+        Параметры:
+            text (str): Текст сообщения.
+            args: Аргументы обработчика.
+
+        Возвращаемое значение:
+            Результат обработчика или None, если команда остановлена middleware или обработчика нет.
+        """
+        name, handler = self.resolve(text)
+        if handler is None or not self._allowed(name, args):
+            return None
+        started = time.perf_counter()
+        failed = True
+        try:
+            with span("command", command=name):
+                result = handler(*args)
+            failed = False
+            return result
+        finally:
+            self._record(name, started, failed)
+
+    async def dispatch_async(self, text: str, *args):
+        """
+        Выполняет команду, соответствующую тексту, для обработчиков-корутин (время включает ожидание).
+
+        Параметры:
+            text (str): Текст сообщения.
+            args: Аргументы обработчика.
+
+        Возвращаемое значение:
+            Результат обработчика или None, если команда остановлена middleware или обработчика нет.
+        """
+        name, handler = self.resolve(text)
+        if handler is None or not self._allowed(name, args):
+            return None
+        started = time.perf_counter()
+        failed = True
+        try:
+            with span("command", command=name):
+                result = handler(*args)
+                if inspect.isawaitable(result):
+                    result = await result
+            failed = False
+            return result
+        finally:
+            self._record(name, started, failed)
+
+    def stats(self) -> dict:
+        """
+        Возвращает счетчики команд.
+
+        Возвращаемое значение:
+            Словарь {имя команды: снимок гистограммы с числом ошибок и остановленных вызовов}.
+        """
+        with self.lock:
+            names = set(self.histograms) | set(self.blocked)
+            return {
+                name: {
+                    **(self.histograms[name].snapshot() if name in self.histograms else LatencyHistogram().snapshot()),
+                    "errors": self.errors.get(name, 0),
+                    "blocked": self.blocked.get(name, 0),
+                }
+                for name in sorted(names)
+            }
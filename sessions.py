@@ -0,0 +1,137 @@
+import threading
+import time
+from collections import OrderedDict, deque
+
+
+class SearchSession:
+    """
+    Состояние поиска одного пользователя бота между сообщениями.
+
+    Атрибуты:
+        user_id (int): VK ID пользователя бота.
+        search_params (tuple): Параметры поиска (пол, возраст от, возраст до, id города),
+            по которым построен текущий список кандидатов.
+        candidates: Итератор по найденным кандидатам (курсор поиска).
+        current (tuple): Текущий показанный кандидат (id, ФИО, топ-3 фото).
+        prefetched (deque): Кандидаты, заранее подготовленные в фоне.
+        touched (float): Время последнего обращения к сессии.
+    """
+
+    def __init__(self, user_id: int) -> None:
+        self.user_id = user_id
+        self.search_params = None
+        self.candidates = None
+        self.current = (None, None, None)
+        self.prefetched = deque()
+        self.touched = time.monotonic()
+
+    def needs_search(self, search_params: tuple) -> bool:
+        """
+        Проверяет, нужно ли заново выполнять поиск.
+
+        Параметры:
+            search_params (tuple): Актуальные параметры поиска пользователя.
+
+        Возвращаемое значение:
+            True, если поиска еще не было или изменились город, возраст или пол.
+        """
+        return self.candidates is None or self.search_params != search_params
+
+    def start_search(self, search_params: tuple, candidates) -> None:
+        """
+        Запоминает новый поиск и сбрасывает подготовленных по старому поиску кандидатов.
+
+        Параметры:
+            search_params (tuple): Параметры, по которым выполнен поиск.
+            candidates: Итератор по найденным кандидатам.
+        """
+        self.search_params = search_params
+        self.candidates = candidates
+        self.prefetched = deque()
+
+    def end_search(self) -> None:
+        """
+        Забывает курсор поиска, сохраняя текущего кандидата.
+
+        Вызывается, когда кандидаты закончились или курсор завершился ошибкой:
+        следующее сообщение пользователя начнет поиск заново, а не получит
+        ответ от уже закрытого курсора.
+        """
+        self.search_params = None
+        self.candidates = None
+        self.prefetched = deque()
+
+    def reset(self) -> None:
+        """Сбрасывает курсор поиска, следующий запрос выполнит поиск заново."""
+        self.search_params = None
+        self.candidates = None
+        self.current = (None, None, None)
+        self.prefetched = deque()
+
+
+class SessionStore:
+    """
+    Хранилище сессий поиска по VK ID пользователя с TTL и вытеснением LRU.
+
+    Сессия, к которой не обращались дольше ttl секунд, считается устаревшей
+    и создается заново. При превышении max_sessions вытесняется сессия,
+    к которой дольше всего не обращались.
+
+    Методы:
+        get: Возвращает сессию пользователя, создавая ее при необходимости.
+        drop: Удаляет сессию пользователя.
+    """
+
+    def __init__(self, max_sessions: int = 10000, ttl: float = 1800) -> None:
+        """
+        Параметры:
+            max_sessions (int): Максимальное число хранимых сессий.
+            ttl (float): Время жизни неактивной сессии в секундах.
+        """
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.sessions = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, user_id: int) -> SearchSession:
+        """
+        Возвращает сессию пользователя, создавая ее при отсутствии или устаревании.
+
+        Параметры:
+            user_id (int): VK ID пользователя бота.
+
+        Возвращаемое значение:
+            Экземпляр SearchSession.
+        """
+        now = time.monotonic()
+        with self.lock:
+            session = self.sessions.get(user_id)
+            if session is None or now - session.touched > self.ttl:
+                session = SearchSession(user_id)
+                self.sessions[user_id] = session
+            self.sessions.move_to_end(user_id)
+            session.touched = now
+            self._evict(now)
+            return session
+
+    def drop(self, user_id: int) -> None:
+        """
+        Удаляет сессию пользователя.
+
+        Параметры:
+            user_id (int): VK ID пользователя бота.
+        """
+        with self.lock:
+            self.sessions.pop(user_id, None)
+
+    def _evict(self, now: float) -> None:
+        """Удаляет устаревшие сессии и лишние сессии сверх max_sessions (вызывается под блокировкой)."""
+        while self.sessions:
+            user_id, session = next(iter(self.sessions.items()))
+            if len(self.sessions) > self.max_sessions or now - session.touched > self.ttl:
+                del self.sessions[user_id]
+            else:
+                break
+
+    def __len__(self) -> int:
+        return len(self.sessions)
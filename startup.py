@@ -0,0 +1,69 @@
+import threading
+import time
+from contextlib import contextmanager
+
+PROCESS_STARTED = time.perf_counter()  # Момент импорта модуля - начало отсчета времени запуска
+
+
+class StartupTimer:
+    """
+    Замеряет этапы запуска бота.
+
+    Этапы могут выполняться в разных потоках одновременно, поэтому сумма
+    этапов бывает больше общего времени запуска.
+
+    Методы:
+        step: Контекстный менеджер, замеряющий этап.
+        timed: Вызывает функцию, замеряя ее как этап.
+        report: Время этапов и общее время запуска.
+    """
+
+    def __init__(self) -> None:
+        self.started = time.perf_counter()
+        self.steps = dict()  # Название этапа -> длительность, секунды
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def step(self, name: str):
+        """
+        Замеряет этап запуска.
+
+        Параметры:
+            name (str): Название этапа.
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.steps[name] = time.perf_counter() - started
+
+    def timed(self, name: str, func, *args, **kwargs):
+        """
+        Вызывает функцию, замеряя ее как этап запуска (удобно для пула потоков).
+
+        Параметры:
+            name (str): Название этапа.
+            func: Вызываемая функция.
+
+        Возвращаемое значение:
+            Результат функции.
+        """
+        with self.step(name):
+            return func(*args, **kwargs)
+
+    def report(self) -> dict:
+        """
+        Возвращает время этапов запуска.
+
+        Возвращаемое значение:
+            Словарь {этап: секунды}: imports - от импорта модуля startup до создания
+            таймера, затем замеренные этапы и total - от импорта модуля startup до сейчас.
+        """
+        with self.lock:
+            steps = {name: round(duration, 3) for name, duration in self.steps.items()}
+        return {
+            "imports": round(self.started - PROCESS_STARTED, 3),
+            **steps,
+            "total": round(time.perf_counter() - PROCESS_STARTED, 3),
+        }
@@ -0,0 +1,63 @@
+import asyncio
+
+import loadtest
+from VK_async import AsyncVkApi
+from VK_class import CITY_NOT_FOUND, My_VkApi
+from city_index import CityIndex
+
+
+def test_async_bot_handles_long_poll_events():
+    users, rounds, no_city_every = 4, 1, 2
+    report = loadtest.run_async(users=users, rounds=rounds, latency=0.001, jitter=0, no_city_every=no_city_every)
+    # Пользователи без города в профиле сначала отправляют название города
+    assert report["events"] == users * rounds * len(loadtest.SCRIPT) + users // no_city_every
+    assert report["errors"] == 0
+    calls = report["vk"]["calls"]
+    assert calls["messages.getLongPollServer"] == 1
+    assert calls["messages.send"] >= report["events"] - users  # На каждое событие, кроме "Начать", есть ответ
+    assert report["router"]["Добавить в избранное"]["count"] == users * rounds
+    assert report["db_methods_per_event"]["get_user_city"] == 1.0  # Город читает только start_bot
+
+
+def test_async_bot_survives_transient_errors():
+    report = loadtest.run_async(users=3, rounds=1, latency=0.001, jitter=0, error_rate=0.1, seed=2)
+    assert report["errors"] == 0
+    assert sum(report["vk"]["errors"].values()) > 0
+
+
+def clients(tmp_path, response):
+    """Синхронный и асинхронный клиенты с общим справочником и одинаковым ответом VK."""
+    cities = CityIndex(str(tmp_path / "cities.json"))
+    sync_api = My_VkApi.__new__(My_VkApi)
+    sync_api.cities = cities
+    sync_api.params = {}
+    sync_api._send_request = lambda **kwargs: response
+    async_api = AsyncVkApi.__new__(AsyncVkApi)
+    async_api.cities = cities
+
+    async def call(method, params, parser=None):
+        return response
+
+    async_api._call = call
+    return sync_api, async_api
+
+
+def test_clients_report_missing_city_the_same_way(tmp_path):
+    sync_api, async_api = clients(tmp_path, {"response": {"count": 0, "items": []}})
+    assert asyncio.run(async_api.search_city("Нигде")) == CITY_NOT_FOUND
+    assert sync_api.search_city("Тоже нигде") == CITY_NOT_FOUND
+    # Второй раз ответ берется из справочника
+    assert sync_api.search_city("Нигде") == CITY_NOT_FOUND
+    assert asyncio.run(async_api.search_city("Тоже нигде")) == CITY_NOT_FOUND
+
+
+def test_clients_return_found_city_the_same_way(tmp_path):
+    sync_api, async_api = clients(tmp_path, {"response": {"count": 1, "items": [{"id": 2, "title": "Санкт-Петербург"}]}})
+    assert sync_api.search_city("Питер") == ("Санкт-Петербург", 2)
+    assert asyncio.run(async_api.search_city("питер")) == ("Санкт-Петербург", 2)
+
+
+def test_clients_report_missing_city_id_the_same_way(tmp_path):
+    sync_api, async_api = clients(tmp_path, {"response": []})
+    assert sync_api.search_city_by_id(5) == CITY_NOT_FOUND
+    assert asyncio.run(async_api.search_city_by_id(5)) == CITY_NOT_FOUND
@@ -0,0 +1,89 @@
+import json
+
+import pytest
+import requests
+
+from VK_class import VkApiError, VkBatch, VkTooManyRequests
+
+
+class FakeApi:
+    """Клиент, который вместо запроса к VK возвращает заготовленный ответ execute."""
+
+    params = {"access_token": "token", "v": "5.199"}
+
+    def __init__(self, response=None, error=None):
+        self.response = response
+        self.error = error
+        self.codes = []
+
+    def _send_request(self, http_method, uri_path, params=None, data=None, response_type=None):
+        self.codes.append(data["code"])
+        if self.error is not None:
+            raise self.error
+        return self.response
+
+
+def test_code_calls_methods_in_order():
+    code = VkBatch.code([("users.get", {"user_ids": "1"}), ("photos.get", {"owner_id": 2})])
+    assert code == 'return [API.users.get({"user_ids": "1"}),API.photos.get({"owner_id": 2})];'
+
+
+def test_results_map_false_items_to_execute_errors_in_order():
+    response = {
+        "response": [1, False, 3, False],
+        "execute_errors": [{"error_code": 6}, {"error_code": 10}],
+    }
+    assert VkBatch.results(response, 4) == [
+        {"response": 1},
+        {"error": {"error_code": 6}},
+        {"response": 3},
+        {"error": {"error_code": 10}},
+    ]
+
+
+def test_results_spread_whole_request_error_to_every_call():
+    assert VkBatch.results({"error": {"error_code": 5}}, 2) == [{"error": {"error_code": 5}}] * 2
+
+
+def test_get_sends_batch_once_and_applies_parsers():
+    api = FakeApi({"response": [[{"id": 1}], False], "execute_errors": [{"error_code": 6, "error_msg": "slow"}]})
+    batch = VkBatch(api)
+    user = batch.add("users.get", {"user_ids": 1}, parser=lambda raw: raw["response"][0]["id"])
+    photos = batch.add("photos.get", {"owner_id": 1}, parser=lambda raw: raw["response"])
+    assert user.get() == 1
+    with pytest.raises(VkTooManyRequests):
+        photos.get()
+    assert len(api.codes) == 1
+
+
+def test_batch_flushes_when_full():
+    api = FakeApi({"response": list(range(VkBatch.max_calls))})
+    batch = VkBatch(api)
+    results = [batch.add("users.get", {"user_ids": n}) for n in range(VkBatch.max_calls)]
+    assert len(api.codes) == 1 and batch.calls == []
+    assert [result.get() for result in results] == [{"response": n} for n in range(VkBatch.max_calls)]
+
+
+@pytest.mark.parametrize("error", [requests.ConnectionError("down"), VkApiError(5, "auth", "execute")])
+def test_failed_execute_is_raised_from_every_result(error):
+    batch = VkBatch(FakeApi(error=error))
+    first = batch.add("users.get", {"user_ids": 1}, parser=json.dumps)
+    second = batch.add("photos.get", {"owner_id": 1})
+    with pytest.raises(type(error)):
+        batch.flush()
+    for result in (first, second):
+        with pytest.raises(type(error)) as raised:
+            result.get()
+        assert raised.value is error
+
+
+def test_partial_execute_reply_fails_leftover_calls():
+    api = FakeApi({"response": [[{"id": 1}]]})  # ответ только на первый из трех вызовов
+    batch = VkBatch(api)
+    first = batch.add("users.get", {"user_ids": 1}, parser=lambda raw: raw["response"][0]["id"])
+    second = batch.add("photos.get", {"owner_id": 1})
+    third = batch.add("photos.get", {"owner_id": 2}, parser=lambda raw: raw["response"])
+    assert first.get() == 1
+    for result in (second, third):
+        with pytest.raises(VkApiError, match="1 results for 3 calls"):
+            result.get()
@@ -0,0 +1,95 @@
+import threading
+import time
+
+import pytest
+
+from callback_server import CallbackServer
+
+
+class FakeDispatcher:
+    def __init__(self, accept=True, delay=0):
+        self.accept = accept
+        self.delay = delay
+        self.events = []
+        self.lock = threading.Lock()
+
+    def submit(self, event, timeout=None):
+        time.sleep(self.delay)  # Окно, в которое попадают повторные доставки
+        with self.lock:
+            self.events.append(event)
+        return self.accept
+
+
+def message(event_id, user_id=1):
+    return {
+        "type": "message_new",
+        "event_id": event_id,
+        "object": {"message": {"from_id": user_id, "text": "привет"}},
+    }
+
+
+@pytest.fixture
+def make_server():
+    servers = []
+
+    def make(dispatcher, **kwargs):
+        server = CallbackServer(("127.0.0.1", 0), dispatcher, confirmation="code", **kwargs)
+        servers.append(server)
+        return server
+
+    yield make
+    for server in servers:
+        server.server_close()
+
+
+def test_duplicate_event_is_dropped(make_server):
+    dispatcher = FakeDispatcher()
+    server = make_server(dispatcher)
+    assert server.handle_payload(message("e1"), b"") == (200, "ok")
+    assert server.handle_payload(message("e1"), b"") == (200, "ok")
+    assert len(dispatcher.events) == 1
+    assert server.duplicates == 1
+
+
+def test_concurrent_duplicates_are_submitted_once(make_server):
+    dispatcher = FakeDispatcher(delay=0.05)
+    server = make_server(dispatcher)
+    start = threading.Barrier(8)
+
+    def deliver():
+        start.wait(timeout=1)
+        server.handle_payload(message("e1"), b"")
+
+    threads = [threading.Thread(target=deliver) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(dispatcher.events) == 1
+    assert server.duplicates == 7
+
+
+def test_rejected_event_is_accepted_on_retry(make_server):
+    dispatcher = FakeDispatcher(accept=False)
+    server = make_server(dispatcher)
+    assert server.handle_payload(message("e1"), b"") == (503, "busy")
+    assert "e1" not in server.seen_events
+    dispatcher.accept = True
+    assert server.handle_payload(message("e1"), b"") == (200, "ok")
+    assert server.accepted == 1
+    assert server.duplicates == 0
+
+
+def test_seen_events_are_bounded(make_server):
+    server = make_server(FakeDispatcher(), max_seen_events=2)
+    for event_id in ("e1", "e2", "e3"):
+        server.handle_payload(message(event_id), b"")
+    assert list(server.seen_events) == ["e2", "e3"]
+
+
+def test_reuse_port_with_peers_is_rejected():
+    with pytest.raises(ValueError):
+        CallbackServer(
+            ("127.0.0.1", 0), FakeDispatcher(), confirmation="code",
+            peers=["http://a/", "http://b/"], reuse_port=True
+        )
@@ -0,0 +1,263 @@
+import asyncio
+import json
+
+import aiohttp
+import pytest
+import requests
+
+import VK_async
+import VK_class
+import circuit_breaker
+from VK_async import AsyncVkApi
+from VK_class import ApiBasic, VkCircuitOpen
+from circuit_breaker import CircuitBreaker
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(circuit_breaker.time, "monotonic", clock.monotonic)
+    return clock
+
+
+@pytest.fixture
+def breaker(monkeypatch, clock):
+    """Свежий размыкатель, который клиенты VK получают для любого метода."""
+    breaker = CircuitBreaker("test", window=4, min_calls=2, error_rate=0.5, cooldown=10)
+    monkeypatch.setattr(VK_class, "get_breaker", lambda method: breaker)
+    monkeypatch.setattr(VK_async, "get_breaker", lambda method: breaker)
+    monkeypatch.setattr(VK_class.time, "sleep", lambda seconds: None)
+    return breaker
+
+
+def open_breaker(breaker):
+    breaker.record(breaker.allow(), False)
+    breaker.record(breaker.allow(), False)
+    assert breaker.stats()["state"] == "open"
+
+
+def test_stays_closed_below_min_calls(clock):
+    breaker = CircuitBreaker(window=4, min_calls=3, error_rate=0.5)
+    breaker.record(breaker.allow(), False)
+    breaker.record(breaker.allow(), False)
+    assert breaker.allow()
+    assert breaker.stats()["state"] == "closed"
+
+
+def test_opens_when_error_rate_reached_and_rejects_calls(clock):
+    breaker = CircuitBreaker(window=4, min_calls=4, error_rate=0.5)
+    for success in (True, True, False):
+        breaker.record(breaker.allow(), success)
+    token = breaker.allow()
+    assert token
+    breaker.record(token, False)
+    assert not breaker.allow()
+    assert breaker.stats() == {"state": "open", "trips": 1, "rejected": 1, "errors": 2, "calls": 4}
+
+
+def test_allows_single_probe_after_cooldown(clock):
+    breaker = CircuitBreaker(min_calls=2, cooldown=10)
+    open_breaker(breaker)
+    clock.now += 9
+    assert not breaker.allow()
+    clock.now += 1
+    assert breaker.allow()
+    assert not breaker.allow()  # второй вызов ждет исхода пробного
+
+
+def test_successful_probe_closes(clock):
+    breaker = CircuitBreaker(min_calls=2, cooldown=10)
+    open_breaker(breaker)
+    clock.now += 10
+    token = breaker.allow()
+    assert token
+    breaker.record(token, True)
+    assert breaker.stats()["state"] == "closed"
+    assert breaker.stats()["calls"] == 0
+    assert breaker.allow()
+
+
+def test_failed_probe_reopens_for_another_cooldown(clock):
+    breaker = CircuitBreaker(min_calls=2, cooldown=10)
+    open_breaker(breaker)
+    clock.now += 10
+    token = breaker.allow()
+    assert token
+    breaker.record(token, False)
+    assert not breaker.allow()
+    clock.now += 10
+    assert breaker.allow()
+
+
+def test_only_probe_outcome_decides_half_open_circuit(clock):
+    breaker = CircuitBreaker("test-probe", min_calls=2, cooldown=10)
+    slow_call = breaker.allow()  # Начат до размыкания, завершится во время пробного вызова
+    open_breaker(breaker)
+    clock.now += 10
+    probe_token = breaker.allow()
+    assert breaker.stats()["state"] == "half-open"
+    breaker.record(slow_call, True)  # Успех устаревшего вызова не замыкает цепь
+    assert breaker.probe == probe_token
+    assert breaker.stats()["state"] == "half-open"
+    breaker.record(probe_token, True)
+    assert breaker.stats()["state"] == "closed"
+
+
+def test_state_is_exported_as_gauge(clock):
+    breaker = CircuitBreaker("test-gauge", min_calls=2, cooldown=10)
+
+    def state():
+        return circuit_breaker.CIRCUIT_STATE.values[("test-gauge",)]
+
+    assert state() == circuit_breaker.CLOSED
+    open_breaker(breaker)
+    assert state() == circuit_breaker.OPEN
+    clock.now += 10
+    token = breaker.allow()
+    assert state() == circuit_breaker.HALF_OPEN
+    breaker.record(token, True)
+    assert state() == circuit_breaker.CLOSED
+
+
+class FakeResponse:
+    def __init__(self, status_code=200, text="{}"):
+        self.status_code = status_code
+        self.text = text
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class FakeTransport:
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+
+    def request(self, *args, **kwargs):
+        self.calls += 1
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, BaseException):
+            raise outcome
+        return outcome
+
+
+def client(transport):
+    api = ApiBasic()
+    api.transport = transport
+    return api
+
+
+def probe(breaker, clock):
+    open_breaker(breaker)
+    clock.now += 10
+
+
+def test_unexpected_error_on_probe_reopens_circuit(breaker, clock):
+    probe(breaker, clock)
+    api = client(FakeTransport(FakeResponse(text="<html>")))
+    with pytest.raises(ValueError):
+        api._send_request("GET", "method/users.get", response_type="json")
+    assert breaker.probe is None
+    assert breaker.stats()["state"] == "open"
+    clock.now += 10
+    assert breaker.allow()  # следующий пробный вызов не заблокирован навсегда
+
+
+def test_network_error_is_retried(breaker):
+    transport = FakeTransport(requests.ConnectionError("reset"), FakeResponse(text='{"response": 1}'))
+    assert client(transport)._send_request("GET", "method/users.get", response_type="json") == {"response": 1}
+    assert transport.calls == 2
+    assert list(breaker.outcomes) == [False, True]
+
+
+def test_network_error_is_raised_after_retries(breaker):
+    breaker.min_calls = 10
+    transport = FakeTransport(*[requests.ConnectionError("reset")] * 4)
+    api = client(transport)
+    with pytest.raises(requests.ConnectionError):
+        api._send_request("GET", "method/users.get", response_type="json")
+    assert transport.calls == api.max_retries + 1
+    assert list(breaker.outcomes) == [False] * 4
+
+
+def test_retries_stop_when_circuit_opens(breaker):
+    transport = FakeTransport(*[requests.ConnectionError("reset")] * 4)
+    with pytest.raises(VkCircuitOpen):
+        client(transport)._send_request("GET", "method/users.get", response_type="json")
+    assert transport.calls == 2  # после двух ошибок из двух цепь разомкнута
+
+
+def test_permanent_vk_error_is_not_retried_and_counts_as_success(breaker):
+    transport = FakeTransport(FakeResponse(text='{"error": {"error_code": 15, "error_msg": "Access denied"}}'))
+    with pytest.raises(VK_class.VkApiError):
+        client(transport)._send_request("GET", "method/users.get", response_type="json")
+    assert transport.calls == 1
+    assert list(breaker.outcomes) == [True]
+
+
+class FakeAsyncTransport:
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+
+    async def request(self, *args, **kwargs):
+        self.calls += 1
+        outcome = self.outcomes.pop(0)
+        if outcome == "hang":
+            await asyncio.sleep(3600)
+        if isinstance(outcome, BaseException):
+            raise outcome
+        return outcome
+
+
+def async_client(transport, monkeypatch):
+    async def no_sleep(seconds):
+        pass
+
+    monkeypatch.setattr(VK_async.asyncio, "sleep", no_sleep)
+    api = AsyncVkApi.__new__(AsyncVkApi)
+    api.params = {}
+    api.transport = transport
+    api.limiter = None
+    return api
+
+
+def test_async_cancelled_probe_reopens_circuit(breaker, clock):
+    probe(breaker, clock)
+    api = AsyncVkApi.__new__(AsyncVkApi)
+    api.transport = FakeAsyncTransport("hang")
+    api.limiter = None
+
+    async def cancel_probe():
+        task = asyncio.ensure_future(api._send_request("GET", "method/users.get"))
+        await asyncio.sleep(0)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(cancel_probe())
+    assert breaker.probe is None
+    assert breaker.stats()["state"] == "open"
+
+
+def test_async_bad_json_on_probe_reopens_circuit(breaker, clock, monkeypatch):
+    probe(breaker, clock)
+    api = async_client(FakeAsyncTransport((200, "<html>")), monkeypatch)
+    with pytest.raises(ValueError):
+        asyncio.run(api._send_request("GET", "method/users.get"))
+    assert breaker.probe is None
+
+
+def test_async_network_error_is_retried(breaker, monkeypatch):
+    transport = FakeAsyncTransport(aiohttp.ClientConnectionError("reset"), (200, '{"response": 1}'))
+    api = async_client(transport, monkeypatch)
+    assert asyncio.run(api._send_request("GET", "method/users.get")) == {"response": 1}
+    assert transport.calls == 2
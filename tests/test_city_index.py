@@ -0,0 +1,70 @@
+import json
+
+from city_index import CityIndex
+
+
+def read_lines(path):
+    return [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()]
+
+
+def test_lookup_is_case_and_space_insensitive(tmp_path):
+    index = CityIndex(str(tmp_path / "cities.json"))
+    index.add(1, "Москва")
+    assert index.find_by_name("  москва ") == ("Москва", 1)
+    assert index.find_by_id(1) == "Москва"
+    assert index.find_by_name("Тверь") is None
+    assert index.find_by_id(2) is None
+
+
+def test_new_cities_are_appended_and_reloaded(tmp_path):
+    path = tmp_path / "cities.json"
+    index = CityIndex(str(path))
+    index.add(1, "Москва")
+    index.add(2, "Санкт-Петербург")
+    index.add(1, "Москва")  # Уже известный город файл не меняет
+    assert read_lines(path) == [{"id": 1, "title": "Москва"}, {"id": 2, "title": "Санкт-Петербург"}]
+    reloaded = CityIndex(str(path))
+    assert reloaded.find_by_name("санкт-петербург") == ("Санкт-Петербург", 2)
+
+
+def test_user_queries_are_kept_in_memory_only_and_capped(tmp_path):
+    path = tmp_path / "cities.json"
+    index = CityIndex(str(path), max_aliases=2)
+    index.add(1, "Москва", query="мск")
+    index.add(1, "Москва", query="моск")
+    index.add(1, "Москва", query="масква")
+    assert index.find_by_name("масква") == ("Москва", 1)
+    assert index.find_by_name("мск") is None  # Вытеснен самым старым
+    assert read_lines(path) == [{"id": 1, "title": "Москва"}]
+    assert CityIndex(str(path)).find_by_name("масква") is None
+
+
+def test_missing_names_are_remembered_until_found(tmp_path):
+    index = CityIndex(str(tmp_path / "cities.json"))
+    index.add_missing("Атлантида")
+    assert index.find_by_name("атлантида") == (None, None)
+    index.add(7, "Атлантида", query="атлантида")
+    assert index.find_by_name("Атлантида") == ("Атлантида", 7)
+
+
+def test_legacy_file_and_damaged_lines_are_read(tmp_path):
+    path = tmp_path / "cities.json"
+    path.write_text(
+        '{"by_id": {"1": "Москва"}, "by_name": {"москва": 1, "мск": 1}}\nnot json\n{"id": 2, "title": "Тверь"}\n',
+        encoding="utf-8",
+    )
+    index = CityIndex(str(path))
+    assert index.find_by_name("москва") == ("Москва", 1)
+    assert index.find_by_name("тверь") == ("Тверь", 2)
+    assert index.find_by_name("мск") is None  # Синонимы из старого файла не переносятся
+
+
+def test_file_with_many_repeats_is_compacted_on_load(tmp_path):
+    path = tmp_path / "cities.json"
+    path.write_text('{"id": 1, "title": "Москва"}\n' * 5, encoding="utf-8")
+    assert CityIndex(str(path)).find_by_id(1) == "Москва"
+    assert read_lines(path) == [{"id": 1, "title": "Москва"}]
+
+
+def test_missing_file_means_empty_index(tmp_path):
+    assert CityIndex(str(tmp_path / "absent.json")).find_by_name("Москва") is None
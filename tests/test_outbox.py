@@ -0,0 +1,130 @@
+import threading
+
+import requests
+
+import outbox
+from VK_class import VkApiError
+from outbox import MessageOutbox
+
+
+class BlockingSend:
+    """Функция отправки, которая держит первое сообщение, пока тест не отпустит его."""
+
+    def __init__(self):
+        self.sent = []
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def __call__(self, user_id, message, random_id, keyboard, attachment):
+        self.started.set()
+        self.release.wait(timeout=5)
+        self.sent.append((user_id, message, keyboard))
+
+
+def queue_behind_first(send, messages, **kwargs):
+    """Ставит сообщения в очередь, пока первое сообщение пользователя 1 отправляется."""
+    box = MessageOutbox(send, workers=1, **kwargs)
+    box.send(1, "first")
+    send.started.wait(timeout=5)
+    for args in messages:
+        box.send(*args[:3], replaceable=args[3] if len(args) > 3 else False)
+    send.release.set()
+    box.close()
+    return box
+
+
+def test_newer_keyboard_strips_replaceable_keyboards_but_keeps_text():
+    send = BlockingSend()
+    box = queue_behind_first(send, [
+        (1, "Не поняла вашего ответа...", "menu", True),
+        (1, "Возвращаемся в главное меню", "menu", True),
+        (1, "Выберите действие", "menu-2"),
+    ])
+    assert send.sent == [
+        (1, "first", None),
+        (1, "Не поняла вашего ответа...", None),
+        (1, "Возвращаемся в главное меню", None),
+        (1, "Выберите действие", "menu-2"),
+    ]
+    assert box.stats()["coalesced"] == 2
+
+
+def test_keyboards_of_regular_messages_are_kept():
+    send = BlockingSend()
+    box = queue_behind_first(send, [(1, "Кандидат", "inline"), (1, "Меню", "menu")])
+    assert send.sent[1:] == [(1, "Кандидат", "inline"), (1, "Меню", "menu")]
+    assert box.stats()["coalesced"] == 0
+
+
+def test_message_without_keyboard_does_not_coalesce():
+    send = BlockingSend()
+    box = queue_behind_first(send, [(1, "Меню", "menu", True), (1, "Текст", None)])
+    assert send.sent[1:] == [(1, "Меню", "menu"), (1, "Текст", None)]
+
+
+def test_coalescing_is_per_user_and_can_be_disabled():
+    send = BlockingSend()
+    box = queue_behind_first(send, [(2, "Меню", "menu", True), (1, "Меню", "menu-2")])
+    assert (2, "Меню", "menu") in send.sent
+    send = BlockingSend()
+    box = queue_behind_first(send, [(1, "Меню", "menu", True), (1, "Меню", "menu-2")], coalesce=False)
+    assert send.sent[1:] == [(1, "Меню", "menu"), (1, "Меню", "menu-2")]
+    assert box.stats()["coalesced"] == 0
+
+
+def test_messages_of_one_user_keep_order():
+    sent = []
+    box = MessageOutbox(lambda user_id, message, *args: sent.append((user_id, message)), workers=4)
+    for number in range(50):
+        box.send(number % 3, number)
+    box.close()
+    for user_id in range(3):
+        assert [message for uid, message in sent if uid == user_id] == list(range(user_id, 50, 3))
+
+
+def test_network_error_is_retried_with_same_random_id(monkeypatch):
+    monkeypatch.setattr(outbox.time, "sleep", lambda seconds: None)
+    random_ids = []
+
+    def send(user_id, message, random_id, keyboard, attachment):
+        random_ids.append(random_id)
+        if len(random_ids) < 3:
+            raise requests.ConnectionError("reset")
+
+    box = MessageOutbox(send, workers=1, retries=2)
+    box.send(1, "Привет")
+    box.close()
+    assert len(set(random_ids)) == 1 and len(random_ids) == 3
+    assert box.stats()["sent"] == 1
+
+
+def test_api_error_is_not_retried():
+    calls = []
+
+    def send(*args):
+        calls.append(args)
+        raise VkApiError(901, "Can't send messages")
+
+    box = MessageOutbox(send, workers=1)
+    box.send(1, "Привет")
+    box.close()
+    assert len(calls) == 1
+    assert box.stats()["failed"] == 1
+
+
+def test_unexpected_error_does_not_strand_user_messages():
+    sent = []
+
+    def send(user_id, message, *args):
+        if message == "broken":
+            raise ValueError("bad response")
+        sent.append(message)
+
+    box = MessageOutbox(send, workers=1)
+    box.send(1, "broken")
+    box.send(1, "after")
+    box.close()  # Раньше зависал: поток отправки погибал, а pending_count не обнулялся
+    assert sent == ["after"]
+    assert box.stats()["failed"] == 1
+    assert box.stats()["pending"] == 0
+    assert not any(thread.is_alive() for thread in box.threads)
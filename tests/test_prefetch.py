@@ -0,0 +1,94 @@
+import threading
+from collections import deque
+
+import pytest
+
+from VK_class import VkApiError
+from prefetch import CandidatePrefetcher, SearchCursorError
+
+
+def resolve_all(candidate_ids):
+    return {candidate_id: candidate_id * 10 for candidate_id in candidate_ids}
+
+
+@pytest.fixture
+def prefetcher():
+    prefetcher = CandidatePrefetcher(depth=2, workers=2)
+    yield prefetcher
+    prefetcher.shutdown()
+
+
+def test_skips_excluded_and_keeps_order(prefetcher):
+    prefetched, candidates = deque(), iter([1, 2, 3, 4])
+    assert prefetcher.next(prefetched, candidates, resolve_all, excluded={2}) == 10
+    assert prefetcher.next(prefetched, candidates, resolve_all, excluded={2}) == 30
+    assert prefetcher.next(prefetched, candidates, resolve_all, excluded={2}) == 40
+    with pytest.raises(StopIteration):
+        prefetcher.next(prefetched, candidates, resolve_all, excluded={2})
+
+
+def test_resolves_look_ahead_with_one_call():
+    prefetcher = CandidatePrefetcher(depth=3, workers=1)
+    calls = []
+
+    def resolve(candidate_ids):
+        calls.append(candidate_ids)
+        return resolve_all(candidate_ids)
+
+    prefetched, candidates = deque(), iter(range(1, 8))
+    assert prefetcher.next(prefetched, candidates, resolve) == 10
+    assert calls[0] == [1, 2, 3]  # первые кандидаты - одним вызовом, а не тремя
+    assert prefetcher.next(prefetched, candidates, resolve) == 20
+    for future in prefetched:
+        future.result()
+    prefetcher.shutdown()
+    assert calls == [[1, 2, 3], [4], [5]]  # дальше очередь дополняется по одному показанному кандидату
+
+
+def test_counts_hit_when_candidate_is_ready(prefetcher):
+    prefetched, candidates = deque(), iter([1, 2, 3])
+    prefetcher.next(prefetched, candidates, resolve_all)
+    for future in prefetched:
+        future.result()  # пользователь смотрит кандидата, следующий успевает загрузиться
+    prefetcher.next(prefetched, candidates, resolve_all)
+    assert prefetcher.stats()["hits"] >= 1
+
+
+def test_counts_miss_when_candidate_is_not_ready(prefetcher):
+    release = threading.Event()
+
+    def slow(candidate_ids):
+        release.wait(timeout=5)
+        return resolve_all(candidate_ids)
+
+    prefetched, candidates = deque(), iter([1])
+    threading.Timer(0.05, release.set).start()
+    assert prefetcher.next(prefetched, candidates, slow) == 10
+    assert prefetcher.stats() == {"hits": 0, "misses": 1}
+
+
+def test_skips_candidates_without_profile(prefetcher):
+    resolve = lambda candidate_ids: {i: i for i in candidate_ids if i != 1}  # профиль 1 удален
+    assert prefetcher.next(deque(), iter([1, 2]), resolve) == 2
+
+
+def test_resolve_error_reaches_every_candidate_of_batch(prefetcher):
+    def broken(candidate_ids):
+        raise VkApiError(10, "Internal server error", "execute")
+
+    prefetched, candidates = deque(), iter([1, 2])
+    with pytest.raises(VkApiError):
+        prefetcher.next(prefetched, candidates, broken)
+    with pytest.raises(VkApiError):
+        prefetched.popleft().result()
+
+
+def broken_search():
+    yield 101
+    raise VkApiError(6, "Too many requests per second", "users.search")
+
+
+def test_reports_cursor_errors(prefetcher):
+    with pytest.raises(SearchCursorError) as error:
+        prefetcher.next(deque(), broken_search(), resolve_all)
+    assert isinstance(error.value.__cause__, VkApiError)
@@ -0,0 +1,126 @@
+import asyncio
+import threading
+
+import pytest
+
+import profiles
+from profiles import ProfileResolver
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 500.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(profiles.time, "monotonic", clock.monotonic)
+    return clock
+
+
+class Fetcher:
+    """users.get, который запоминает запрошенные пачки идентификаторов."""
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, user_ids):
+        self.calls.append(list(user_ids))
+        return [{"id": user_id, "first_name": f"Имя{user_id}"} for user_id in user_ids]
+
+
+def test_misses_are_fetched_in_one_call_and_duplicates_once(clock):
+    fetch = Fetcher()
+    resolver = ProfileResolver()
+    found = resolver.get_many([1, 2, 1, 3], fetch)
+    assert sorted(found) == [1, 2, 3]
+    assert fetch.calls == [[1, 2, 3]]
+    assert resolver.get_many([2, 3, 4], fetch).keys() == {2, 3, 4}
+    assert fetch.calls == [[1, 2, 3], [4]]
+    assert resolver.stats() == {"size": 4, "hits": 2, "misses": 4}
+
+
+def test_profiles_expire_after_ttl(clock):
+    fetch = Fetcher()
+    resolver = ProfileResolver(ttl=60)
+    resolver.get(1, fetch)
+    clock.now += 60
+    resolver.get(1, fetch)
+    assert len(fetch.calls) == 1
+    clock.now += 1
+    resolver.get(1, fetch)
+    assert len(fetch.calls) == 2
+
+
+def test_cache_is_bounded_lru(clock):
+    fetch = Fetcher()
+    resolver = ProfileResolver(max_size=2)
+    resolver.get_many([1, 2], fetch)
+    resolver.get(1, fetch)  # 1 становится самым свежим
+    resolver.get(3, fetch)
+    assert list(resolver.cache) == [1, 3]
+
+
+def test_large_requests_are_split_by_max_ids(clock, monkeypatch):
+    monkeypatch.setattr(ProfileResolver, "max_ids", 2)
+    fetch = Fetcher()
+    ProfileResolver().get_many([1, 2, 3, 4, 5], fetch)
+    assert fetch.calls == [[1, 2], [3, 4], [5]]
+
+
+def test_missing_profile_raises_key_error(clock):
+    with pytest.raises(KeyError):
+        ProfileResolver().get(1, lambda user_ids: [])
+
+
+def test_concurrent_request_waits_for_inflight_fetch():
+    resolver = ProfileResolver()
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def slow_fetch(user_ids):
+        calls.append(list(user_ids))
+        started.set()
+        release.wait(5)
+        return [{"id": user_id} for user_id in user_ids]
+
+    results = {}
+    first = threading.Thread(target=lambda: results.update(first=resolver.get(7, slow_fetch)))
+    first.start()
+    started.wait(5)
+    second = threading.Thread(target=lambda: results.update(second=resolver.get(7, slow_fetch)))
+    second.start()
+    release.set()
+    first.join(5)
+    second.join(5)
+    assert calls == [[7]]
+    assert results == {"first": {"id": 7}, "second": {"id": 7}}
+
+
+def test_failed_fetch_releases_waiters(clock):
+    resolver = ProfileResolver()
+
+    def failing_fetch(user_ids):
+        raise RuntimeError("VK is down")
+
+    with pytest.raises(RuntimeError):
+        resolver.get_many([1], failing_fetch)
+    assert resolver.inflight == {}
+    assert resolver.get(1, Fetcher()) == {"id": 1, "first_name": "Имя1"}
+
+
+def test_async_get_many_uses_same_cache(clock):
+    fetch = Fetcher()
+    resolver = ProfileResolver()
+    resolver.get(1, fetch)
+
+    async def async_fetch(user_ids):
+        return fetch(user_ids)
+
+    found = asyncio.run(resolver.get_many_async([1, 2], async_fetch))
+    assert found.keys() == {1, 2}
+    assert fetch.calls == [[1], [2]]
@@ -0,0 +1,101 @@
+import asyncio
+
+import pytest
+
+import rate_limiter
+from rate_limiter import TokenBucket, get_limiter
+
+
+class FakeClock:
+    """Часы, которые идут только при sleep: ожидания ограничителя проверяются без реального времени."""
+
+    def __init__(self):
+        self.now = 100.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(rate_limiter.time, "monotonic", clock.monotonic)
+    monkeypatch.setattr(rate_limiter.time, "sleep", clock.sleep)
+    return clock
+
+
+def test_burst_up_to_capacity_does_not_wait(clock):
+    bucket = TokenBucket(3)
+    assert [bucket.acquire() for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert clock.sleeps == []
+
+
+def test_requests_over_capacity_wait_for_their_token(clock):
+    bucket = TokenBucket(4)
+    for _ in range(4):
+        bucket.acquire()
+    assert bucket.acquire() == pytest.approx(0.25)
+    assert bucket.acquire() == pytest.approx(0.25)
+    assert bucket.stats() == {"rate": 4, "acquired": 6, "waits": 2, "wait_time": 0.5}
+
+
+def test_reserved_tokens_queue_up_fairly(clock):
+    bucket = TokenBucket(2)
+    bucket.acquire()
+    bucket.acquire()
+    # Ожидания без сна: каждый следующий ждет на 1/rate дольше предыдущего
+    assert [bucket._reserve() for _ in range(3)] == pytest.approx([0.5, 1.0, 1.5])
+
+
+def test_tokens_refill_with_time_up_to_capacity(clock):
+    bucket = TokenBucket(2)
+    bucket.acquire()
+    bucket.acquire()
+    clock.now += 10
+    assert [bucket.acquire() for _ in range(2)] == [0.0, 0.0]
+    assert bucket.acquire() == pytest.approx(0.5)
+
+
+def test_acquire_async_waits_without_blocking(clock, monkeypatch):
+    slept = []
+
+    async def fake_sleep(seconds):
+        slept.append(seconds)
+
+    monkeypatch.setattr(asyncio, "sleep", fake_sleep)
+    bucket = TokenBucket(1)
+    assert asyncio.run(bucket.acquire_async()) == 0.0
+    assert asyncio.run(bucket.acquire_async()) == pytest.approx(1.0)
+    assert slept == [pytest.approx(1.0)] and clock.sleeps == []
+
+
+def test_set_rate_keeps_limit(clock):
+    bucket = TokenBucket(3)
+    bucket.set_rate(1000)
+    assert bucket.rate == 1000 and bucket.limit == 3
+    assert sum(bucket.acquire() for _ in range(10)) == pytest.approx(0.007)
+
+
+def test_get_limiter_shares_bucket_per_token():
+    assert get_limiter("test-shared-token", 5) is get_limiter("test-shared-token", 5)
+    assert get_limiter("test-other-token", 5) is not get_limiter("test-shared-token", 5)
+
+
+def test_get_limiter_keeps_stricter_rate_for_same_token():
+    limiter = get_limiter("test-mismatch-token", 20)
+    assert get_limiter("test-mismatch-token", 3) is limiter
+    assert limiter.rate == 3 and limiter.limit == 3
+    assert get_limiter("test-mismatch-token", 20) is limiter
+    assert limiter.rate == 3 and limiter.limit == 3
+
+
+def test_waits_are_exported_per_token(clock):
+    bucket = TokenBucket(2, name="...wait")
+    for _ in range(4):
+        bucket.acquire()
+    assert rate_limiter.LIMITER_WAIT_SECONDS.values[("...wait",)] == pytest.approx(1.0)
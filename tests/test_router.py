@@ -0,0 +1,152 @@
+import asyncio
+
+import pytest
+
+import VK_bot
+from VK_async import AsyncVkBot
+from VK_bot import VkBot
+from router import CommandRouter
+from sessions import SearchSession
+
+
+def test_normalize_ignores_case_spaces_and_yo():
+    assert CommandRouter.normalize("  Добавить   в ЧЁРНЫЙ список ") == "добавить в черный список"
+
+
+def test_resolve_finds_command_by_alias():
+    router = CommandRouter()
+    handler = object()
+    router.register("Поиск пары", handler, ("найти пару",))
+    assert router.resolve("НАЙТИ  пару") == ("Поиск пары", handler)
+    assert router.resolve("поиск пары") == ("Поиск пары", handler)
+
+
+def test_register_rejects_text_of_another_command():
+    router = CommandRouter()
+    router.register("Пропустить", lambda: None, ("дальше",))
+    router.register("Пропустить", lambda: None)  # повторная регистрация той же команды допустима
+    with pytest.raises(ValueError):
+        router.register("Следующий", lambda: None, ("Дальше",))
+
+
+def test_unknown_text_goes_to_fallback():
+    calls = []
+    router = CommandRouter(fallback=lambda *args: calls.append(args))
+    router.dispatch("что-то", 1, "session")
+    router.dispatch(None, 2, "session")
+    assert calls == [(1, "session"), (2, "session")]
+    assert router.stats()[CommandRouter.unknown]["count"] == 2
+
+
+def test_unknown_text_without_fallback_is_ignored():
+    router = CommandRouter()
+    assert router.dispatch("что-то", 1) is None
+    assert router.stats() == {}
+
+
+def test_dispatch_passes_arguments_and_returns_result():
+    router = CommandRouter()
+    router.register("Правила", lambda user_id, session: (user_id, session))
+    assert router.dispatch("правила", 5, "session") == (5, "session")
+    assert router.stats()["Правила"]["count"] == 1
+
+
+def test_middleware_can_block_command():
+    calls = []
+    router = CommandRouter()
+    router.register("Правила", lambda user_id: calls.append(user_id))
+    router.use(lambda name, user_id: user_id != 13)
+    router.dispatch("Правила", 13)
+    router.dispatch("Правила", 14)
+    assert calls == [14]
+    assert router.stats()["Правила"]["blocked"] == 1
+    assert router.stats()["Правила"]["count"] == 1
+
+
+def test_errors_are_counted_and_raised():
+    router = CommandRouter()
+
+    def fail(user_id):
+        raise RuntimeError("db is down")
+
+    router.register("Правила", fail)
+    with pytest.raises(RuntimeError):
+        router.dispatch("Правила", 1)
+    assert router.stats()["Правила"]["errors"] == 1
+
+
+def test_dispatch_async_awaits_coroutine_handlers():
+    router = CommandRouter()
+
+    async def handler(user_id):
+        await asyncio.sleep(0)
+        return user_id * 2
+
+    router.register("Поиск пары", handler)
+    router.register("Правила", lambda user_id: user_id)  # обычная функция тоже допустима
+    assert asyncio.run(router.dispatch_async("поиск пары", 21)) == 42
+    assert asyncio.run(router.dispatch_async("правила", 7)) == 7
+
+
+def bot_without_candidate(cls):
+    bot = cls.__new__(cls)
+    bot.messages = []
+    bot.added = []
+    bot.handle_add_to_favourites = lambda *args: bot.added.append(args)
+    bot.handle_add_to_blacklist = lambda *args: bot.added.append(args)
+    return bot
+
+
+@pytest.mark.parametrize("command", ["command_add_favourite", "command_add_black_list"])
+def test_sync_bot_answers_when_there_is_no_candidate(command):
+    bot = bot_without_candidate(VkBot)
+    bot.write_msg = lambda user_id, message, *args, **kwargs: bot.messages.append((user_id, message))
+    getattr(bot, command)(1, SearchSession(1))
+    assert bot.messages == [(1, VkBot.no_candidate_text)]
+    assert bot.added == []
+
+
+@pytest.mark.parametrize("command", ["command_add_favourite", "command_add_black_list"])
+def test_async_bot_answers_when_there_is_no_candidate(command):
+    bot = bot_without_candidate(AsyncVkBot)
+
+    async def write_msg(user_id, message, *args, **kwargs):
+        bot.messages.append((user_id, message))
+
+    bot.write_msg = write_msg
+    asyncio.run(getattr(bot, command)(1, SearchSession(1)))
+    assert bot.messages == [(1, VkBot.no_candidate_text)]
+    assert bot.added == []
+
+
+class NoCitySearch:
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def search_city(self, city):
+        raise AssertionError(f"command '{city}' was sent to city search")
+
+
+@pytest.mark.parametrize("text", ["Начать", "поиск пары", "Сменить город"])
+def test_sync_bot_does_not_search_commands_as_city(text, monkeypatch):
+    monkeypatch.setattr(VK_bot, "My_VkApi", NoCitySearch)
+    bot = bot_without_candidate(VkBot)
+    bot.access_token = "user-token"
+    bot.router = bot.build_router()
+    bot.write_msg = lambda user_id, message, *args, **kwargs: bot.messages.append((user_id, message))
+    bot.handle_city_request(1, text)
+    assert bot.messages == [(1, "Укажите ваш город")]
+
+
+@pytest.mark.parametrize("text", ["Начать", "поиск пары", "Сменить город"])
+def test_async_bot_does_not_search_commands_as_city(text):
+    bot = bot_without_candidate(AsyncVkBot)
+    bot.user_api = NoCitySearch()
+    bot.router = bot.build_router()
+
+    async def write_msg(user_id, message, *args, **kwargs):
+        bot.messages.append((user_id, message))
+
+    bot.write_msg = write_msg
+    asyncio.run(bot.handle_city_request(1, text))
+    assert bot.messages == [(1, "Укажите ваш город")]
@@ -0,0 +1,128 @@
+import pytest
+
+import VK_bot
+import sessions
+from VK_bot import VkBot
+from loadtest import MemoryDatabase
+from VK_class import VkApiError
+from prefetch import CandidatePrefetcher
+from sessions import SearchSession, SessionStore
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(sessions.time, "monotonic", clock.monotonic)
+    return clock
+
+
+def test_store_returns_same_session_until_ttl_expires(clock):
+    store = SessionStore(ttl=60)
+    session = store.get(1)
+    clock.now += 59
+    assert store.get(1) is session
+    clock.now += 61
+    assert store.get(1) is not session
+
+
+def test_store_evicts_least_recently_used(clock):
+    store = SessionStore(max_sessions=2)
+    first = store.get(1)
+    store.get(2)
+    assert store.get(1) is first  # 1 стал самым свежим, вытесняется 2
+    store.get(3)
+    assert len(store) == 2
+    assert list(store.sessions) == [1, 3]
+
+
+def test_store_drops_expired_sessions_of_other_users(clock):
+    store = SessionStore(ttl=10)
+    store.get(1)
+    clock.now += 11
+    store.get(2)
+    assert list(store.sessions) == [2]
+
+
+def test_session_searches_again_when_params_change():
+    session = SearchSession(1)
+    assert session.needs_search((1, 18, 30, 1))
+    session.start_search((1, 18, 30, 1), iter([5]))
+    assert not session.needs_search((1, 18, 30, 1))
+    assert session.needs_search((1, 18, 30, 2))
+
+
+def test_end_search_keeps_current_candidate():
+    session = SearchSession(1)
+    session.start_search((1, 18, 30, 1), iter([5]))
+    session.current = (5, "Имя Фамилия", "photo5_1")
+    session.end_search()
+    assert session.needs_search((1, 18, 30, 1))
+    assert session.current == (5, "Имя Фамилия", "photo5_1")
+
+
+def broken_search():
+    yield 101
+    raise VkApiError(6, "Too many requests per second", "users.search")
+
+
+class FakeDatabase:
+    def get_excluded_ids(self, user_id):
+        return set()
+
+
+@pytest.fixture
+def bot():
+    bot = VkBot.__new__(VkBot)  # Без токенов, long poll и БД: проверяем только логику поиска
+    bot.prefetcher = CandidatePrefetcher(depth=2, workers=1)
+    bot.database = FakeDatabase()
+    bot.sent = []
+    bot.write_msg = lambda user_id, message, keyboard=None, attachment=None, **kwargs: bot.sent.append(message)
+    bot.fetch_candidates = lambda candidate_ids: {
+        candidate_id: (candidate_id, "Имя Фамилия", f"photo{candidate_id}_1") for candidate_id in candidate_ids
+    }
+    yield bot
+    bot.prefetcher.shutdown()
+
+
+def test_failed_search_page_starts_new_search_on_next_message(bot):
+    session = SearchSession(1)
+    session.start_search((1, 18, 30, 1), broken_search())
+    assert bot.send_next_photo(1, session) == (None, None, None)
+    assert any(message.startswith("Error fetching new user") for message in bot.sent)
+    assert session.needs_search((1, 18, 30, 1))
+
+
+def test_exhausted_search_starts_new_search_on_next_message(bot):
+    session = SearchSession(1)
+    session.start_search((1, 18, 30, 1), iter([7]))
+    assert bot.send_next_photo(1, session)[0] == 7
+    assert bot.send_next_photo(1, session) == (None, None, None)
+    assert bot.sent[-1] == "Больше нет доступных фотографий."
+    assert session.needs_search((1, 18, 30, 1))
+
+
+class FakeProfileApi:
+    def __init__(self, token, rps=None):
+        pass
+
+    def get_user_info(self, user_id):
+        return {user_id: {"sex": "Женский", "age": 25, "city_id": 7}}
+
+
+def test_start_bot_keeps_city_reset_by_user(monkeypatch):
+    monkeypatch.setattr(VK_bot, "My_VkApi", FakeProfileApi)
+    bot = VkBot.__new__(VkBot)
+    bot.group_access_token = "group-token"
+    bot.database = MemoryDatabase()
+    assert bot.start_bot(1)[6] == 7  # Новый пользователь получает город из профиля
+    bot.database.update_user_city(1, None)  # "Сменить город"
+    assert bot.start_bot(1)[6] is None
+    assert bot.database.cities == {1: None}
@@ -0,0 +1,35 @@
+from VK_class import get_top3_likes, get_top_likes, get_top_likes_many
+
+
+def photos(owner_id, likes):
+    return {"response": {"count": len(likes), "items": [
+        {"owner_id": owner_id, "id": photo_id, "likes": {"count": count}} for photo_id, count in enumerate(likes, 1)
+    ]}}
+
+
+def test_top_photos_are_ordered_by_likes():
+    assert get_top_likes(photos(5, [3, 40, 7, 12, 0]), 3) == "photo5_2 ,photo5_4 ,photo5_3"
+
+
+def test_ties_keep_original_order():
+    assert get_top_likes(photos(5, [1, 9, 9, 2]), 2) == "photo5_2 ,photo5_3"
+
+
+def test_fewer_photos_than_k_returns_all():
+    assert get_top_likes(photos(5, [1, 2]), 3) == "photo5_2 ,photo5_1"
+
+
+def test_photos_without_likes_count_as_zero():
+    response = photos(5, [4])
+    response["response"]["items"].append({"owner_id": 5, "id": 9})
+    assert get_top_likes(response, 2) == "photo5_1 ,photo5_9"
+
+
+def test_no_photos_or_error():
+    assert get_top_likes(photos(5, [])) == "фотографии нет"
+    assert get_top_likes({"error": {"error_code": 30}}) == "фотографии нет"
+
+
+def test_many_and_top3_wrappers():
+    assert get_top_likes_many({1: photos(1, [1, 5]), 2: photos(2, [])}, 1) == {1: "photo1_2", 2: "фотографии нет"}
+    assert get_top3_likes(photos(5, [1, 2, 3, 4])) == "photo5_4 ,photo5_3 ,photo5_2"
@@ -0,0 +1,178 @@
+import atexit
+import threading
+import time
+from contextlib import contextmanager
+
+import pytest
+
+import db_tools
+from db_tools import DB_FLUSH_DROPPED, DB_FLUSH_FAILURES, DB_creator, DB_editor
+
+
+class FakeServer:
+    """Таблица users в памяти: вставки видны чтениям только после фиксации транзакции."""
+
+    def __init__(self):
+        self.users = dict()  # user_id -> city_id, зафиксированные строки
+        self.log = []
+        self.fail = 0  # Сколько следующих вставок должно упасть
+        self.block = None  # Event, на котором вставка ждет (запись "в процессе")
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+        self.connection = conn
+        self.result = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, query, params=None):
+        self.conn.server.log.append("select")
+        city_id = self.conn.server.users.get(params[0])
+        self.result = None if params[0] not in self.conn.server.users else (city_id,)
+
+    def fetchone(self):
+        return self.result
+
+
+class FakeConnection:
+    def __init__(self, server):
+        self.server = server
+        self.autocommit = True
+        self.staged = dict()
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.server.users.update(self.staged)
+            self.server.log.append("commit")
+        else:
+            self.server.log.append("rollback")
+        self.staged = dict()
+        return False
+
+
+class FakePool:
+    def __init__(self, server):
+        self.server = server
+
+    @contextmanager
+    def connection(self):
+        yield FakeConnection(self.server)
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def server(monkeypatch):
+    server = FakeServer()
+
+    def execute_values(cur, query, rows, page_size=None):
+        table = query.split("INSERT INTO ")[1].split("(")[0]
+        server.log.append(f"insert {table}")
+        if server.block is not None:
+            server.block.wait(5)
+        if server.fail:
+            server.fail -= 1
+            raise RuntimeError("connection lost")
+        if table == "users":
+            cur.conn.staged.update((row[0], row[3]) for row in rows)
+
+    monkeypatch.setattr(db_tools.psycopg2.extras, "execute_values", execute_values)
+    monkeypatch.setattr(DB_creator, "get_settings", lambda file_name="settings.ini": ("db", "u", "p", "h", 5432))
+    monkeypatch.setattr(DB_creator, "get_pool_settings", lambda file_name="settings.ini": (1, 2, 1))
+    return server
+
+
+@pytest.fixture
+def editor(server):
+    editor = DB_editor(write_behind=True, flush_interval=3600, use_prepared=False, lazy_connect=True)
+    editor.pool = FakePool(server)
+    yield editor
+    editor.flush_stop.set()
+    atexit.unregister(editor.flush)  # Фейковый пул не переживет сброс буфера при выходе
+
+
+def test_flush_writes_users_before_lists_in_one_transaction(editor, server):
+    editor.register_user(1, 30, 1, 5)
+    editor.add_to_black_list(1, 100)
+    editor.add_to_favourites(1, "Имя", "Фамилия", 200, "{photo200_1}")
+    editor.flush()
+    assert server.log == ["insert users", "insert black_list", "insert favourite_users", "commit"]
+    assert server.users == {1: 5}
+    assert editor.pending_size() == 0
+
+
+def test_buffered_favourite_reports_buffered_count(editor, server):
+    assert editor.add_to_favourites(1, "Имя", "Фамилия", 200, "{photo200_1}") == 1
+    assert editor.add_to_favourites(1, "Имя", "Фамилия", 200, "{photo200_1}") == 0  # Уже ждет в буфере
+    assert editor.add_to_favourites(1, "Имя", "Фамилия", 201, "{photo201_1}") == 1
+    assert server.log == []
+
+
+def test_read_flushes_pending_writes_of_that_user(editor, server):
+    editor.register_user(1, 30, 1, 5)
+    assert server.users == {}
+    assert editor.get_user_city(1) == 5
+
+
+def test_read_waits_for_flush_in_progress(editor, server):
+    editor.register_user(1, 30, 1, 5)
+    server.block = threading.Event()
+    background = threading.Thread(target=editor.flush)
+    background.start()
+    while "insert users" not in server.log:
+        time.sleep(0.001)
+    # Пачка уже забрана из буфера, но еще не зафиксирована: чтение должно дождаться фиксации
+    result = {}
+    reader = threading.Thread(target=lambda: result.update(city=editor.get_user_city(1)))
+    reader.start()
+    time.sleep(0.05)
+    assert "select" not in server.log
+    server.block.set()
+    background.join(5)
+    reader.join(5)
+    assert result == {"city": 5}
+    assert server.log.index("commit") < server.log.index("select")
+
+
+def test_failed_flush_puts_batch_back_and_counts_failure(editor, server):
+    failures = DB_FLUSH_FAILURES.values.get((), 0)
+    editor.register_user(1, 30, 1, 5)
+    editor.add_to_black_list(1, 100)
+    server.fail = 1
+    editor.flush()
+    assert "rollback" in server.log and server.users == {}
+    assert editor.pending_size() == 2
+    assert DB_FLUSH_FAILURES.values[()] == failures + 1
+    assert editor.get_user_city(1) == 5  # Повтор при чтении записывает вернувшуюся пачку
+
+
+def test_newer_pending_values_win_over_requeued_batch(editor, server):
+    editor.register_user(1, 30, 1, 5)
+    server.fail = 1
+    editor.flush()
+    editor.register_user(2, 20, 2, 7)
+    editor.flush()
+    assert server.users == {1: 5, 2: 7}
+
+
+def test_batch_is_dropped_after_repeated_failures(editor, server):
+    dropped = DB_FLUSH_DROPPED.values.get((), 0)
+    editor.register_user(1, 30, 1, 5)
+    server.fail = editor.max_flush_attempts
+    for _ in range(editor.max_flush_attempts):
+        editor.flush()
+    assert editor.pending_size() == 0
+    assert DB_FLUSH_DROPPED.values[()] == dropped + 1
@@ -0,0 +1,330 @@
+import contextvars
+import json
+import os
+import queue
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+import requests
+
+_current = contextvars.ContextVar("current_span", default=None)  # Открытый span текущего события
+
+
+class Span:
+    """
+    Отрезок работы внутри трассы события.
+
+    Атрибуты:
+        trace_id (str): Идентификатор трассы (общий для всех span события).
+        span_id (str): Идентификатор span.
+        parent_id (str): Идентификатор родительского span или None для корня.
+        name (str): Название операции.
+        attributes (dict): Метки операции (метод, пользователь и т.д.).
+        start (float): Время начала, секунды от эпохи.
+        duration (float): Длительность, секунды.
+        status (str): ok или error.
+    """
+
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "attributes", "start", "started", "duration", "status")
+
+    def __init__(self, name: str, trace_id: str, parent_id: str = None, attributes: dict = None) -> None:
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes = attributes or {}
+        self.start = time.time()
+        self.started = time.perf_counter()
+        self.duration = 0.0
+        self.status = "ok"
+
+    def set(self, **attributes) -> None:
+        """Добавляет метки к span."""
+        self.attributes.update(attributes)
+
+    def to_dict(self) -> dict:
+        """Возвращает span в виде словаря для записи в JSONL."""
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": round(self.start, 6),
+            "duration_ms": round(self.duration * 1000, 3),
+            "status": self.status,
+            "attributes": self.attributes,
+        }
+
+
+class BatchExporter:
+    """
+    Базовый экспортер: span копятся в очереди и выгружаются пачками в фоновом потоке,
+    поэтому обработка события не ждет записи в файл или сеть.
+
+    Методы:
+        export: Ставит завершенный span в очередь.
+        write: Выгружает пачку span (реализуется в наследниках).
+        close: Выгружает оставшиеся span и останавливает поток.
+    """
+
+    def __init__(self, batch_size: int = 100, interval: float = 1.0, max_queue: int = 10000) -> None:
+        """
+        Параметры:
+            batch_size (int): Максимальный размер пачки.
+            interval (float): Как долго ждать заполнения пачки, секунды.
+            max_queue (int): Максимальная длина очереди; при переполнении span отбрасываются.
+        """
+        self.batch_size = batch_size
+        self.interval = interval
+        self.spans = queue.Queue(maxsize=max_queue)
+        self.dropped = 0
+        self.closed = threading.Event()
+        self.thread = threading.Thread(target=self._work, name="trace-exporter", daemon=True)
+        self.thread.start()
+
+    def export(self, span: Span) -> None:
+        """Ставит span в очередь выгрузки; при переполненной очереди span отбрасывается."""
+        try:
+            self.spans.put_nowait(span)
+        except queue.Full:
+            self.dropped += 1
+
+    def _work(self) -> None:
+        while not (self.closed.is_set() and self.spans.empty()):
+            batch = []
+            deadline = time.monotonic() + self.interval
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.spans.get(timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            if batch:
+                try:
+                    self.write(batch)
+                except Exception as e:
+                    print(f"Error exporting spans: {e}")  # Ошибка выгрузки не должна влиять на бота
+
+    def write(self, batch: list[Span]) -> None:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        """Выгружает оставшиеся span и останавливает фоновый поток."""
+        self.closed.set()
+        self.thread.join()
+
+
+class JsonlExporter(BatchExporter):
+    """Записывает span в локальный файл, по одному JSON-объекту на строку."""
+
+    def __init__(self, path: str = "traces.jsonl", **kwargs) -> None:
+        """
+        Параметры:
+            path (str): Путь к файлу; запись дописывается в конец.
+        """
+        self.file = open(path, "a", encoding="utf-8")
+        super().__init__(**kwargs)
+
+    def write(self, batch: list[Span]) -> None:
+        self.file.write("".join(json.dumps(span.to_dict(), ensure_ascii=False) + "\n" for span in batch))
+        self.file.flush()
+
+    def close(self) -> None:
+        super().close()
+        self.file.close()
+
+
+class OtlpExporter(BatchExporter):
+    """Отправляет span в коллектор по протоколу OTLP/HTTP в формате JSON (POST /v1/traces)."""
+
+    def __init__(self, endpoint: str = "http://127.0.0.1:4318/v1/traces", service: str = "vkinder", **kwargs) -> None:
+        """
+        Параметры:
+            endpoint (str): Адрес приема трасс коллектора.
+            service (str): Имя сервиса (service.name).
+        """
+        self.endpoint = endpoint
+        self.service = service
+        self.http = requests.Session()
+        super().__init__(**kwargs)
+
+    @staticmethod
+    def _value(value) -> dict:
+        if isinstance(value, bool):
+            return {"boolValue": value}
+        if isinstance(value, int):
+            return {"intValue": str(value)}
+        if isinstance(value, float):
+            return {"doubleValue": value}
+        return {"stringValue": str(value)}
+
+    def write(self, batch: list[Span]) -> None:
+        spans = []
+        for span in batch:
+            item = {
+                "traceId": span.trace_id,
+                "spanId": span.span_id,
+                "name": span.name,
+                "kind": 1,
+                "startTimeUnixNano": str(int(span.start * 1e9)),
+                "endTimeUnixNano": str(int((span.start + span.duration) * 1e9)),
+                "attributes": [{"key": key, "value": self._value(value)} for key, value in span.attributes.items()],
+                "status": {"code": 1 if span.status == "ok" else 2},
+            }
+            if span.parent_id:
+                item["parentSpanId"] = span.parent_id
+            spans.append(item)
+        payload = {
+            "resourceSpans": [{
+                "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": self.service}}]},
+                "scopeSpans": [{"scope": {"name": "vkinder"}, "spans": spans}],
+            }]
+        }
+        self.http.post(self.endpoint, json=payload, timeout=5).raise_for_status()
+
+
+class Tracer:
+    """
+    Трассировка событий с выборкой по началу трассы (head sampling).
+
+    Решение, записывать ли трассу, принимается один раз при создании
+    корневого span события. Для событий вне выборки дочерние span не
+    создаются: их стоимость - одно чтение contextvars.
+
+    Методы:
+        trace: Открывает корневой span события.
+        span: Открывает дочерний span внутри текущей трассы.
+    """
+
+    def __init__(self, exporter: BatchExporter = None, sample_rate: float = 0.0) -> None:
+        """
+        Параметры:
+            exporter (BatchExporter): Куда выгружать span; без него трассировка выключена.
+            sample_rate (float): Доля событий, для которых записывается трасса (от 0 до 1).
+        """
+        self.exporter = exporter
+        self.sample_rate = sample_rate if exporter is not None else 0.0
+
+    @contextmanager
+    def _run(self, span: Span):
+        token = _current.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.status = "error"
+            span.attributes["error"] = f"{type(e).__name__}: {e}"[:200]
+            raise
+        finally:
+            span.duration = time.perf_counter() - span.started
+            _current.reset(token)
+            exporter = self.exporter
+            if exporter is not None:  # Трассировку могли выключить, пока span был открыт
+                exporter.export(span)
+
+    @contextmanager
+    def trace(self, name: str, **attributes):
+        """
+        Открывает корневой span события, если событие попало в выборку.
+
+        Параметры:
+            name (str): Название события.
+            attributes: Метки span.
+
+        Возвращаемое значение:
+            Контекстный менеджер, выдающий Span или None (событие не попало в выборку).
+        """
+        if not self.sample_rate or random.random() >= self.sample_rate:
+            yield None
+            return
+        with self._run(Span(name, os.urandom(16).hex(), attributes=attributes)) as span:
+            yield span
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        """
+        Открывает дочерний span текущей трассы.
+
+        Параметры:
+            name (str): Название операции.
+            attributes: Метки span.
+
+        Возвращаемое значение:
+            Контекстный менеджер, выдающий Span или None (вне записываемой трассы).
+        """
+        parent = _current.get()
+        if parent is None:
+            yield None
+            return
+        with self._run(Span(name, parent.trace_id, parent.span_id, attributes)) as span:
+            yield span
+
+
+TRACER = Tracer()  # Трассировка процесса; по умолчанию выключена
+
+
+def configure(sample_rate: float, path: str = None, endpoint: str = None) -> Tracer:
+    """
+    Включает трассировку процесса.
+
+    Параметры:
+        sample_rate (float): Доля записываемых событий (0 - выключить).
+        path (str): Файл JSONL для span.
+        endpoint (str): Адрес коллектора OTLP/HTTP; используется вместо файла, если задан.
+
+    Возвращаемое значение:
+        Настроенный Tracer.
+    """
+    if TRACER.exporter is not None:
+        TRACER.exporter.close()
+    exporter = None
+    if sample_rate > 0:
+        exporter = OtlpExporter(endpoint) if endpoint else JsonlExporter(path or "traces.jsonl")
+    TRACER.exporter = exporter
+    TRACER.sample_rate = sample_rate if exporter is not None else 0.0
+    return TRACER
+
+
+def configure_from(settings: dict) -> Tracer:
+    """
+    Включает трассировку по настройкам из token.json, если в них задана доля событий.
+
+    Параметры:
+        settings (dict): Настройки с ключами trace_sample_rate, trace_file и trace_endpoint.
+
+    Возвращаемое значение:
+        Tracer процесса.
+    """
+    sample_rate = float(settings.get("trace_sample_rate") or 0)
+    if not sample_rate:
+        return TRACER
+    return configure(sample_rate, settings.get("trace_file"), settings.get("trace_endpoint") or None)
+
+
+def trace(name: str, **attributes):
+    """Открывает корневой span события в трассировке процесса (см. Tracer.trace)."""
+    return TRACER.trace(name, **attributes)
+
+
+def span(name: str, **attributes):
+    """Открывает дочерний span в трассировке процесса (см. Tracer.span)."""
+    return TRACER.span(name, **attributes)
+
+
+def current_context() -> contextvars.Context | None:
+    """
+    Возвращает копию контекста, если сейчас записывается трасса.
+
+    Нужна, чтобы работа, переданная в другой поток (отправка сообщения,
+    предзагрузка кандидата), попала в трассу породившего ее события.
+
+    Возвращаемое значение:
+        contextvars.Context или None вне записываемой трассы.
+    """
+    return contextvars.copy_context() if _current.get() is not None else None
+
+
+def close() -> None:
+    """Выгружает оставшиеся span (вызывается при остановке бота)."""
+    if TRACER.exporter is not None:
+        TRACER.exporter.close()